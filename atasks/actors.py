@@ -0,0 +1,403 @@
+"""
+ATasks stateful actors pinned to a worker
+
+An actor is an instance of the class living on one worker. Method calls
+are routed to this worker, and processed one by one against the in-memory state:
+
+    @actor
+    class Counter(object):
+        def __init__(self, start=0):
+            self.value = start
+
+        async def incr(self, n=1):
+            self.value += n
+            return self.value
+
+        async def passivate(self):
+            ...  # save the state before the actor is dropped
+
+    counter = await Counter.create(10)          # ActorRef
+    await counter.incr(5)                       # 15, processed by the worker holding the actor
+    user = await Counter.activate('user:42')    # the actor with the key, created if necessary
+    await user.passivate()                      # drop the actor
+
+Requests are sent with the actor key as the affinity key, and with the address
+of the worker holding the actor as the target for transports addressing workers.
+Workers drop the least recently used or idle actors when limits are exceeded,
+calling their `passivate()` method if defined. Calls of the dropped actor fail
+with `ActorNotFound` unless the actor is activated again.
+"""
+import asyncio
+import collections
+import functools
+import inspect
+import logging
+import threading
+import time
+import uuid
+
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActorNotFound(Exception):
+    """The actor is passivated, evicted, or held by another worker"""
+    pass
+
+
+class ActorRef(object):
+    """
+    Handle of the actor, calls methods of the actor on the worker holding it
+    """
+    __slots__ = ('name', 'key', 'owner', 'namespace')
+
+    def __init__(self, name, key, owner=None, namespace='default'):
+        """
+        Constructor
+
+        :param name: name of the actor class
+        :type name: str
+        :param key: key of the actor
+        :type key: str
+        :param owner: address of the worker holding the actor, None if workers are not addressable
+        :type owner: str
+        :param namespace: namespace of the actor class
+        :type namespace: str
+        """
+        self.name = name
+        self.key = key
+        self.owner = owner
+        self.namespace = namespace
+
+    def __getattr__(self, method):
+        """Coroutine function calling the method of the actor"""
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return functools.partial(self._call, method)
+
+    async def _call(self, method, *argv, **kwargs):
+        """Call the method of the actor"""
+        return await get_router(self.namespace).send_request(
+            '%s.call' % self.name, self.key, self.owner, method, argv, kwargs,
+        )
+
+    async def passivate(self):
+        """Drop the actor on the worker, calling its `passivate()` method if defined"""
+        return await get_router(self.namespace).send_request('%s.passivate' % self.name, self.key, self.owner)
+
+    def __reduce__(self):
+        """Pickle the handle"""
+        return ActorRef, (self.name, self.key, self.owner, self.namespace)
+
+    def __eq__(self, other):
+        """Compare handles"""
+        return isinstance(other, ActorRef) and (self.name, self.key, self.namespace) == (other.name, other.key, other.namespace)
+
+    def __hash__(self):
+        """Hash of the handle"""
+        return hash((self.name, self.key))
+
+    def __repr__(self):
+        """Representation of the handle"""
+        return 'ActorRef(%s:%s@%s/%s)' % (self.name, self.key, self.owner, self.namespace)
+
+
+class _Activation(object):
+    """
+    Actor living on the worker
+    """
+    __slots__ = ('instance', 'lock', 'used', 'loop')
+
+    def __init__(self, instance, loop):
+        """
+        Constructor
+
+        :param instance: instance of the actor class
+        :type instance: any
+        :param loop: event loop processing calls of the actor
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.instance = instance
+        self.lock = asyncio.Lock()
+        self.used = time.monotonic()
+        self.loop = loop
+
+
+async def _run_in(loop, coro):
+    """Run the coroutine in the loop of another thread"""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+class ActorTable(object):
+    """
+    Actors living on the worker
+
+    The least recently used actors are dropped when the number of actors exceeds the limit,
+    and actors not used longer than the idle time are dropped when other actors are used.
+    May be used from loops of several threads, the actor is processed by the loop it has been created in
+    while the loop is running.
+    """
+    def __init__(self, namespace='default', max_items=10000, idle_ttl=None):
+        """
+        Constructor
+
+        :param namespace: namespace where the table should be registered to work for
+        :type namespace: str
+        :param max_items: max number of actors
+        :type max_items: int
+        :param idle_ttl: time in seconds an actor is kept not used, unlimited by default
+        :type idle_ttl: float
+        """
+        namespaces.register(namespace, actors=self)
+        self.namespace = namespace
+        self.max_items = max_items
+        self.idle_ttl = idle_ttl
+        self._activations = collections.OrderedDict()  # (name, key): activation, least recently used first
+        self._lock = threading.Lock()  # guards activations
+
+    def __len__(self):
+        """Number of actors"""
+        return len(self._activations)
+
+    def __contains__(self, actor):
+        """Check whether the actor lives on this worker"""
+        return (actor.name, actor.key) in self._activations
+
+    async def activate(self, name, cls, key, argv, kwargs):
+        """
+        Create the actor unless it exists
+
+        :param name: name of the actor class
+        :type name: str
+        :param cls: actor class
+        :type cls: type
+        :param key: key of the actor
+        :type key: str
+        :param argv: positional parameters of the constructor
+        :param kwargs: named parameters of the constructor
+        """
+        with self._lock:
+            if (name, key) not in self._activations:
+                logger.debug('Activating the actor %s:%s', name, key)
+                self._activations[(name, key)] = _Activation(cls(*argv, **kwargs), asyncio.get_event_loop())
+            self._touch(name, key)
+        await self._evict()
+
+    async def call(self, name, key, method, argv, kwargs):
+        """
+        Call the method of the actor after other calls of the actor are finished
+
+        :param name: name of the actor class
+        :type name: str
+        :param key: key of the actor
+        :type key: str
+        :param method: name of the method
+        :type method: str
+        :param argv: positional parameters of the method
+        :param kwargs: named parameters of the method
+        :returns: result of the method
+        :raises ActorNotFound: if the actor doesn't live on this worker
+        """
+        with self._lock:
+            activation = self._touch(name, key)
+        if method.startswith('_'):
+            raise AttributeError(method)
+        if not self._adopt(activation):
+            return await _run_in(activation.loop, self.call(name, key, method, argv, kwargs))
+        async with activation.lock:
+            if self._get(name, key) is not activation:
+                raise ActorNotFound('%s:%s' % (name, key))
+            result = getattr(activation.instance, method)(*argv, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+        await self._evict()
+        return result
+
+    async def passivate(self, name, key):
+        """
+        Drop the actor after calls of the actor are finished, calling its `passivate()` method if defined
+
+        :param name: name of the actor class
+        :type name: str
+        :param key: key of the actor
+        :type key: str
+        :raises ActorNotFound: if the actor doesn't live on this worker
+        """
+        activation = self._get(name, key)
+        if activation is None:
+            raise ActorNotFound('%s:%s' % (name, key))
+        if not self._adopt(activation):
+            return await _run_in(activation.loop, self.passivate(name, key))
+        async with activation.lock:
+            with self._lock:
+                if self._activations.get((name, key), None) is not activation:
+                    return
+                del self._activations[(name, key)]
+            logger.debug('Passivating the actor %s:%s', name, key)
+            passivate = getattr(activation.instance, 'passivate', None)
+            if passivate is not None:
+                result = passivate()
+                if inspect.isawaitable(result):
+                    await result
+
+    def _adopt(self, activation):
+        """Check whether the actor is processed by the current loop, taking over the actor of the loop stopped"""
+        loop = asyncio.get_event_loop()
+        if activation.loop is loop:
+            return True
+        with self._lock:
+            if activation.loop.is_running():
+                return False
+            logger.debug('Actor of the loop stopped is taken over by %s', loop)
+            activation.loop = loop
+            activation.lock = asyncio.Lock()
+        return True
+
+    def _get(self, name, key):
+        """Get the actor holding the lock"""
+        with self._lock:
+            return self._activations.get((name, key), None)
+
+    def _touch(self, name, key):
+        """Mark the actor as used recently, called holding the lock"""
+        activation = self._activations.get((name, key), None)
+        if activation is None:
+            raise ActorNotFound('%s:%s' % (name, key))
+        activation.used = time.monotonic()
+        self._activations.move_to_end((name, key))
+        return activation
+
+    async def _evict(self):
+        """Drop the least recently used and idle actors"""
+        expires = time.monotonic() - self.idle_ttl if self.idle_ttl is not None else None
+        evicted = []
+        with self._lock:
+            for (name, key), activation in self._activations.items():
+                if len(self._activations) - len(evicted) <= self.max_items and (expires is None or activation.used > expires):
+                    break
+                if not activation.lock.locked():
+                    evicted.append((name, key))
+        for name, key in evicted:
+            logger.info('Evicting the actor %s:%s', name, key)
+            try:
+                await self.passivate(name, key)
+            except Exception as ex:
+                logger.error('Error passivating the actor %s:%s: %s', name, key, ex)
+
+
+def get_actors(namespace='default'):
+    """
+    Get or create the actor table for the namespace.
+
+    :param namespace: name of the namespace
+    :type namespace: str
+    :returns: actor table of the namespace
+    :rtype: ActorTable
+    """
+    ns = namespaces.get(namespace)
+    table = getattr(ns, 'actors', None)
+    if table is None:
+        table = ActorTable(namespace)
+    return table
+
+
+class ActorClass(object):
+    """
+    Actor class registered in the namespace, creates actors
+    """
+    def __init__(self, cls, name, namespace, options):
+        """
+        Constructor
+
+        :param cls: actor class
+        :type cls: type
+        :param name: name of the actor class
+        :type name: str
+        :param namespace: namespace of the registry
+        :type namespace: str
+        :param options: options of atasks processing actor requests, like `queue`
+        :type options: dict
+        """
+        self.cls = cls
+        self.name = name
+        self.namespace = namespace
+        router = get_router(namespace)
+        options = dict(options, affinity=lambda key, *argv: key, target=lambda key, owner=None, *argv: owner)
+        router.register_atask('%s.activate' % name, coro=self._atask(self._activate), options=dict(options, target=None))
+        router.register_atask('%s.call' % name, coro=self._atask(self._call), options=options)
+        router.register_atask('%s.passivate' % name, coro=self._atask(self._passivate), options=options)
+
+    async def create(self, *argv, **kwargs):
+        """
+        Create the actor having the unique key
+
+        :param argv: positional parameters of the constructor
+        :param kwargs: named parameters of the constructor
+        :returns: handle of the actor
+        :rtype: ActorRef
+        """
+        return await self.activate(uuid.uuid4().hex, *argv, **kwargs)
+
+    async def activate(self, key, *argv, **kwargs):
+        """
+        Get the actor having the key, creating it on the worker owning the key if necessary
+
+        :param key: key of the actor
+        :type key: str
+        :param argv: positional parameters of the constructor used if the actor is created
+        :param kwargs: named parameters of the constructor used if the actor is created
+        :returns: handle of the actor
+        :rtype: ActorRef
+        """
+        owner = await get_router(self.namespace).send_request('%s.activate' % self.name, key, argv, kwargs)
+        return ActorRef(self.name, key, owner, self.namespace)
+
+    def _atask(self, method):
+        """Coroutine function calling the method, defined by the module of the actor class for the manifest"""
+        async def _method(*argv, **kwargs):
+            return await method(*argv, **kwargs)
+
+        _method.__module__ = self.cls.__module__
+        return _method
+
+    async def _activate(self, key, argv, kwargs):
+        """Atask creating the actor on this worker"""
+        await get_actors(self.namespace).activate(self.name, self.cls, key, argv, kwargs)
+        server = get_router(self.namespace).server
+        return server.local_address() if server is not None else None
+
+    async def _call(self, key, owner, method, argv, kwargs):
+        """Atask calling the method of the actor living on this worker"""
+        return await get_actors(self.namespace).call(self.name, key, method, argv, kwargs)
+
+    async def _passivate(self, key, owner):
+        """Atask dropping the actor living on this worker"""
+        await get_actors(self.namespace).passivate(self.name, key)
+
+
+def actor(cls=None, name=None, namespace='default', **options):
+    """
+    Decorator for the actor class
+
+    May be used as `@actor` or `@actor(name=..., namespace=..., **options)`
+
+    :param cls: class to be decorated
+    :type cls: type
+    :param name: name of the actor class, module and name of the class by default
+    :type name: str
+    :param namespace: namespace of the registry
+    :type namespace: str
+    :param options: options of atasks processing actor requests, like `queue`
+    :type options: dict
+    :returns: actor class creating actors
+    :rtype: ActorClass
+    """
+    if cls is None:
+        return functools.partial(actor, name=name, namespace=namespace, **options)
+
+    name = '%s.%s' % (cls.__module__, cls.__name__) if name is None else name
+    logger.debug('actor: %s[%s/%s] %s', cls, name, namespace, options)
+    return ActorClass(cls, name, namespace, options)
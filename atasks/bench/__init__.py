@@ -0,0 +1,3 @@
+"""
+ATasks benchmark suite
+"""
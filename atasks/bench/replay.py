@@ -0,0 +1,216 @@
+"""
+ATasks trace replay load generator
+
+Regenerates the load recorded by `atasks.trace.Recorder` against any transport.
+Every atask found in the trace is registered as the synthetic atask imitating
+recorded requests: it sends nested calls with recorded offsets and sizes, waits
+for the rest of the recorded duration, and returns the response of the recorded size.
+All recorded times, inter-arrival times of top-level calls as well as offsets
+of nested calls and durations, are divided by the speed:
+
+    replay = Replay(Trace.load('client.trace.gz', 'worker.trace.gz'), speed=10)
+    replay.register()
+    ...
+    results = await replay.run()
+
+Workers should register the same trace with the same speed to serve synthetic atasks.
+Payloads are synthetic, and padded to sizes of recorded requests and responses.
+"""
+import asyncio
+import collections
+import itertools
+import logging
+
+from atasks.bench.runner import percentile
+from atasks.codecs import get_codec
+from atasks.namespaces import namespaces
+from atasks.refs import FETCH
+from atasks.router import get_router
+from atasks.trace import CALL, SERVE, read_trace
+
+
+logger = logging.getLogger(__name__)
+
+
+class Trace(object):
+    """
+    Events of one or more trace files
+    """
+    def __init__(self, events):
+        """
+        Constructor
+
+        :param events: events, ids should be unique
+        :type events: list
+        """
+        self.events = sorted((event for event in events if event.name != FETCH), key=lambda event: event.start)
+        self.children = collections.defaultdict(list)  # calls by id of the serve event sending them
+        for event in self.events:
+            if event.kind == CALL and event.parent is not None:
+                self.children[event.parent].append(event)
+
+    @classmethod
+    def load(cls, *paths):
+        """
+        Load trace files recorded by several processes
+
+        :param paths: names of trace files
+        :returns: the trace
+        :rtype: Trace
+        """
+        events = []
+        offset = 0
+        for path in paths:
+            loaded = read_trace(path)
+            for event in loaded:
+                event.id += offset
+                if event.parent is not None:
+                    event.parent += offset
+            offset = max([offset] + [event.id for event in loaded])
+            events += loaded
+        return cls(events)
+
+    def roots(self):
+        """
+        Top-level calls, or requests received if calls have not been recorded
+
+        :returns: events ordered by the start time
+        :rtype: list
+        """
+        roots = [event for event in self.events if event.kind == CALL and event.parent is None]
+        return roots or [event for event in self.events if event.kind == SERVE]
+
+    def templates(self):
+        """
+        Requests imitated by synthetic atasks
+
+        Requests received are imitated, or calls if requests received
+        with the same name have not been recorded.
+
+        :returns: lists of events by name
+        :rtype: dict
+        """
+        served = collections.defaultdict(list)
+        called = collections.defaultdict(list)
+        for event in self.events:
+            (served if event.kind == SERVE else called)[event.name].append(event)
+        return dict((name, served.get(name, None) or called[name]) for name in set(served) | set(called))
+
+
+class Replay(object):
+    """
+    Trace replay load generator
+    """
+    def __init__(self, trace, namespace='default', speed=1.0):
+        """
+        Constructor
+
+        :param trace: trace to be replayed
+        :type trace: Trace
+        :param namespace: namespace to register synthetic atasks and send calls in
+        :type namespace: str
+        :param speed: recorded times are divided by the speed
+        :type speed: float
+        """
+        self.trace = trace
+        self.namespace = namespace
+        self.speed = speed
+        self._templates = dict((name, itertools.cycle(events)) for name, events in trace.templates().items())
+        self._overheads = None
+
+    def register(self):
+        """Register synthetic atasks of the trace in the namespace, replacing atasks having the same names"""
+        router = get_router(self.namespace)
+        registry = namespaces.get(self.namespace).registry
+        for name, events in self.trace.templates().items():
+            if registry.get(name):
+                logger.debug('Replacing atask %s by the synthetic one', name)
+                registry.unregister(name)
+
+            async def _synthetic(payload, name=name):
+                return await self._imitate(name)
+
+            reply = any(event.response_size is not None for event in events)
+            router.register_atask(name, _synthetic, options={} if reply else {'reply': False})
+
+    async def run(self):
+        """
+        Send top-level calls of the trace
+
+        :returns: number of calls and errors, elapsed time in seconds,
+                  throughput in calls per second, mean and percentiles of latency in seconds
+        :rtype: dict
+        """
+        loop = asyncio.get_event_loop()
+        roots = self.trace.roots()
+        latencies = []
+        errors = []
+
+        async def _root(event):
+            started = loop.time()
+            try:
+                await self._call(event)
+            except Exception as ex:
+                errors.append(ex)
+            latencies.append(loop.time() - started)
+
+        calls = []
+        started = loop.time()
+        for event in roots:
+            delay = (event.start - roots[0].start) / self.speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            calls.append(asyncio.ensure_future(_root(event)))
+        await asyncio.gather(*calls)
+        elapsed = loop.time() - started
+        if errors:
+            logger.warning('%s of %s calls failed, f.e. %r', len(errors), len(roots), errors[0])
+        return {
+            'calls': len(roots),
+            'errors': len(errors),
+            'elapsed': elapsed,
+            'throughput': len(roots) / elapsed if elapsed else float('inf'),
+            'mean': sum(latencies) / len(latencies) if latencies else 0,
+            'p50': percentile(latencies, 0.5) if latencies else 0,
+            'p95': percentile(latencies, 0.95) if latencies else 0,
+            'p99': percentile(latencies, 0.99) if latencies else 0,
+        }
+
+    async def _call(self, event):
+        """Send the call with the synthetic payload of the recorded size"""
+        request, response = await self._overhead()
+        return await get_router(self.namespace).send_request(event.name, b'x' * max(0, event.size - request))
+
+    async def _imitate(self, name):
+        """Imitate the recorded request: send nested calls, wait, and return the response"""
+        loop = asyncio.get_event_loop()
+        template = next(self._templates[name])
+        started = loop.time()
+        calls = []  # recorded finish offsets and futures of nested calls
+        for child in self.trace.children.get(template.id, []):
+            offset = (child.start - template.start) / self.speed
+            # calls finished before this one started in the trace are awaited before sending it
+            finished = [future for end, future in calls if end <= offset]
+            if finished:
+                await asyncio.gather(*finished, return_exceptions=True)
+            delay = offset - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            calls.append((offset + (child.duration or 0) / self.speed, asyncio.ensure_future(self._call(child))))
+        if calls:
+            await asyncio.gather(*[future for end, future in calls], return_exceptions=True)
+        delay = (template.duration or 0) / self.speed - (loop.time() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request, response = await self._overhead()
+        return b'x' * max(0, (template.response_size or 0) - response)
+
+    async def _overhead(self):
+        """Sizes of the encoded request and response having empty payloads"""
+        if self._overheads is None:
+            codec = get_codec(self.namespace)
+            self._overheads = (
+                len(await codec.encode(((b'',), {}))),
+                len(await codec.encode((True, b''))),
+            )
+        return self._overheads
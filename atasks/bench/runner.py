@@ -0,0 +1,384 @@
+"""
+ATasks benchmark runner
+
+Measures throughput and latency percentiles of synthetic workloads and scenario
+atasks over every requested transport and codec, writes machine-readable results
+and compares them against a stored baseline.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import platform
+import time
+
+import atasks
+from atasks.codecs import PickleCodec
+from atasks.loader import load_module
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+
+
+logger = logging.getLogger(__name__)
+
+WORKLOADS = 'atasks.bench.workloads'  # module of workload atasks, imported by `Benchmark.run()`
+DEFAULT_SIZES = (10, 1000, 100000, 10000000, 100000000)
+DEFAULT_WIDTHS = (1, 10, 100)
+DEFAULT_DEPTHS = (1, 5, 20)
+DEFAULT_TRANSPORTS = ('loopback', 'threads', 'processes', 'sockets', 'memory')
+DEFAULT_METRICS = {
+    'throughput': -1,
+    'p50': 1,
+    'p95': 1,
+}
+
+CODECS = {
+    'pickle': PickleCodec,
+}
+
+
+def _loopback(namespace, **options):
+    """Create a loopback transport"""
+    from atasks.transport.base import LoopbackTransport
+    return LoopbackTransport(namespace)
+
+
+def _threads(namespace, **options):
+    """Create a thread pool transport"""
+    from atasks.transport.backends.threads import ThreadPoolTransport
+    return ThreadPoolTransport(namespace, workers=options.get('workers'))
+
+
+def _processes(namespace, **options):
+    """Create a process pool transport"""
+    from atasks.transport.backends.processes import ProcessPoolTransport
+    return ProcessPoolTransport(namespace, workers=options.get('workers'), modules=options.get('modules'))
+
+
+def _sockets(namespace, **options):
+    """Create a socket transport"""
+    from atasks.transport.backends.sockets import SocketTransport
+    return SocketTransport(namespace)
+
+
+def _amqp(namespace, **options):
+    """Create an AMQP transport"""
+    from atasks.transport.backends.amqp import AMQPTransport
+    return AMQPTransport(namespace, url=options.get('url') or 'amqp://localhost/')
+
+
+def _memory(namespace, **options):
+    """Create an AMQP transport over the in-memory broker"""
+    from atasks.transport.backends.amqp import AMQPTransport
+    from atasks.transport.memory import Broker
+    return AMQPTransport(namespace, driver=Broker(latency=options.get('latency', 0), bandwidth=options.get('bandwidth', None)))
+
+
+TRANSPORTS = {
+    'loopback': _loopback,
+    'threads': _threads,
+    'processes': _processes,
+    'sockets': _sockets,
+    'amqp': _amqp,
+    'memory': _memory,
+}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile
+
+    :param values: measured values
+    :type values: list
+    :param fraction: percentile as a fraction, f.e. 0.95
+    :type fraction: float
+    """
+    ordered = sorted(values)
+    index = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[max(0, min(len(ordered) - 1, index))]
+
+
+class Benchmark(object):
+    """
+    Benchmark runner
+    """
+    def __init__(
+        self,
+        transports=DEFAULT_TRANSPORTS,
+        codecs=tuple(CODECS),
+        sizes=DEFAULT_SIZES,
+        widths=DEFAULT_WIDTHS,
+        depths=DEFAULT_DEPTHS,
+        iterations=20,
+        scenario_iterations=3,
+        concurrency=1,
+        budget=100000000,
+        scenarios=(),
+        modules=(),
+        **options
+    ):
+        """
+        Constructor
+
+        :param transports: names of transports from `TRANSPORTS` to be measured
+        :type transports: list
+        :param codecs: names of codecs from `CODECS` to be measured
+        :type codecs: list
+        :param sizes: payload sizes in bytes for the echo workload
+        :type sizes: list
+        :param widths: numbers of parallel atasks for the fan-out workload
+        :type widths: list
+        :param depths: numbers of nested atasks for the nesting workload
+        :type depths: list
+        :param iterations: number of calls measured for every synthetic workload
+        :type iterations: int
+        :param scenario_iterations: number of calls measured for every scenario
+        :type scenario_iterations: int
+        :param concurrency: number of concurrent callers
+        :type concurrency: int
+        :param budget: max number of payload bytes sent for one workload, the number
+                       of iterations is reduced for large payloads to fit the budget
+        :type budget: int
+        :param scenarios: scenarios as (label, atask, argv) tuples
+        :type scenarios: list
+        :param modules: file or module names containing scenarios, passed to transport workers
+        :type modules: list
+        :param options: additional options passed to transport factories, like `url` or `workers`
+        :type options: dict
+        """
+        self.transports = transports
+        self.codecs = codecs
+        self.sizes = sizes
+        self.widths = widths
+        self.depths = depths
+        self.iterations = iterations
+        self.scenario_iterations = scenario_iterations
+        self.concurrency = concurrency
+        self.budget = budget
+        self.scenarios = scenarios
+        self.modules = modules
+        self.options = options
+
+    def workloads(self):
+        """
+        Workloads to be measured
+
+        :returns: list of workload name, parameter, number of iterations, and call factory
+        :rtype: list
+        """
+        from atasks.bench import workloads
+
+        ret = []
+        for size in self.sizes:
+            payload = b'x' * size
+            iterations = max(1, min(self.iterations, self.budget // max(size, 1)))
+            ret.append(('echo', size, iterations, lambda payload=payload: workloads.echo(payload)))
+        for width in self.widths:
+            ret.append(('fanout', width, self.iterations, lambda width=width: workloads.fanout(width, b'x')))
+        for depth in self.depths:
+            ret.append(('nest', depth, self.iterations, lambda depth=depth: workloads.nest(depth, b'x')))
+        for label, ref, argv in self.scenarios:
+            ret.append((label, None, self.scenario_iterations, lambda ref=ref, argv=argv: ref(*argv)))
+        return ret
+
+    async def run(self):
+        """
+        Run all benchmarks
+
+        Workload atasks are registered in their dedicated namespace, so the benchmark
+        doesn't interfere with atasks of the application.
+
+        :returns: list of results
+        :rtype: list
+        """
+        load_module(WORKLOADS)
+        results = []
+        for transport_name in self.transports:
+            for codec_name in self.codecs:
+                results += await self.run_one(transport_name, codec_name)
+        return results
+
+    async def run_one(self, transport_name, codec_name):
+        """
+        Run workloads using the transport and codec
+
+        Namespaces of workloads and scenarios get their own codec and transport for the run,
+        the codec and the transport of the namespace registered before are restored after the run.
+
+        :param transport_name: name of the transport from `TRANSPORTS`
+        :type transport_name: str
+        :param codec_name: name of the codec from `CODECS`
+        :type codec_name: str
+        :returns: list of results
+        :rtype: list
+        """
+        from atasks.bench.workloads import NAMESPACE
+
+        modules = {NAMESPACE: [WORKLOADS]}
+        for label, ref, argv in self.scenarios:
+            modules.setdefault(getattr(ref, 'namespace', 'default'), list(self.modules) or None)
+        saved = []
+        try:
+            for namespace, ns_modules in modules.items():
+                saved.append(await self._setup(namespace, transport_name, codec_name, ns_modules))
+            results = []
+            for workload, param, iterations, call in self.workloads():
+                result = await self.measure(call, iterations)
+                result.update(workload=workload, param=param, transport=transport_name, codec=codec_name)
+                logger.info('Measured %s', result)
+                results.append(result)
+        finally:
+            for namespace, transport, codec, server in reversed(saved):
+                await self._restore(namespace, transport, codec, server)
+        return results
+
+    async def _setup(self, namespace, transport_name, codec_name, modules):
+        """Activate the router of the namespace using the transport and codec, returns the state to be restored"""
+        ns = namespaces.get(namespace)
+        state = (namespace, getattr(ns, 'transport', None), getattr(ns, 'codec', None), get_router(namespace).server)
+        CODECS[codec_name](namespace)
+        transport = TRANSPORTS[transport_name](namespace, **dict(self.options, modules=modules))
+        await transport.connect()
+        await get_router(namespace).activate(transport)
+        return state
+
+    async def _restore(self, namespace, transport, codec, server):
+        """Deactivate the router of the namespace, restoring the transport, codec and server registered before"""
+        router = get_router(namespace)
+        measured = router.server
+        await router.deactivate()
+        if measured is not None:
+            await measured.disconnect()
+        namespaces.register(namespace, transport=transport, codec=codec)
+        if server is not None:
+            await router.activate(server)
+
+    async def measure(self, call, iterations):
+        """
+        Measure throughput and latency of the call
+
+        :param call: function returning an awaitable to be measured
+        :type call: callable
+        :param iterations: number of calls to be measured after one warming call
+        :type iterations: int
+        :returns: measured values
+        :rtype: dict
+        """
+        await call()
+        latencies = []
+        calls = iter(range(iterations))
+
+        async def _caller():
+            for i in calls:
+                started = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[_caller() for i in range(min(self.concurrency, iterations))])
+        elapsed = time.perf_counter() - started
+        return {
+            'iterations': iterations,
+            'throughput': iterations / elapsed if elapsed else float('inf'),
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
+
+
+def result_key(result):
+    """Key identifying the measured case of the result"""
+    return (result['workload'], result['param'], result['transport'], result['codec'])
+
+
+def write_results(path, results):
+    """
+    Write results to the JSON file
+
+    :param path: path to the file
+    :type path: str
+    :param results: results returned by the benchmark
+    :type results: list
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'meta': {
+                'atasks': atasks.__version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+            },
+            'results': results,
+        }, f, indent=2)
+
+
+def read_results(path):
+    """
+    Read results from the JSON file written by `write_results`
+
+    :param path: path to the file
+    :type path: str
+    :returns: results
+    :rtype: list
+    """
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, tolerance=0.2, metrics=DEFAULT_METRICS):
+    """
+    Compare results against the baseline
+
+    :param results: current results
+    :type results: list
+    :param baseline: baseline results
+    :type baseline: list
+    :param tolerance: relative change of the metric tolerated
+    :type tolerance: float
+    :param metrics: metrics to be compared, 1 if the greater value is worse, -1 if the lower one
+    :type metrics: dict
+    :returns: list of regressions
+    :rtype: list
+    """
+    baseline = dict((result_key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        base = baseline.get(result_key(result), None)
+        if base is None:
+            continue
+        for metric, sign in metrics.items():
+            if not base[metric]:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if change * sign > tolerance:
+                regressions.append({
+                    'key': result_key(result),
+                    'metric': metric,
+                    'baseline': base[metric],
+                    'current': result[metric],
+                    'change': change,
+                })
+    return regressions
+
+
+def format_results(results):
+    """
+    Format results as a text table
+
+    :param results: results returned by the benchmark
+    :type results: list
+    :returns: lines of the table
+    :rtype: list
+    """
+    lines = ['%-10s %-8s %-18s %10s %12s %10s %10s %10s' % (
+        'transport', 'codec', 'workload', 'param', 'calls/s', 'p50 ms', 'p95 ms', 'p99 ms'
+    )]
+    for result in results:
+        lines.append('%-10s %-8s %-18s %10s %12.1f %10.3f %10.3f %10.3f' % (
+            result['transport'], result['codec'], result['workload'],
+            '' if result['param'] is None else result['param'],
+            result['throughput'], result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000,
+        ))
+    return lines
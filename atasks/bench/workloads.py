@@ -0,0 +1,34 @@
+"""
+Synthetic benchmark atasks
+
+Registered in the dedicated namespace when the module is imported,
+by the benchmark runner and by workers of the measured transport.
+"""
+
+import asyncio
+
+from atasks.tasks import atask
+
+
+NAMESPACE = 'atasks.bench'
+
+
+@atask(namespace=NAMESPACE)
+async def echo(payload):
+    """Return the payload back"""
+    return payload
+
+
+@atask(namespace=NAMESPACE)
+async def fanout(width, payload):
+    """Await a number of echo atasks in parallel"""
+    returns = await asyncio.gather(*[echo(payload) for i in range(width)])
+    return len(returns)
+
+
+@atask(namespace=NAMESPACE)
+async def nest(depth, payload):
+    """Await the chain of nested atasks"""
+    if depth <= 1:
+        return payload
+    return await nest(depth - 1, payload)
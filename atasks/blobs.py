@@ -0,0 +1,359 @@
+"""
+ATasks content-addressed argument cache
+
+Large arguments passed to many calls, like a model config or a lookup table,
+are encoded and sent once per worker, if the atask is registered with the `blob_size` option:
+
+    @atask(blob_size=100000)
+    async def score(table, item):
+        ...
+
+    await asyncio.gather(*[score(table, item) for item in items])
+
+Arguments encoded to at least `blob_size` bytes are sent as digests of their encoded content.
+The client estimates the size of the argument without encoding it first, and encodes only
+arguments which may be large enough. The client caches encoded arguments by identity,
+so the same object is encoded once, and remembers large objects found to be small.
+Requests are sent to the worker chosen by the client transport if it balances requests itself,
+like the `SocketTransport` and the `ProcessPoolTransport`, so the client tracks contents sent
+to every worker. The first request passing the digest to the worker sends the content along
+with it, and concurrent requests passing the same digest to the same worker wait until
+the first one is responded. The worker caches decoded arguments by digest, and responds
+with `BlobMissing` to the request passing the digest it doesn't know, f.e. evicted, or sent
+to another worker chosen by the broker; the client sends the request again with contents
+of missing arguments then.
+
+Arguments passed this way should not be changed after the first call by the client,
+nor by atasks on the worker, because both sides reuse the same objects.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import sys
+import threading
+
+from atasks.codecs import get_codec
+from atasks.namespaces import namespaces
+from atasks.refs import RemoteRef
+
+
+logger = logging.getLogger(__name__)
+
+_SCALARS = (type(None), bool, int, float, complex, RemoteRef)
+_STRINGS = (str, bytes, bytearray)
+_SEQUENCES = (list, tuple, set, frozenset)
+_WALKED = 64  # min number of objects walked to estimate the size of the argument remembered as small
+
+
+class BlobMissing(Exception):
+    """The worker has no arguments with the digests in the cache"""
+    def __init__(self, digests):
+        """
+        Constructor
+
+        :param digests: digests of missing arguments
+        :type digests: list
+        """
+        super().__init__(digests)
+        self.digests = digests
+
+
+class Blob(object):
+    """
+    Argument passed by the digest of its encoded content
+    """
+    __slots__ = ('digest', 'content', 'inline')
+
+    def __init__(self, digest, content=None, inline=False):
+        """
+        Constructor
+
+        :param digest: digest of the encoded argument
+        :type digest: str
+        :param content: encoded argument, None if not known
+        :type content: bytes
+        :param inline: send the content along with the digest
+        :type inline: bool
+        """
+        self.digest = digest
+        self.content = content
+        self.inline = inline
+
+    def __reduce__(self):
+        """Pickle the digest, and the content if inline"""
+        return Blob, (self.digest, self.content if self.inline else None)
+
+    def __repr__(self):
+        """Representation of the blob"""
+        return 'Blob(%s)' % self.digest
+
+
+class BlobStore(object):
+    """
+    Arguments encoded by the client and decoded by the worker
+
+    The least recently used arguments are evicted when limits are exceeded.
+    May be used from any thread.
+    """
+    def __init__(self, namespace='default', max_items=256, max_bytes=256 * 1024 * 1024):
+        """
+        Constructor
+
+        :param namespace: namespace where the store should be registered to work for
+        :type namespace: str
+        :param max_items: max number of objects whose encoded content or small size is remembered
+                          by the client, and of digests whose content is known to be sent to every worker
+        :type max_items: int
+        :param max_bytes: max total size in bytes of encoded contents of arguments kept by the worker decoded
+        :type max_bytes: int
+        """
+        namespaces.register(namespace, blobs=self)
+        self.namespace = namespace
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._encoded = collections.OrderedDict()  # id of the object: (object, digest, content)
+        self._small = collections.OrderedDict()  # id of the object: (object, size in bytes it is smaller than)
+        self._sent = collections.OrderedDict()  # (target, digest): future done when the content is sent
+        self._decoded = collections.OrderedDict()  # digest: (object, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        """Check whether the decoded argument is kept"""
+        return digest in self._decoded
+
+    async def wrap(self, argv, kwargs, min_size, reply=True, target=None):
+        """
+        Replace large arguments by blobs
+
+        Blobs whose content has not been sent to the target yet are sent inline, the call should
+        pass their digests to the `sent()` when the request is responded.
+        Waits until the content is sent if another call is sending it to the same target.
+
+        :param argv: positional parameters of the call
+        :type argv: tuple
+        :param kwargs: named parameters of the call
+        :type kwargs: dict
+        :param min_size: min size in bytes of the encoded argument replaced by the blob
+        :type min_size: int
+        :param reply: whether the call is responded, contents of all blobs are sent inline otherwise
+        :type reply: bool
+        :param target: address of the worker the request is sent to, None if not known
+        :type target: str
+        :returns: positional and named parameters
+        :rtype: tuple
+        """
+        argv = [await self._wrap(value, min_size) for value in argv]
+        wrapped = {}
+        for key, value in kwargs.items():
+            wrapped[key] = await self._wrap(value, min_size)
+        if not reply:
+            # the worker can not ask for missing arguments
+            inline(argv, wrapped)
+            return argv, wrapped
+        sending = set()
+        for blob in blobs(argv, wrapped):
+            with self._lock:
+                future = self._sent.get((target, blob.digest), None)
+                if future is None:
+                    future = self._sent[(target, blob.digest)] = concurrent.futures.Future()
+                    sending.add(blob.digest)
+                    # contents being sent are never forgotten
+                    while len(self._sent) > self.max_items and next(iter(self._sent.values())).done():
+                        self._sent.popitem(last=False)
+                else:
+                    self._sent.move_to_end((target, blob.digest))
+            if blob.digest in sending:
+                blob.inline = True
+            elif not future.done():
+                await asyncio.wrap_future(future)
+        return argv, wrapped
+
+    def sent(self, digests, success, target=None):
+        """
+        Finish sending contents of blobs sent inline by the call
+
+        :param digests: digests of blobs sent inline by the call
+        :type digests: list
+        :param success: whether the request has been responded, so the content is known to be sent
+        :type success: bool
+        :param target: target passed to `wrap()`
+        :type target: str
+        """
+        for digest in set(digests):
+            with self._lock:
+                future = self._sent.get((target, digest), None)
+                if future is None or future.done():
+                    continue
+                if not success:
+                    # the next call sends the content again
+                    del self._sent[(target, digest)]
+            future.set_result(success)
+
+    async def unwrap(self, argv, kwargs):
+        """
+        Replace blobs by arguments
+
+        :param argv: positional parameters of the request
+        :type argv: list
+        :param kwargs: named parameters of the request
+        :type kwargs: dict
+        :returns: positional and named parameters
+        :rtype: tuple
+        :raises BlobMissing: if some arguments are neither cached nor sent with the request
+        """
+        with self._lock:
+            missing = [blob.digest for blob in blobs(argv, kwargs) if blob.content is None and blob.digest not in self._decoded]
+        if missing:
+            raise BlobMissing(missing)
+        argv = [await self._unwrap(value) for value in argv]
+        unwrapped = {}
+        for key, value in kwargs.items():
+            unwrapped[key] = await self._unwrap(value)
+        return argv, unwrapped
+
+    async def _wrap(self, value, min_size):
+        """Replace the argument by the blob if the argument is large enough"""
+        if isinstance(value, _SCALARS):
+            return value
+        with self._lock:
+            entry = self._encoded.get(id(value), None)
+            if entry is not None and entry[0] is value:
+                self._encoded.move_to_end(id(value))
+            else:
+                small = self._small.get(id(value), None)
+                if small is not None and small[0] is value and small[1] <= min_size:
+                    self._small.move_to_end(id(value))
+                    return value
+        if entry is None or entry[0] is not value:
+            size, walked = _estimate(value, min_size)
+            if size < min_size:
+                if walked >= _WALKED:
+                    # large object graphs are not walked again on every call
+                    self._remember_small(value, min_size)
+                return value
+            content = await get_codec(self.namespace).encode(value)
+            if content is None or len(content) < min_size:
+                self._remember_small(value, min_size)
+                return value
+            entry = (value, hashlib.blake2b(content, digest_size=16).hexdigest(), content)
+            with self._lock:
+                self._encoded[id(value)] = entry
+                while len(self._encoded) > self.max_items:
+                    self._encoded.popitem(last=False)
+        value, digest, content = entry
+        return Blob(digest, content)
+
+    def _remember_small(self, value, min_size):
+        """Remember the argument smaller than the size by identity"""
+        with self._lock:
+            self._small[id(value)] = (value, min_size)
+            while len(self._small) > self.max_items:
+                self._small.popitem(last=False)
+
+    async def _unwrap(self, value):
+        """Replace the blob by the cached or decoded argument"""
+        if not isinstance(value, Blob):
+            return value
+        with self._lock:
+            entry = self._decoded.get(value.digest, None)
+            if entry is not None:
+                self._decoded.move_to_end(value.digest)
+                return entry[0]
+        decoded = await get_codec(self.namespace).decode(value.content)
+        with self._lock:
+            if value.digest not in self._decoded:
+                self._decoded[value.digest] = (decoded, len(value.content))
+                self._size += len(value.content)
+            while self._size > self.max_bytes and len(self._decoded) > 1:
+                digest, (evicted, size) = self._decoded.popitem(last=False)
+                self._size -= size
+                logger.info('Argument %s evicted from the cache', digest)
+        return decoded
+
+
+def _estimate(value, limit):
+    """
+    Estimate the size of the encoded argument without encoding it
+
+    Strings are measured by their length, containers and objects by their items
+    and attributes, other values by their size in memory. Every container and object
+    is measured once. The estimation stops as soon as the limit is reached.
+
+    :param value: argument
+    :param limit: size in bytes which is enough to stop
+    :type limit: int
+    :returns: estimated size in bytes and number of objects walked
+    :rtype: tuple
+    """
+    size = 0
+    walked = 0
+    seen = set()
+    stack = [value]
+    while stack and size < limit:
+        value = stack.pop()
+        walked += 1
+        if not isinstance(value, _SCALARS + _STRINGS):
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+        if isinstance(value, _STRINGS):
+            size += len(value)
+        elif isinstance(value, _SEQUENCES):
+            size += len(value)
+            stack.extend(value)
+        elif isinstance(value, dict):
+            size += len(value)
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif hasattr(value, '__dict__') and not isinstance(value, type):
+            size += sys.getsizeof(value)
+            stack.extend(vars(value).values())
+        else:
+            size += sys.getsizeof(value)
+    return size, walked
+
+
+def blobs(argv, kwargs):
+    """
+    Blobs passed as parameters
+
+    :param argv: positional parameters
+    :param kwargs: named parameters
+    :returns: list of blobs
+    :rtype: list
+    """
+    return [value for value in itertools.chain(argv, kwargs.values()) if isinstance(value, Blob)]
+
+
+def inline(argv, kwargs, digests=None):
+    """
+    Send contents of blobs passed as parameters along with digests
+
+    :param argv: positional parameters
+    :param kwargs: named parameters
+    :param digests: digests of blobs to be sent with contents, all blobs by default
+    :type digests: list
+    """
+    for blob in blobs(argv, kwargs):
+        if digests is None or blob.digest in digests:
+            blob.inline = True
+
+
+def get_blobs(namespace='default'):
+    """
+    Get or create the blob store for the namespace.
+
+    :param namespace: name of the namespace
+    :type namespace: str
+    :returns: blob store of the namespace
+    :rtype: BlobStore
+    """
+    ns = namespaces.get(namespace)
+    store = getattr(ns, 'blobs', None)
+    if store is None:
+        store = BlobStore(namespace)
+    return store
@@ -0,0 +1,43 @@
+"""
+ATasks compatibility with older Python versions
+"""
+import asyncio
+import sys
+
+
+if sys.version_info < (3, 7):
+    # the backport of contextvars propagating the context to asyncio tasks
+    import aiocontextvars as contextvars
+else:
+    import contextvars
+
+
+__all__ = ['contextvars', 'current_task', 'task_coro']
+
+
+def current_task(loop=None):
+    """
+    Get the task running in the loop
+
+    :param loop: event loop, the current event loop by default
+    :type loop: asyncio.AbstractEventLoop
+    :returns: the task, or None if called outside of a task
+    :rtype: asyncio.Task
+    """
+    if sys.version_info < (3, 7):
+        return asyncio.Task.current_task(loop)
+    return asyncio.current_task(loop)
+
+
+def task_coro(task):
+    """
+    Get the coroutine wrapped by the task
+
+    :param task: the task
+    :type task: asyncio.Task
+    :returns: the coroutine object
+    """
+    if hasattr(task, 'get_coro'):
+        return task.get_coro()
+    # the attribute is not public before Python 3.8
+    return task._coro
@@ -0,0 +1,190 @@
+"""
+ATasks live introspection of requests in flight
+
+Lists atasks being processed by the worker and requests sent and awaiting responses,
+with ages, nesting parents and current await points of tasks processing them:
+
+    snapshot = introspect.snapshot()
+
+The snapshot is also served as JSON over HTTP for workers having no other
+way to be inspected:
+
+    server = await introspect.start_server('127.0.0.1', 7200, monitor=monitor)
+    ...
+    server.close()
+
+Routers keep requests in flight anyway, so the snapshot costs nothing until it is taken.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from atasks.compat import task_coro
+from atasks.namespaces import namespaces
+from atasks.transport.base import get_transport
+
+
+logger = logging.getLogger(__name__)
+
+_ASYNCIO = os.path.dirname(asyncio.__file__)
+
+
+def await_stack(task, limit=30):
+    """
+    Chain of coroutines the task is suspended in
+
+    :param task: task to be inspected
+    :type task: asyncio.Task
+    :param limit: max number of frames
+    :type limit: int
+    :returns: frames as `module:function:line` from the outermost to the await point,
+              and the type name of the awaited object
+    :rtype: tuple
+    """
+    frames = []
+    awaited = task_coro(task) if task is not None else None
+    while awaited is not None and len(frames) < limit:
+        frame = getattr(awaited, 'cr_frame', None) or getattr(awaited, 'gi_frame', None)
+        if frame is None:
+            break
+        if not frame.f_code.co_filename.startswith(_ASYNCIO):
+            frames.append('%s:%s:%s' % (frame.f_globals.get('__name__', '?'), frame.f_code.co_name, frame.f_lineno))
+        awaited = getattr(awaited, 'cr_await', None) or getattr(awaited, 'gi_yieldfrom', None)
+    return frames, type(awaited).__name__ if awaited is not None else None
+
+
+def describe(request, now, stack_limit=30):
+    """
+    Describe the request in flight
+
+    :param request: request being sent or received by the router
+    :type request: atasks.router.Request
+    :param now: current `time.monotonic()` value
+    :type now: float
+    :param stack_limit: max number of frames of the await stack
+    :type stack_limit: int
+    :returns: request id, name, age in seconds, id of the parent request,
+              await stack of the task and the awaited object type
+    :rtype: dict
+    """
+    frames, awaiting = await_stack(request.task, stack_limit) if stack_limit else ([], None)
+    return {
+        'id': request.id,
+        'name': request.name,
+        'age': now - request.started,
+        'parent': request.parent.id if request.parent is not None else None,
+        'await': frames[-1] if frames else None,
+        'awaiting': awaiting,
+        'stack': frames,
+    }
+
+
+def snapshot(namespace=None, stack_limit=30):
+    """
+    Requests in flight of routers
+
+    :param namespace: namespace of the router, all existing routers by default
+    :type namespace: str
+    :param stack_limit: max number of frames of await stacks, 0 to skip stacks
+    :type stack_limit: int
+    :returns: process id, and by namespace: number of requests received,
+              requests being served, requests sent by the router, and
+              requests in flight of the client transport with ids used by the transport
+    :rtype: dict
+    """
+    routers = [
+        ns.router for name, ns in namespaces.items()
+        if getattr(ns, 'router', None) and (namespace is None or name == namespace)
+    ]
+    now = time.monotonic()
+    ret = {}
+    for router in routers:
+        client = get_transport(router.namespace)
+        ret[router.namespace] = {
+            'requests': router.requests,
+            'serving': [describe(request, now, stack_limit) for request in list(router.serving.values())],
+            'sending': [describe(request, now, stack_limit) for request in list(router.sending.values())],
+            'transport': client.pending_requests() if client is not None else [],
+        }
+    return {'pid': os.getpid(), 'namespaces': ret}
+
+
+async def start_server(host='127.0.0.1', port=0, monitor=None, reuse_port=False):
+    """
+    Serve snapshots over HTTP
+
+    Every GET request is responded by the JSON snapshot of all routers, including
+    the snapshot of the loop lag monitor if passed. The `stack` query parameter
+    limits await stacks, f.e. `/?stack=0` skips them.
+
+    :param host: host to listen on
+    :type host: str
+    :param port: port to listen on, any free port by default
+    :type port: int
+    :param monitor: loop lag monitor of the worker
+    :type monitor: atasks.monitor.LoopMonitor
+    :param reuse_port: share the port with other processes
+    :type reuse_port: bool
+    :returns: started server
+    :rtype: asyncio.Server
+    """
+    async def _on_connection(reader, writer):
+        try:
+            line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            method, target = (line.decode('latin-1').split() + ['', ''])[:2]
+            if method != 'GET':
+                status, body = '405 Method Not Allowed', {'error': 'GET expected'}
+            else:
+                try:
+                    status, body = '200 OK', _query(target, monitor)
+                except ValueError as ex:
+                    status, body = '400 Bad Request', {'error': str(ex)}
+            content = json.dumps(body, indent=2, default=str).encode('utf-8')
+            writer.write(
+                (
+                    'HTTP/1.0 %s\r\nContent-Type: application/json\r\nContent-Length: %s\r\nConnection: close\r\n\r\n'
+                    % (status, len(content))
+                ).encode('latin-1') + content
+            )
+            await writer.drain()
+        except Exception as ex:
+            logger.error('Error serving the introspection request: %s', ex)
+        finally:
+            writer.close()
+
+    kw = {'reuse_port': True} if reuse_port and sys.platform != 'win32' else {}
+    server = await asyncio.start_server(_on_connection, host, port, **kw)
+    logger.info('Serving introspection on %s', ', '.join('%s:%s' % s.getsockname()[:2] for s in server.sockets))
+    return server
+
+
+def stack_limit(value):
+    """
+    Parse the `stack` query parameter
+
+    :param value: value of the parameter, None or empty if not passed
+    :type value: str
+    :returns: max number of frames of await stacks
+    :rtype: int
+    :raises ValueError: if the value is not a non-negative integer
+    """
+    if not value:
+        return 30
+    if not value.isdigit():
+        raise ValueError('stack: non-negative integer expected, got %r' % value)
+    return int(value)
+
+
+def _query(target, monitor):
+    """Snapshot for the HTTP request target"""
+    path, sep, query = target.partition('?')
+    params = dict(param.partition('=')[::2] for param in query.split('&') if param)
+    ret = snapshot(stack_limit=stack_limit(params.get('stack', None)))
+    if monitor is not None:
+        ret['loop'] = monitor.snapshot()
+    return ret
@@ -0,0 +1,34 @@
+"""
+ATasks module loader
+"""
+
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_module(name):
+    """
+    Load a module containing atasks.
+
+    :param name: file or module name
+    :type name: str
+    :returns: loaded module
+    :rtype: module
+    """
+    if os.path.exists(name) and os.path.isfile(name):
+        module_name = os.path.basename(name).rsplit('.', 1)[0]
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        logger.debug('Loading %s from %s', module_name, name)
+        spec = importlib.util.spec_from_file_location(module_name, name)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        return module
+    return importlib.import_module(name)
@@ -0,0 +1,157 @@
+"""
+ATasks manifest
+
+The manifest maps names of atasks to modules defining them. A worker
+registers atasks from the manifest without importing their modules, binds
+its queues immediately, and imports the module defining the atask only
+when the first request for the atask arrives.
+"""
+import asyncio
+import json
+import logging
+
+from atasks.loader import load_module
+from atasks.namespaces import namespaces
+from atasks.router import JobNotFound, get_router
+
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+def build_manifest(sources):
+    """
+    Build the manifest of atasks defined by modules
+
+    Modules are loaded if not loaded yet.
+
+    :param sources: file or module names
+    :type sources: list
+    :returns: manifest
+    :rtype: dict
+    """
+    modules = {}
+    for source in sources:
+        modules[load_module(source).__name__] = source
+    atasks = []
+    for namespace, ns in namespaces.items():
+        registry = getattr(ns, 'registry', None)
+        for name, item in registry.items() if registry else []:
+            module = getattr(item, 'source', None) or item.coro.__module__
+            if module == '__main__':
+                logger.warning('Atask %s defined in __main__ is not available in the manifest', name)
+                continue
+            atasks.append({
+                'namespace': namespace,
+                'name': name,
+                'source': modules.get(module, module),
+                'options': _options(item.options),
+            })
+    return {'version': VERSION, 'atasks': atasks}
+
+
+def write_manifest(path, manifest):
+    """
+    Write the manifest to the JSON file
+
+    :param path: path to the file
+    :type path: str
+    :param manifest: manifest returned by `build_manifest`
+    :type manifest: dict
+    """
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(path):
+    """
+    Read the manifest from the JSON file written by `write_manifest`
+
+    :param path: path to the file
+    :type path: str
+    :returns: manifest
+    :rtype: dict
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version', None) != VERSION:
+        raise ValueError('Unsupported manifest version: %s' % manifest.get('version', None))
+    return manifest
+
+
+def register_manifest(manifest):
+    """
+    Register atasks from the manifest without loading their modules
+
+    Atasks already registered are skipped.
+
+    :param manifest: manifest returned by `build_manifest` or `read_manifest`
+    :type manifest: dict
+    """
+    for entry in manifest['atasks']:
+        namespace, name = entry['namespace'], entry['name']
+        router = get_router(namespace)
+        if namespaces.get(namespace).registry.get(name):
+            continue
+        logger.debug('Registering lazy atask %s/%s from %s', namespace, name, entry['source'])
+        router.register_atask(name, coro=_lazy(namespace, name), options=entry['options'], source=entry['source'])
+
+
+def load_atask(namespace, name):
+    """
+    Load the module defining the lazy atask if not loaded yet
+
+    :param namespace: namespace of the atask
+    :type namespace: str
+    :param name: name of the atask
+    :type name: str
+    :returns: coroutine of the atask
+    :rtype: awaitable
+    """
+    registry = namespaces.get(namespace).registry
+    item = registry.get(name)
+    if item and getattr(item, 'source', None):
+        logger.info('Loading %s for the atask %s/%s', item.source, namespace, name)
+        load_module(item.source)
+        item = registry.get(name)
+    if not item or getattr(item, 'source', None):
+        raise JobNotFound(name)
+    return item.coro
+
+
+async def prewarm(manifest, interval=0):
+    """
+    Load modules of lazy atasks in background
+
+    :param manifest: manifest returned by `build_manifest` or `read_manifest`
+    :type manifest: dict
+    :param interval: interval in seconds between loading modules, passes requests arrived meanwhile
+    :type interval: float
+    """
+    for entry in manifest['atasks']:
+        item = namespaces.get(entry['namespace']).registry.get(entry['name'])
+        if item and getattr(item, 'source', None):
+            try:
+                load_atask(entry['namespace'], entry['name'])
+            except Exception as ex:
+                logger.error('Error while loading the atask %s: %s', entry['name'], ex)
+            await asyncio.sleep(interval)
+    logger.info('Prewarming finished')
+
+
+def _lazy(namespace, name):
+    """Coroutine loading the module of the atask on the first call"""
+    async def _coro(*argv, **kwargs):
+        return await load_atask(namespace, name)(*argv, **kwargs)
+
+    _coro.__qualname__ = 'lazy[%s/%s]' % (name, namespace)
+    return _coro
+
+
+def _options(options):
+    """Options of the atask to be stored in the manifest, functions are replaced by True"""
+    return dict(
+        (key, value if value is None or isinstance(value, (str, int, float, bool)) else True)
+        for key, value in options.items()
+    )
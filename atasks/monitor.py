@@ -0,0 +1,176 @@
+"""
+ATasks event loop lag monitor
+
+Measures the event loop scheduling lag and attributes loop stalls
+to atasks being processed when the loop has stalled:
+
+    monitor = LoopMonitor(threshold=0.1)
+    monitor.start()
+    ...
+    monitor.snapshot()
+
+The loop runs a ticker coroutine which measures how late it is woken up.
+A watchdog thread notices when the ticker has not been woken up for longer
+than the threshold, and samples the stack of the loop thread along with
+names of atasks processed by the task running at the moment.
+"""
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from atasks.compat import current_task
+from atasks.namespaces import namespaces
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class LoopMonitor(object):
+    """
+    Event loop lag monitor
+    """
+    def __init__(self, interval=0.05, threshold=0.1, buckets=DEFAULT_BUCKETS, max_stalls=100, samples=5, stack_limit=30):
+        """
+        Constructor
+
+        :param interval: interval in seconds between ticks measuring the lag
+        :type interval: float
+        :param threshold: lag in seconds considered as a stall of the loop
+        :type threshold: float
+        :param buckets: upper bounds in seconds of lag histogram buckets, the last bucket has no upper bound
+        :type buckets: list
+        :param max_stalls: number of recent stalls kept
+        :type max_stalls: int
+        :param samples: max number of stack samples taken during one stall
+        :type samples: int
+        :param stack_limit: max number of frames in the stack sample
+        :type stack_limit: int
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.buckets = tuple(buckets)
+        self.samples = samples
+        self.stack_limit = stack_limit
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.max_lag = 0
+        self.stalls = collections.deque(maxlen=max_stalls)
+        self._lock = threading.Lock()
+        self._stall = None
+        self._heartbeat = None
+        self._loop = None
+        self._thread_id = None
+        self._ticker = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start monitoring the running event loop"""
+        self._loop = asyncio.get_event_loop()
+        self._thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._ticker = asyncio.ensure_future(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name='atasks-monitor', daemon=True)
+        self._watchdog.start()
+        logger.info('Monitoring the loop lag with threshold %s', self.threshold)
+
+    async def stop(self):
+        """Stop monitoring"""
+        self._stopped.set()
+        self._ticker.cancel()
+        await asyncio.wait([self._ticker])
+        self._watchdog.join()
+
+    def snapshot(self):
+        """
+        Current state of the monitor
+
+        :returns: lag histogram as a list of bucket upper bound and count pairs,
+                  the max lag, and recent stalls with atasks and stack samples
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'histogram': [[bound, count] for bound, count in zip(self.buckets + (None,), self.counts)],
+                'max_lag': self.max_lag,
+                'stalls': [dict(stall, samples=list(stall['samples'])) for stall in self.stalls],
+            }
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the histogram bucket containing the percentile of lags
+
+        :param fraction: percentile as a fraction, f.e. 0.99
+        :type fraction: float
+        :returns: upper bound in seconds, or the max lag for the last bucket
+        :rtype: float
+        """
+        with self._lock:
+            total = sum(self.counts)
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if total and seen >= fraction * total:
+                    return bound
+            return self.max_lag
+
+    async def _tick(self):
+        """Measure the lag of waking up after sleeping for the interval"""
+        while True:
+            expected = self._loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0, self._loop.time() - expected)
+            with self._lock:
+                self._heartbeat = time.monotonic()
+                index = next((i for i, bound in enumerate(self.buckets) if lag <= bound), len(self.buckets))
+                self.counts[index] += 1
+                self.max_lag = max(self.max_lag, lag)
+                stall, self._stall = self._stall, None
+                if stall is not None:
+                    stall['duration'] = lag
+            if stall is not None:
+                logger.warning(
+                    'Loop stalled for %.3fs while processing %s:\n%s',
+                    lag, ', '.join(stall['atasks']) or 'no atasks', stall['samples'][0] if stall['samples'] else '',
+                )
+
+    def _watch(self):
+        """Watchdog thread body sampling the loop thread when the loop is stalled"""
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                stalled = time.monotonic() - self._heartbeat - self.interval
+                if stalled < self.threshold:
+                    continue
+                if self._stall is None:
+                    self._stall = {
+                        'started': time.time() - stalled,
+                        'duration': None,
+                        'atasks': self._atasks(),
+                        'samples': [],
+                    }
+                    self.stalls.append(self._stall)
+                if len(self._stall['samples']) < self.samples:
+                    self._stall['samples'].append(self._sample())
+
+    def _atasks(self):
+        """Names of atasks processed by the task currently running in the loop"""
+        task = current_task(self._loop)
+        names = []
+        for namespace, ns in namespaces.items():
+            router = getattr(ns, 'router', None)
+            running = getattr(router, 'running', {})
+            names += running.get(task, [])
+        return names
+
+    def _sample(self):
+        """Stack of the loop thread"""
+        frame = sys._current_frames().get(self._thread_id, None)
+        if frame is None:
+            return ''
+        return ''.join(traceback.format_stack(frame, limit=self.stack_limit))
@@ -0,0 +1,312 @@
+"""
+ATasks per-atask profiler
+
+Collects wall time, on-CPU time, and optionally allocations of every atask
+processed by the router. Atasks are interleaved in the event loop, so
+the profiler measures every step of the atask coroutine separately,
+and attributes the cost of the step to the atask:
+
+    profiler = Profiler(memory=True)
+    profiler.enable()
+    ...
+    profiler.disable()
+    profiler.stats()
+    profiler.dump('profile')
+
+Per-atask `cProfile` statistics are collected the same way step by step,
+and dumped as `pstats` files. Optionally, the stack of the loop thread is sampled
+with the interval, samples are attributed to the atask running at the moment,
+and dumped as folded stacks accepted by flame graph tools.
+"""
+import asyncio
+import collections
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+from atasks.compat import current_task
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+
+
+logger = logging.getLogger(__name__)
+
+_ASYNCIO = os.path.dirname(asyncio.__file__)
+
+if hasattr(time, 'thread_time'):
+    _cpu_time = time.thread_time
+else:
+    # CPU time of the whole process on Python 3.6, including other threads
+    _cpu_time = time.process_time
+
+
+class _Stats(object):
+    """
+    Aggregated statistics of an atask
+
+    Updated holding the lock, because the atask may be processed by loops of several threads.
+    """
+    __slots__ = ('calls', 'errors', 'wall', 'cpu', 'memory', 'profile', 'lock')
+
+    def __init__(self, profile):
+        """
+        Constructor
+
+        :param profile: collect `cProfile` statistics
+        :type profile: bool
+        """
+        self.calls = 0
+        self.errors = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.memory = 0
+        self.profile = cProfile.Profile() if profile else None
+        self.lock = threading.Lock()
+
+
+class _Profiled(object):
+    """
+    Awaitable driving the atask coroutine step by step and measuring every step
+    """
+    _local = threading.local()  # stack of profiles enabled in the thread
+
+    def __init__(self, coro, stats, memory):
+        """
+        Constructor
+
+        :param coro: coroutine object of the atask
+        :param stats: statistics of the atask
+        :type stats: _Stats
+        :param memory: measure allocations
+        :type memory: bool
+        """
+        self.coro = coro
+        self.stats = stats
+        self.memory = memory
+
+    def __await__(self):
+        """Drive the coroutine"""
+        started = time.perf_counter()
+        iterator = self.coro.__await__()
+        value, error = None, None
+        try:
+            while True:
+                try:
+                    yielded = self._step(iterator, value, error)
+                except StopIteration as ex:
+                    return ex.value
+                except BaseException:
+                    with self.stats.lock:
+                        self.stats.errors += 1
+                    raise
+                try:
+                    value, error = (yield yielded), None
+                except GeneratorExit:
+                    iterator.close()
+                    raise
+                except BaseException as ex:
+                    value, error = None, ex
+        finally:
+            with self.stats.lock:
+                self.stats.calls += 1
+                self.stats.wall += time.perf_counter() - started
+
+    def _step(self, iterator, value, error):
+        """Make one step of the coroutine measuring it"""
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = []
+        profile = self.stats.profile
+        if profile is not None:
+            if profiles:
+                profiles[-1].disable()
+            profiles.append(profile)
+            profile.enable()
+        memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        cpu = _cpu_time()
+        try:
+            if error is not None:
+                return iterator.throw(error)
+            return iterator.send(value)
+        finally:
+            cpu = _cpu_time() - cpu
+            memory = tracemalloc.get_traced_memory()[0] - memory if self.memory else 0
+            with self.stats.lock:
+                self.stats.cpu += cpu
+                self.stats.memory += memory
+            if profile is not None:
+                profile.disable()
+                profiles.pop()
+                if profiles:
+                    profiles[-1].enable()
+
+
+class Profiler(object):
+    """
+    Per-atask profiler
+    """
+    def __init__(self, sample_rate=1.0, memory=False, profile=True, interval=None, stack_limit=64):
+        """
+        Constructor
+
+        :param sample_rate: fraction of atask calls to be profiled
+        :type sample_rate: float
+        :param memory: measure allocations using `tracemalloc`
+        :type memory: bool
+        :param profile: collect `cProfile` statistics
+        :type profile: bool
+        :param interval: interval in seconds of sampling the loop thread stack, no sampling by default
+        :type interval: float
+        :param stack_limit: max number of frames in the stack sample
+        :type stack_limit: int
+        """
+        self.sample_rate = sample_rate
+        self.memory = memory
+        self.profile = profile
+        self.interval = interval
+        self.stack_limit = stack_limit
+        self.samples = collections.Counter()
+        self._stats = {}
+        self._routers = []
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._tracing = False
+        self._lock = threading.Lock()
+
+    def enable(self, namespace=None):
+        """
+        Start profiling atasks processed by routers
+
+        :param namespace: namespace of the router, all existing routers by default
+        :type namespace: str
+        """
+        routers = [get_router(namespace)] if namespace is not None else [
+            ns.router for name, ns in namespaces.items() if getattr(ns, 'router', None)
+        ]
+        for router in routers:
+            router.profiler = self
+        self._routers += routers
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.interval and self._sampler is None:
+            self._stopped.clear()
+            self._sampler = threading.Thread(
+                target=self._sample,
+                args=(asyncio.get_event_loop(), threading.get_ident()),
+                name='atasks-profiler',
+                daemon=True,
+            )
+            self._sampler.start()
+
+    def disable(self):
+        """Stop profiling"""
+        for router in self._routers:
+            if router.profiler is self:
+                router.profiler = None
+        self._routers = []
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        if self._sampler is not None:
+            self._stopped.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def wrap(self, name, coro):
+        """
+        Wrap the atask coroutine function to profile its calls
+
+        :param name: name of the atask
+        :type name: str
+        :param coro: coroutine function of the atask
+        :type coro: callable
+        :returns: coroutine function to be called instead
+        :rtype: callable
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return coro
+        with self._lock:
+            stats = self._stats.get(name, None)
+            if stats is None:
+                stats = self._stats[name] = _Stats(self.profile)
+
+        def _profiled(*argv, **kwargs):
+            return _Profiled(coro(*argv, **kwargs), stats, self.memory)
+
+        return _profiled
+
+    def stats(self):
+        """
+        Aggregated statistics
+
+        :returns: number of profiled calls and errors, total wall and CPU time in seconds,
+                  and net memory allocated in bytes if measured, by atask name
+        :rtype: dict
+        """
+        return dict(
+            (name, {
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'wall': stats.wall,
+                'cpu': stats.cpu,
+                'memory': stats.memory if self.memory else None,
+            })
+            for name, stats in self._stats.items()
+        )
+
+    def folded(self):
+        """
+        Stack samples as folded stacks accepted by flame graph tools
+
+        :returns: lines like `atask;module:function;module:function count`
+        :rtype: list
+        """
+        return ['%s %s' % (stack, count) for stack, count in sorted(self.samples.items())]
+
+    def dump(self, directory):
+        """
+        Dump statistics to the directory
+
+        Writes `stats.json` with aggregated statistics, `<atask>.pstats` files
+        with `cProfile` statistics of every atask, and `stacks.folded`
+        with stack samples if sampling is enabled.
+
+        :param directory: directory to write files to, created if necessary
+        :type directory: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'stats.json'), 'w') as f:
+            json.dump(self.stats(), f, indent=2)
+        for name, stats in self._stats.items():
+            if stats.profile is not None and stats.calls:
+                stats.profile.dump_stats(os.path.join(directory, '%s.pstats' % re.sub(r'[^\w.-]', '_', name)))
+        if self.interval:
+            with open(os.path.join(directory, 'stacks.folded'), 'w') as f:
+                f.writelines('%s\n' % line for line in self.folded())
+
+    def _sample(self, loop, thread_id):
+        """Sampler thread body taking samples of the loop thread stack"""
+        while not self._stopped.wait(self.interval):
+            task = current_task(loop)
+            names = []
+            for router in list(self._routers):
+                names += router.running.get(task, [])
+            frame = sys._current_frames().get(thread_id, None)
+            if not names or frame is None:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.stack_limit:
+                if frame.f_code.co_filename.startswith(_ASYNCIO):
+                    break
+                if frame.f_code.co_filename != __file__:
+                    frames.append('%s:%s' % (frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+                frame = frame.f_back
+            self.samples[';'.join([names[-1]] + frames[::-1])] += 1
@@ -0,0 +1,217 @@
+"""
+ATasks remote result references
+
+An atask registered with the `ref=True` option keeps its result in the object store
+of the worker, and returns a lightweight reference to the result instead:
+
+    @atask(ref=True)
+    async def load(path):
+        ...
+
+    @atask
+    async def transform(data):
+        ...
+
+    ref = await load('data.csv')         # RemoteRef, the data stays on the worker
+    ref = await transform(ref)           # the worker gets the data from the store
+    data = await resolve(ref)            # the data is passed to the caller
+
+The reference passed to another atask is resolved by the worker processing it.
+The request is sent to the worker holding the data if the transport addresses workers,
+otherwise the worker fetches the data directly from the worker holding it.
+Results are evicted from the store after the TTL, or when the store is full.
+"""
+import collections
+import logging
+import threading
+import time
+import uuid
+
+from atasks.namespaces import namespaces
+
+
+logger = logging.getLogger(__name__)
+
+FETCH = 'atasks.refs.fetch'  # name of the request fetching the result from the worker holding it
+
+
+class RefNotFound(Exception):
+    """The referenced result is expired, evicted or held by the unreachable worker"""
+    pass
+
+
+class RemoteRef(object):
+    """
+    Reference to the atask result kept in the object store of the worker
+    """
+    __slots__ = ('key', 'owner', 'namespace')
+
+    def __init__(self, key, owner=None, namespace='default'):
+        """
+        Constructor
+
+        :param key: key of the result in the object store
+        :type key: str
+        :param owner: address of the worker holding the result, None if workers are not addressable
+        :type owner: str
+        :param namespace: namespace of the object store
+        :type namespace: str
+        """
+        self.key = key
+        self.owner = owner
+        self.namespace = namespace
+
+    def __reduce__(self):
+        """Pickle the reference"""
+        return RemoteRef, (self.key, self.owner, self.namespace)
+
+    def __eq__(self, other):
+        """Compare references"""
+        return isinstance(other, RemoteRef) and (self.key, self.owner, self.namespace) == (other.key, other.owner, other.namespace)
+
+    def __hash__(self):
+        """Hash of the reference"""
+        return hash(self.key)
+
+    def __repr__(self):
+        """Representation of the reference"""
+        return 'RemoteRef(%s@%s/%s)' % (self.key, self.owner, self.namespace)
+
+
+class ObjectStore(object):
+    """
+    Store of results kept by the worker
+
+    Results are evicted after the TTL, and the least recently used
+    results are evicted when the number of results exceeds the limit.
+    May be used from any thread.
+    """
+    def __init__(self, namespace='default', ttl=300.0, max_items=1000):
+        """
+        Constructor
+
+        :param namespace: namespace where the store should be registered to work for
+        :type namespace: str
+        :param ttl: time in seconds to keep the result
+        :type ttl: float
+        :param max_items: max number of results kept
+        :type max_items: int
+        """
+        namespaces.register(namespace, store=self)
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = collections.OrderedDict()  # key: value, least recently used first
+        self._expires = collections.OrderedDict()  # key: expiration time, the earliest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of results kept"""
+        return len(self._items)
+
+    def __contains__(self, key):
+        """Check whether the result is kept"""
+        with self._lock:
+            self._expire()
+            return key in self._items
+
+    def put(self, value):
+        """
+        Keep the result
+
+        :param value: result to be kept
+        :type value: any
+        :returns: key of the result
+        :rtype: str
+        """
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._items[key] = value
+            self._expires[key] = time.monotonic() + self.ttl
+            while len(self._items) > self.max_items:
+                evicted, item = self._items.popitem(last=False)
+                del self._expires[evicted]
+                logger.info('Result %s evicted from the store', evicted)
+        return key
+
+    def get(self, key):
+        """
+        Get the result
+
+        :param key: key of the result
+        :type key: str
+        :returns: the result
+        :rtype: any
+        :raises RefNotFound: if the result is not kept
+        """
+        with self._lock:
+            self._expire()
+            if key not in self._items:
+                raise RefNotFound(key)
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def delete(self, key):
+        """
+        Forget the result
+
+        :param key: key of the result
+        :type key: str
+        """
+        with self._lock:
+            self._items.pop(key, None)
+            self._expires.pop(key, None)
+
+    def _expire(self):
+        """Evict expired results, all results have the same TTL, so they expire in order of keeping"""
+        now = time.monotonic()
+        while self._expires:
+            key, expires = next(iter(self._expires.items()))
+            if expires > now:
+                break
+            del self._expires[key]
+            del self._items[key]
+
+    async def fetch(self, key):
+        """
+        Coroutine processing the request fetching the result from this worker
+
+        :param key: key of the result
+        :type key: str
+        :returns: the result
+        :rtype: any
+        """
+        return self.get(key)
+
+
+def get_store(namespace='default'):
+    """
+    Get or create the object store for the namespace.
+
+    :param namespace: name of the namespace
+    :type namespace: str
+    :returns: object store of the namespace
+    :rtype: ObjectStore
+    """
+    ns = namespaces.get(namespace)
+    store = getattr(ns, 'store', None)
+    if store is None:
+        store = ObjectStore(namespace)
+    return store
+
+
+async def resolve(ref):
+    """
+    Get the referenced result
+
+    :param ref: reference to the result, other values are returned as is
+    :type ref: RemoteRef
+    :returns: the result
+    :rtype: any
+    :raises RefNotFound: if the result is not available anymore
+    """
+    if not isinstance(ref, RemoteRef):
+        return ref
+    from atasks.router import get_router
+    return await get_router(ref.namespace).resolve_ref(ref)
@@ -93,3 +93,12 @@ class Manager(object):
             ret = RegistryItem()
             self._registry[name] = ret
         return ret
+
+    def items(self):
+        """
+        Get all registered items
+
+        :returns: list of name and item pairs
+        :rtype: list
+        """
+        return list(self._registry.items())
@@ -2,16 +2,27 @@
 ATasks Router
 """
 
+import asyncio
+import itertools
 import logging
+import threading
+import time
 
+from atasks.blobs import BlobMissing, blobs, get_blobs, inline
 from atasks.codecs import get_codec
+from atasks.compat import contextvars, current_task
 from atasks.namespaces import namespaces
+from atasks.refs import FETCH, RefNotFound, RemoteRef, get_store
 from atasks.registry import Manager
 from atasks.transport.base import get_transport
+from atasks.transport.pending import Activity, _set_result
 
 
 logger = logging.getLogger(__name__)
 
+_ids = itertools.count(1)  # ids of requests sent and received, unique for the process
+_serving = contextvars.ContextVar('atasks_serving', default=None)  # request being served by the current context
+
 
 class NoClientTransportRegistered(Exception):
     """No client transport found in a namespace"""
@@ -33,6 +44,28 @@ class TransportError(Exception):
     pass
 
 
+class Request(object):
+    """
+    Request being sent or received by the router
+    """
+    __slots__ = ('id', 'name', 'parent', 'task', 'started')
+
+    def __init__(self, name):
+        """
+        Constructor
+
+        The request served in the current context, if any, becomes the parent of the request.
+
+        :param name: name of the atask
+        :type name: str
+        """
+        self.id = next(_ids)
+        self.name = name
+        self.parent = _serving.get()
+        self.task = current_task()
+        self.started = time.monotonic()
+
+
 class Router(object):
     """
     Router is a core atasks class which registers asynchronous tasks,
@@ -40,6 +73,11 @@ class Router(object):
     etc.
 
     It is registered in the namespace and uses codec and transport from it.
+
+    The router serves requests in event loops of all threads the server transport calls it from,
+    f.e. worker threads of the `ThreadPoolTransport`. Every request is processed in the loop
+    of the thread having received it, calls of batched atasks are collected per loop,
+    and the state shared among threads is guarded by the lock.
     """
     def __init__(self, namespace='default'):
         """
@@ -52,6 +90,17 @@ class Router(object):
         namespaces.register(namespace, router=self, registry=Manager(namespace, unite=False))
         self.namespace = namespace
         self.server = None
+        self._registering = {}  # futures registering atasks by the server transport, with their loops
+        self.requests = 0  # number of requests received by the server
+        self.activity = Activity()  # requests being processed by the server
+        self._limits = []  # futures awaiting the number of requests received, with their loops
+        self.running = {}  # names of atasks being processed by the server, by task processing them
+        self.profiler = None  # profiler wrapping atask coroutines, see `atasks.profiler`
+        self.recorder = None  # recorder of the request trace, see `atasks.trace`
+        self._batches = {}  # calls of batched atasks being collected, by atask name and loop
+        self.serving = {}  # requests being processed by the server, by request id
+        self.sending = {}  # requests sent and awaiting responses, by request id
+        self._lock = threading.Lock()  # guards the state shared among threads serving requests
 
     async def activate(self, server):
         """
@@ -82,6 +131,81 @@ class Router(object):
             await self.server.unregister_callback()
         self.server = None
 
+    @property
+    def active(self):
+        """Number of requests being processed by the server"""
+        return self.activity.count
+
+    def wait_requests(self, number):
+        """
+        Wait until the number of requests is received by the server
+
+        :param number: number of requests
+        :type number: int
+        :returns: future resolved when the number of requests is received
+        :rtype: asyncio.Future
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._limits.append((number, future, loop))
+            self._check_limits()
+        return future
+
+    async def _registered(self):
+        """Wait until atasks registered in loops of all threads are registered by the server transport"""
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            registering = list(self._registering.items())
+        waiters = []
+        for future, future_loop in registering:
+            if future_loop is loop:
+                waiters.append(future)
+            elif future_loop.is_running():
+                # futures can't be awaited in another loop, so the future of this loop is notified
+                waiter = loop.create_future()
+                future_loop.call_soon_threadsafe(
+                    future.add_done_callback, lambda _, waiter=waiter: loop.call_soon_threadsafe(_set_result, waiter, None),
+                )
+                waiters.append(waiter)
+        if waiters:
+            await asyncio.wait(waiters)
+
+    def _unregistering(self, future):
+        """Forget the future registering the atask by the server transport"""
+        with self._lock:
+            self._registering.pop(future, None)
+
+    def _check_limits(self):
+        """Resolve futures awaiting the number of requests received, called holding the lock"""
+        for limit in list(self._limits):
+            number, future, loop = limit
+            if self.requests >= number:
+                self._limits.remove(limit)
+                loop.call_soon_threadsafe(_set_result, future, self.requests)
+
+    async def drain(self, timeout=None):
+        """
+        Deactivate the server transport gracefully.
+
+        The server transport stops receiving requests immediately,
+        requests being processed are finished, and their responses are sent.
+
+        :param timeout: grace period in seconds, unlimited by default
+        :type timeout: float
+        :returns: True if all requests have been finished in the grace period
+        :rtype: bool
+        """
+        server = self.server
+        logger.info('Draining %s', server)
+        await self.deactivate()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        finished = await self.activity.wait(timeout)
+        if server and finished:
+            finished = await server.drain(max(0, deadline - loop.time()) if deadline is not None else None)
+        return finished
+
     async def send_request(self, name, *argv, **kwargs):
         """
         Send a request.
@@ -96,7 +220,8 @@ class Router(object):
         :type name: str
         :param argv: arbitrary positional parameters
         :param kwargs: arbitrary named parameters
-        :returns: success flag and job awaiting result, or exception in case of the exception handled
+        :returns: success flag and job awaiting result, or exception in case of the exception handled,
+                  None is returned immediately after sending for atasks having the `reply=False` option
         """
         logger.debug('Sending request %s %s %s', name, argv, kwargs)
         client = get_transport(self.namespace)
@@ -107,18 +232,103 @@ class Router(object):
         if not codec:
             raise NoCodecRegistered()
 
+        if self._registering:
+            # atasks registered by the server just now should be able to receive the request
+            await self._registered()
+
+        options = self._options(name)
+        hints = {}
+        if options.get('affinity', None):
+            hints['key'] = options['affinity'](*argv, **kwargs)
+        if not options.get('reply', True):
+            hints['reply'] = False
+        if options.get('target', None):
+            target = options['target'](*argv, **kwargs)
+            if target is not None:
+                hints['target'] = target
+        if 'key' not in hints and 'target' not in hints:
+            # send the request to the worker holding the referenced result
+            owner = next((ref.owner for ref in _refs(argv, kwargs) if ref.owner is not None), None)
+            if owner is not None:
+                hints['target'] = owner
+
+        sending, chosen = [], None
+        if options.get('blob_size', None):
+            store = get_blobs(self.namespace)
+            if hints.get('reply', True) and 'target' not in hints:
+                # large arguments are tracked for every worker chosen by the client
+                chosen = await client.choose_target(name, hints.get('key', None))
+                if chosen is not None:
+                    hints['target'] = chosen
+            target = hints.get('target', None)
+            argv, kwargs = await store.wrap(argv, kwargs, options['blob_size'], hints.get('reply', True), target)
+            if hints.get('reply', True):
+                sending = [blob.digest for blob in blobs(argv, kwargs) if blob.inline]
+
         content = await codec.encode((argv, kwargs))
-        logger.debug('Sending request %s using %s', name, client)
-        response = await client.send_request(name, content)
-        logger.debug('Response for %s returned', name)
-        if not response:
-            raise TransportError()
-        success, result = await codec.decode(response)
+        delivered = False
+        try:
+            response = await self._send(client, name, content, hints)
+            delivered = bool(response)
+            if not response and chosen is not None:
+                logger.debug('Sending request %s again to another worker than %s', name, chosen)
+                del hints['target']
+                inline(argv, kwargs)
+                response = await self._send(client, name, await codec.encode((argv, kwargs)), hints)
+            if not hints.get('reply', True):
+                logger.debug('Request %s sent with no reply', name)
+                return None
+            logger.debug('Response for %s returned', name)
+            if not response:
+                raise TransportError()
+            success, result = await codec.decode(response)
+            if not success and isinstance(result, BlobMissing) and blobs(argv, kwargs):
+                logger.debug('Sending request %s again with missing arguments %s', name, result.digests)
+                inline(argv, kwargs, result.digests)
+                response = await self._send(client, name, await codec.encode((argv, kwargs)), hints)
+                if not response:
+                    raise TransportError()
+                success, result = await codec.decode(response)
+        finally:
+            if sending:
+                # concurrent calls passing the same arguments to the same worker wait until the content is sent
+                store.sent(sending, delivered, target)
         logger.debug('Sending request %s response success = %s content: %s', name, success, result)
         if not success:
             raise result
         return result
 
+    async def _send(self, client, name, content, hints):
+        """
+        Send the encoded request using the transport, tracking and recording it
+        """
+        logger.debug('Sending request %s using %s', name, client)
+        recorder = self.recorder
+        event = recorder.call(name, len(content)) if recorder is not None else None
+        request = Request(name)
+        with self._lock:
+            self.sending[request.id] = request
+        try:
+            response = await client.send_request(name, content, **hints)
+        finally:
+            with self._lock:
+                del self.sending[request.id]
+        if recorder is not None:
+            recorder.finish(event, response if hints.get('reply', True) else None)
+        return response
+
+    def _options(self, name):
+        """
+        Options of the atask registered in the namespace, or empty options
+        """
+        item = namespaces.get(self.namespace).registry.get(name)
+        if item and getattr(item, 'source', None):
+            # options of the lazy atask refer to functions defined by the source
+            from atasks.manifest import load_atask
+            load_atask(self.namespace, name)
+            item = namespaces.get(self.namespace).registry.get(name)
+        return item.options if item else {}
+
     async def _on_request(self, name, content):
         """
         Callback receiving a request.
@@ -133,41 +343,178 @@ class Router(object):
         :type name: str
         :param content: content of the request
         :type content: bytes
-        :returns: encoded response
+        :returns: encoded response, or None for atasks having the `reply=False` option
         :rtype: bytes
         """
         logger.info('Request received %s', name)
+        self.activity.enter()
+        task = current_task()
+        request = Request(name)
+        with self._lock:
+            self.requests += 1
+            if self._limits:
+                self._check_limits()
+            stack = self.running.setdefault(task, [])
+            stack.append(name)
+            self.serving[request.id] = request
+        serving = _serving.set(request)
+        recorder = self.recorder
+        if recorder is not None:
+            event = recorder.serve(request, len(content))
+        response = None
+        try:
+            response = await self._process_request(name, content)
+            return response
+        finally:
+            if recorder is not None:
+                recorder.served(request, event, response)
+            _serving.reset(serving)
+            with self._lock:
+                del self.serving[request.id]
+                stack.pop()
+                if not stack:
+                    del self.running[task]
+            self.activity.leave()
+
+    async def _process_request(self, name, content):
+        """
+        Decode the request, await the job and encode the response
+        """
         codec = get_codec(self.namespace)
         if not codec:
             raise NoCodecRegistered()
 
         argv, kwargs = await codec.decode(content)
+        if blobs(argv, kwargs):
+            try:
+                argv, kwargs = await get_blobs(self.namespace).unwrap(argv, kwargs)
+            except BlobMissing as ex:
+                logger.debug('Request %s has missing arguments %s', name, ex.digests)
+                return await codec.encode((False, ex))
         item = namespaces.get(self.namespace).registry.get(name)
-        if not item:
-            raise JobNotFound(name)
-
-        coro = item.coro
-        options = item.options
+        if item:
+            coro, options = item.coro, item.options
+        elif name == FETCH:
+            coro, options = get_store(self.namespace).fetch, {}
+        else:
+            logger.error('Request %s for the atask not registered in %s', name, self.namespace)
+            return await codec.encode((False, JobNotFound(name)))
 
         logger.debug('Request received %s with %s %s', name, argv, kwargs)
-        success, result = await self._call_coro(coro, argv, kwargs, options)
+        if self.profiler is not None:
+            coro = self.profiler.wrap(name, coro)
+        if options.get('batch_size', None):
+            success, result = await self._call_batched(name, coro, argv, kwargs, options)
+        else:
+            success, result = await self._call_coro(coro, argv, kwargs, options)
+        if success and options.get('ref', False):
+            owner = self.server.local_address() if self.server else None
+            result = RemoteRef(get_store(self.namespace).put(result), owner, self.namespace)
+        if not options.get('reply', True):
+            if not success:
+                logger.error('Request %s with no reply failed: %s', name, result)
+            return None
         logger.debug('Request %s response returning success = %s: %s', name, success, result)
         response = await codec.encode((success, result))
         logger.info('Request %s response returning', name)
         return response
 
+    async def resolve_ref(self, ref):
+        """
+        Get the referenced result from the local object store, or from the worker holding it
+
+        :param ref: reference to the result
+        :type ref: RemoteRef
+        :returns: the result
+        :raises RefNotFound: if the result is not available anymore
+        """
+        store = get_store(self.namespace)
+        try:
+            return store.get(ref.key)
+        except RefNotFound:
+            local = self.server.local_address() if self.server else None
+            if ref.owner is None or ref.owner == local:
+                raise
+        logger.debug('Fetching %s', ref)
+        client = get_transport(self.namespace)
+        codec = get_codec(self.namespace)
+        response = await client.send_request(FETCH, await codec.encode(((ref.key,), {})), target=ref.owner)
+        if not response:
+            raise RefNotFound(ref.key)
+        success, result = await codec.decode(response)
+        if not success:
+            raise result
+        return result
+
     async def _call_coro(self, coro, argv, kwargs, options):
         """
         Calls coroutine and returns success flag and result or exception
         """
         try:
+            if _refs(argv, kwargs):
+                argv = [await self.resolve_ref(value) if isinstance(value, RemoteRef) else value for value in argv]
+                for k, value in kwargs.items():
+                    if isinstance(value, RemoteRef):
+                        kwargs[k] = await self.resolve_ref(value)
             result = await coro(*argv, **kwargs)
         except Exception as ex:
             return False, ex
 
         return True, result
 
-    def register_atask(self, name, coro=None, options={}):
+    async def _call_batched(self, name, coro, argv, kwargs, options):
+        """
+        Collects concurrent calls of the batched atask, calls the coroutine once
+        with the list of parameters, and returns success flag and result or exception of this call
+        """
+        if len(argv) != 1 or kwargs:
+            return False, TypeError('Batched atask %s accepts exactly one positional parameter' % name)
+        value = argv[0]
+        if isinstance(value, RemoteRef):
+            try:
+                value = await self.resolve_ref(value)
+            except Exception as ex:
+                return False, ex
+        loop = asyncio.get_event_loop()
+        key = (name, loop)
+        with self._lock:
+            batch = self._batches.get(key, None)
+            created = batch is None
+            if created:
+                batch = self._batches[key] = []
+        if created:
+            loop.call_later(options.get('batch_wait', 0), self._flush_batch, key, batch, coro)
+        future = loop.create_future()
+        batch.append((value, future))
+        if len(batch) >= options['batch_size']:
+            self._flush_batch(key, batch, coro)
+        return await future
+
+    def _flush_batch(self, key, batch, coro):
+        """Start processing the batch unless it has been started already"""
+        with self._lock:
+            if self._batches.get(key, None) is not batch:
+                return
+            del self._batches[key]
+        asyncio.ensure_future(self._call_batch(key[0], coro, batch))
+
+    async def _call_batch(self, name, coro, batch):
+        """Call the coroutine with the batch of parameters and scatter results to calls"""
+        logger.debug('Calling %s with the batch of %s', name, len(batch))
+        success, results = await self._call_coro(coro, [[value for value, future in batch]], {}, {})
+        if success and (not isinstance(results, (list, tuple)) or len(results) != len(batch)):
+            success, results = False, TypeError('Batched atask %s should return the list of %s results' % (name, len(batch)))
+        for i, (value, future) in enumerate(batch):
+            if future.done():
+                continue
+            if not success:
+                future.set_result((False, results))
+            elif isinstance(results[i], Exception):
+                future.set_result((False, results[i]))
+            else:
+                future.set_result((True, results[i]))
+
+    def register_atask(self, name, coro=None, options={}, source=None):
         """
         Register atask in the registry.
 
@@ -179,22 +526,45 @@ class Router(object):
         :type coro: awaitable
         :param options: registering additional options passed from atask decorator
         :type options: dict
+        :param source: file or module name defining the atask, registers a lazy atask
+                       replaced by the real one when the source is loaded
+        :type source: str
         :returns: network reference stub to await atask remotely
         :rtype: awaitable
         """
         namespace = self.namespace
 
-        namespaces.get(namespace).registry.register(name, coro=coro, options=options)
+        registry = namespaces.get(namespace).registry
+        item = registry.get(name)
+        if item and getattr(item, 'source', None) and not source:
+            logger.debug('Replacing lazy atask %s', name)
+            registry.unregister(name)
+        if source:
+            registry.register(name, coro=coro, options=options, source=source)
+        else:
+            registry.register(name, coro=coro, options=options)
+        if self.server:
+            future = asyncio.ensure_future(self.server.register_atask(name, options))
+            with self._lock:
+                self._registering[future] = asyncio.get_event_loop()
+            future.add_done_callback(self._unregistering)
 
         async def aioref(*argv, **kwargs):
             result = await get_router(namespace).send_request(name, *argv, **kwargs)
             return result
 
         aioref.__qualname__ = 'ref[%s/%s]' % (name, namespace)
+        aioref.atask_name = name
+        aioref.namespace = namespace
         logger.info('Registered %s', aioref)
         return aioref
 
 
+def _refs(argv, kwargs):
+    """References to results passed as parameters"""
+    return [value for value in itertools.chain(argv, kwargs.values()) if isinstance(value, RemoteRef)]
+
+
 def get_router(namespace='default'):
     """
     Get or create a router for the namespace.
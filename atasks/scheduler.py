@@ -0,0 +1,430 @@
+"""
+ATasks delayed and scheduled calls
+
+Calls of atasks are scheduled on the worker instead of parking the coroutine
+in `asyncio.sleep()`:
+
+    timer = await call_later(60, retry_payment, order_id)
+    timer = await call_at(time.time() + 3600, send_reminder, user_id)
+    await cancel(timer)
+
+The schedule request is sent to the worker through the transport, and is acknowledged
+as soon as the worker has put the timer into its hierarchical timer wheel, inserting timers
+in constant time. The due call is sent by the worker through the router as any other call,
+so it may be processed by any worker. The draining worker sends its timers to other workers
+using `handover()`; timers of the crashed worker are lost.
+
+Workers serve schedule requests for the namespace having the `Scheduler` created.
+"""
+import asyncio
+import logging
+import math
+import time
+import uuid
+
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE = 'atasks.scheduler.schedule'  # name of the request scheduling the call
+CANCEL = 'atasks.scheduler.cancel'  # name of the request cancelling the scheduled call
+
+
+class TimerRef(object):
+    """
+    Handle of the scheduled call
+    """
+    __slots__ = ('id', 'owner', 'namespace')
+
+    def __init__(self, id, owner=None, namespace='default'):
+        """
+        Constructor
+
+        :param id: id of the timer
+        :type id: str
+        :param owner: address of the worker holding the timer, None if workers are not addressable
+        :type owner: str
+        :param namespace: namespace of the scheduler
+        :type namespace: str
+        """
+        self.id = id
+        self.owner = owner
+        self.namespace = namespace
+
+    def __reduce__(self):
+        """Pickle the handle"""
+        return TimerRef, (self.id, self.owner, self.namespace)
+
+    def __repr__(self):
+        """Representation of the handle"""
+        return 'TimerRef(%s@%s/%s)' % (self.id, self.owner, self.namespace)
+
+
+class _Timer(object):
+    """
+    Scheduled call
+    """
+    __slots__ = ('id', 'tick', 'when', 'name', 'argv', 'kwargs', 'cancelled')
+
+    def __init__(self, id, tick, when, name, argv, kwargs):
+        """
+        Constructor
+
+        :param id: id of the timer
+        :type id: str
+        :param tick: tick of the timer wheel the call is due at
+        :type tick: int
+        :param when: time of the call as returned by `time.time()`
+        :type when: float
+        :param name: name of the atask
+        :type name: str
+        :param argv: positional parameters of the call
+        :param kwargs: named parameters of the call
+        """
+        self.id = id
+        self.tick = tick
+        self.when = when
+        self.name = name
+        self.argv = argv
+        self.kwargs = kwargs
+        self.cancelled = False
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel
+
+    Every level has the number of slots, a slot of the level covers all slots of the previous level.
+    The timer is put into the slot of the lowest level covering its tick, and moved to lower levels
+    when the wheel reaches the slot. Timers behind the highest level wait in the overflow list.
+    The empty wheel is moved to any tick at once.
+    """
+    def __init__(self, slots=256, levels=4):
+        """
+        Constructor
+
+        :param slots: number of slots of every level
+        :type slots: int
+        :param levels: number of levels
+        :type levels: int
+        """
+        self.slots = slots
+        self.levels = levels
+        self.tick = 0  # the current tick
+        self._wheels = [[[] for i in range(slots)] for level in range(levels)]
+        self._spans = [slots ** level for level in range(levels + 1)]  # ticks covered by the slot of the level
+        self._overflow = []
+        self._due = []
+        self._count = 0
+
+    def __len__(self):
+        """Number of timers in the wheel"""
+        return self._count
+
+    def add(self, timer):
+        """
+        Add the timer
+
+        :param timer: timer having the tick
+        :type timer: _Timer
+        """
+        self._count += 1
+        self._insert(timer)
+
+    def clear(self):
+        """Drop all timers"""
+        self._wheels = [[[] for i in range(self.slots)] for level in range(self.levels)]
+        self._overflow = []
+        self._due = []
+        self._count = 0
+
+    def _insert(self, timer):
+        """Put the timer into the slot covering its tick"""
+        delta = timer.tick - self.tick
+        if delta <= 0:
+            self._due.append(timer)
+            return
+        for level in range(self.levels):
+            if delta < self._spans[level + 1]:
+                self._wheels[level][(timer.tick // self._spans[level]) % self.slots].append(timer)
+                return
+        self._overflow.append(timer)
+
+    def advance(self, tick):
+        """
+        Move the wheel to the tick
+
+        :param tick: the current tick
+        :type tick: int
+        :returns: timers due at ticks passed
+        :rtype: list
+        """
+        due, self._due = self._due, []
+        while self.tick < tick and self._count > len(due):
+            self.tick += 1
+            for level in range(1, self.levels + 1):
+                if self.tick % self._spans[level]:
+                    break
+                if level == self.levels:
+                    timers, self._overflow = self._overflow, []
+                else:
+                    index = (self.tick // self._spans[level]) % self.slots
+                    timers, self._wheels[level][index] = self._wheels[level][index], []
+                for timer in timers:
+                    self._insert(timer)
+            index = self.tick % self.slots
+            due += self._wheels[0][index]
+            self._wheels[0][index] = []
+            due += self._due
+            self._due = []
+        self.tick = max(self.tick, tick)
+        self._count -= len(due)
+        return due
+
+    def timers(self):
+        """
+        All timers of the wheel
+
+        :returns: list of timers
+        :rtype: list
+        """
+        timers = self._due + self._overflow
+        for wheel in self._wheels:
+            for timers_of_slot in wheel:
+                timers += timers_of_slot
+        return timers
+
+
+class Scheduler(object):
+    """
+    Scheduler of calls processed by the worker
+    """
+    def __init__(self, namespace='default', resolution=0.05, slots=256, levels=4):
+        """
+        Constructor
+
+        Registers atasks processing schedule requests in the namespace.
+
+        :param namespace: namespace where the scheduler should be registered to work for
+        :type namespace: str
+        :param resolution: duration of the tick in seconds, calls are sent not later than the tick after due
+        :type resolution: float
+        :param slots: number of slots of every level of the timer wheel
+        :type slots: int
+        :param levels: number of levels of the timer wheel, timers later than `resolution * slots ** levels`
+                       seconds wait in the overflow list
+        :type levels: int
+        """
+        namespaces.register(namespace, scheduler=self)
+        self.namespace = namespace
+        self.resolution = resolution
+        self.wheel = TimerWheel(slots, levels)
+        self._timers = {}  # pending timers by id
+        self._origin = time.time()
+        self._task = None
+        self._wakeup = None
+
+        async def _schedule(when, name, argv, kwargs, timer_id=None):
+            timer_id = self.add(when, name, argv, kwargs, timer_id)
+            server = get_router(namespace).server
+            return timer_id, server.local_address() if server is not None else None
+
+        async def _cancel(timer_id, owner=None):
+            return self.cancel(timer_id)
+
+        router = get_router(namespace)
+        router.register_atask(SCHEDULE, coro=_schedule)
+        router.register_atask(CANCEL, coro=_cancel, options={'target': lambda timer_id, owner=None: owner})
+
+    def __len__(self):
+        """Number of pending timers"""
+        return len(self._timers)
+
+    def add(self, when, name, argv=(), kwargs={}, timer_id=None):
+        """
+        Schedule the call processed by this worker
+
+        :param when: time of the call as returned by `time.time()`
+        :type when: float
+        :param name: name of the atask
+        :type name: str
+        :param argv: positional parameters of the call
+        :param kwargs: named parameters of the call
+        :param timer_id: id of the timer, unique id by default
+        :type timer_id: str
+        :returns: id of the timer
+        :rtype: str
+        """
+        timer_id = timer_id or uuid.uuid4().hex
+        tick = math.ceil((when - self._origin) / self.resolution)
+        timer = _Timer(timer_id, tick, when, name, argv, kwargs)
+        self._timers[timer_id] = timer
+        if not len(self.wheel):
+            self.wheel.advance(self._tick())
+        self.wheel.add(timer)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        elif self._wakeup is not None:
+            self._wakeup.set()
+        return timer_id
+
+    def cancel(self, timer_id):
+        """
+        Cancel the call scheduled on this worker
+
+        :param timer_id: id of the timer
+        :type timer_id: str
+        :returns: True if the call has been pending
+        :rtype: bool
+        """
+        timer = self._timers.pop(timer_id, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        return True
+
+    async def handover(self, timeout=None, batch=1000):
+        """
+        Send pending timers to other workers, f.e. when this worker is draining
+
+        :param timeout: time in seconds to wait for other workers accepting timers, unlimited by default
+        :type timeout: float
+        :param batch: max number of timers sent concurrently
+        :type batch: int
+        :returns: number of timers accepted by other workers
+        :rtype: int
+        """
+        timers = [timer for timer in self.wheel.timers() if not timer.cancelled]
+        self.stop()
+        self.wheel = TimerWheel(self.wheel.slots, self.wheel.levels)
+        self._timers = {}
+        router = get_router(self.namespace)
+        accepted = 0
+
+        async def _handover(timer):
+            try:
+                await router.send_request(SCHEDULE, timer.when, timer.name, timer.argv, timer.kwargs, timer.id)
+                return 1
+            except Exception as ex:
+                logger.error('Error sending the timer %s of %s: %s', timer.id, timer.name, ex)
+                return 0
+
+        async def _send_all():
+            nonlocal accepted
+            for start in range(0, len(timers), batch):
+                accepted += sum(await asyncio.gather(*[_handover(timer) for timer in timers[start:start + batch]]))
+
+        try:
+            await asyncio.wait_for(_send_all(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('%s of %s timers not accepted by other workers in %ss', len(timers) - accepted, len(timers), timeout)
+        logger.info('%s timers sent to other workers', accepted)
+        return accepted
+
+    def stop(self):
+        """Stop sending due calls"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        """Send due calls every tick while timers are pending"""
+        self._wakeup = asyncio.Event()
+        while True:
+            if not self._timers:
+                self.wheel.clear()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            tick = self._tick()
+            for timer in self.wheel.advance(tick):
+                if timer.cancelled:
+                    continue
+                del self._timers[timer.id]
+                asyncio.ensure_future(self._send(timer))
+            await asyncio.sleep(max(0, self._origin + (tick + 1) * self.resolution - time.time()))
+
+    def _tick(self):
+        """The current tick of the timer wheel"""
+        return math.floor((time.time() - self._origin) / self.resolution)
+
+    async def _send(self, timer):
+        """Send the due call"""
+        logger.debug('Sending the call %s scheduled at %s', timer.name, timer.when)
+        try:
+            await get_router(self.namespace).send_request(timer.name, *timer.argv, **timer.kwargs)
+        except Exception as ex:
+            logger.error('Scheduled call %s failed: %s', timer.name, ex)
+
+
+def get_scheduler(namespace='default'):
+    """
+    Get or create the scheduler for the namespace.
+
+    :param namespace: name of the namespace
+    :type namespace: str
+    :returns: scheduler of the namespace
+    :rtype: Scheduler
+    """
+    ns = namespaces.get(namespace)
+    scheduler = getattr(ns, 'scheduler', None)
+    if scheduler is None:
+        scheduler = Scheduler(namespace)
+    return scheduler
+
+
+def _atask_name(atask):
+    """Name and namespace of the atask passed as the reference or the name in the default namespace"""
+    if isinstance(atask, str):
+        return atask, 'default'
+    return atask.atask_name, atask.namespace
+
+
+async def call_at(_when, _atask, *argv, **kwargs):
+    """
+    Schedule the call of the atask
+
+    :param _when: time of the call as returned by `time.time()`
+    :type _when: float
+    :param _atask: reference returned by the `atask` decorator, or the name of the atask in the default namespace
+    :type _atask: awaitable
+    :param argv: positional parameters of the call
+    :param kwargs: named parameters of the call
+    :returns: handle of the scheduled call
+    :rtype: TimerRef
+    """
+    name, namespace = _atask_name(_atask)
+    timer_id, owner = await get_router(namespace).send_request(SCHEDULE, _when, name, argv, kwargs)
+    return TimerRef(timer_id, owner, namespace)
+
+
+async def call_later(_delay, _atask, *argv, **kwargs):
+    """
+    Schedule the call of the atask after the delay
+
+    :param _delay: delay in seconds
+    :type _delay: float
+    :param _atask: reference returned by the `atask` decorator, or the name of the atask in the default namespace
+    :type _atask: awaitable
+    :param argv: positional parameters of the call
+    :param kwargs: named parameters of the call
+    :returns: handle of the scheduled call
+    :rtype: TimerRef
+    """
+    return await call_at(time.time() + _delay, _atask, *argv, **kwargs)
+
+
+async def cancel(timer):
+    """
+    Cancel the scheduled call
+
+    The cancel request reaches the worker holding the timer only if the transport addresses workers,
+    or the worker is the only one.
+
+    :param timer: handle of the scheduled call
+    :type timer: TimerRef
+    :returns: True if the call has been pending
+    :rtype: bool
+    """
+    return await get_router(timer.namespace).send_request(CANCEL, timer.id, timer.owner)
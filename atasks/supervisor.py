@@ -0,0 +1,246 @@
+"""
+ATasks worker process supervisor
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_retirement = None  # connection to the supervisor and index of the worker in the worker process
+
+
+class Supervisor(object):
+    """
+    Supervisor starting and restarting a number of worker processes
+
+    Modules imported before starting the supervisor are shared with workers
+    when the `fork` start method is used. Every worker calls the target function
+    with the index of the worker. A worker exited with zero code is restarted
+    immediately, f.e. when it has processed the max number of requests.
+    A crashed worker is restarted after the delay. A worker going to exit
+    may call `retire()` to get the replacement started while it finishes its work.
+
+    The supervisor stops all workers on SIGINT, SIGTERM or SIGQUIT
+    passing SIGTERM to them.
+
+    On SIGHUP the supervisor reloads workers without downtime: new workers
+    are started first, and old workers get SIGTERM after the reload delay,
+    so they finish requests being processed while new workers already receive requests.
+    Modules not imported by the supervisor itself are imported by new workers again.
+    """
+    def __init__(
+        self,
+        target,
+        concurrency=None,
+        restart_delay=1.0,
+        stop_timeout=10.0,
+        start_method='fork',
+        reload_delay=1.0,
+    ):
+        """
+        Constructor
+
+        :param target: function called by the worker process with the index of the worker
+        :type target: callable(index: int)
+        :param concurrency: number of worker processes, CPU count by default
+        :type concurrency: int
+        :param restart_delay: delay in seconds before restarting a crashed worker
+        :type restart_delay: float
+        :param stop_timeout: time in seconds to wait for workers to stop before killing them
+        :type stop_timeout: float
+        :param start_method: multiprocessing start method used to start workers
+        :type start_method: str
+        :param reload_delay: time in seconds given to new workers to start before old workers are stopped on reload
+        :type reload_delay: float
+        """
+        self.target = target
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.reload_delay = reload_delay
+        self.stopping = False
+        self.reloading = False
+        self._context = multiprocessing.get_context(start_method)
+        self._processes = {}
+        self._restarts = {}
+        self._retiring = []
+        self._retire_at = None
+        self._wakeup = os.pipe()
+        self._retirements, self._retirement_sender = self._context.Pipe(duplex=False)
+
+    def run(self, handle_signals=True):
+        """
+        Start workers and supervise them until the supervisor is stopped
+
+        :param handle_signals: install signal handlers, available only in the main thread
+        :type handle_signals: bool
+        """
+        handlers = {}
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT):
+                handlers[sig] = signal.signal(sig, self._on_signal)
+            handlers[signal.SIGHUP] = signal.signal(signal.SIGHUP, self._on_reload_signal)
+        try:
+            logger.info('Starting %s worker processes', self.concurrency)
+            for index in range(self.concurrency):
+                self._start(index)
+            while not self.stopping:
+                self._wait()
+        finally:
+            self._stop_all()
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+            for fd in self._wakeup:
+                os.close(fd)
+            self._retirements.close()
+            self._retirement_sender.close()
+
+    def stop(self):
+        """Ask the supervisor to stop all workers, may be called from any thread or a signal handler"""
+        self.stopping = True
+        os.write(self._wakeup[1], b'\0')
+
+    def reload(self):
+        """Ask the supervisor to replace all workers by new ones, may be called from any thread or a signal handler"""
+        self.reloading = True
+        os.write(self._wakeup[1], b'\0')
+
+    @property
+    def pids(self):
+        """Process ids of running workers"""
+        return [process.pid for process in self._processes.values()]
+
+    def _on_signal(self, sig_num, stack_frame):
+        """Signal handler"""
+        logger.info('Signal %s caught, stopping worker processes', sig_num)
+        self.stop()
+
+    def _on_reload_signal(self, sig_num, stack_frame):
+        """Reload signal handler"""
+        logger.info('Signal %s caught, reloading worker processes', sig_num)
+        self.reload()
+
+    def _start(self, index):
+        """Start a worker process"""
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.target, index, self._retirement_sender),
+            name='atasks-worker-%s' % index,
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info('Worker process %s started with index %s', process.pid, index)
+
+    def _wait(self):
+        """Wait for worker exit or the stop request and restart exited workers"""
+        now = time.monotonic()
+        dues = list(self._restarts.values()) + ([self._retire_at] if self._retire_at is not None else [])
+        timeout = min([due - now for due in dues], default=None)
+        sentinels = dict((process.sentinel, index) for index, process in self._processes.items())
+        retiring = dict((process.sentinel, process) for process in self._retiring)
+        ready = multiprocessing.connection.wait(
+            list(sentinels) + list(retiring) + [self._wakeup[0], self._retirements],
+            timeout=max(0, timeout) if timeout is not None else None,
+        )
+        if self._wakeup[0] in ready:
+            os.read(self._wakeup[0], 1024)
+        if self.stopping:
+            return
+        while self._retirements.poll():
+            self._on_retire(*self._retirements.recv())
+        for sentinel in ready:
+            if sentinel in retiring:
+                process = retiring[sentinel]
+                process.join()
+                self._retiring.remove(process)
+                logger.info('Old worker process %s exited with code %s', process.pid, process.exitcode)
+            elif sentinel in sentinels:
+                index = sentinels[sentinel]
+                process = self._processes.pop(index)
+                process.join()
+                if process.exitcode == 0:
+                    logger.info('Worker process %s exited, restarting', process.pid)
+                    self._restarts[index] = time.monotonic()
+                else:
+                    logger.error('Worker process %s crashed with code %s, restarting', process.pid, process.exitcode)
+                    self._restarts[index] = time.monotonic() + self.restart_delay
+        now = time.monotonic()
+        for index, due in list(self._restarts.items()):
+            if due <= now:
+                del self._restarts[index]
+                self._start(index)
+        if self.reloading:
+            self._reload()
+        if self._retire_at is not None and self._retire_at <= now:
+            self._retire_at = None
+            for process in self._retiring:
+                if process.is_alive():
+                    logger.info('Stopping old worker process %s', process.pid)
+                    process.terminate()
+
+    def _on_retire(self, index, pid):
+        """Start the replacement of the worker going to exit"""
+        process = self._processes.get(index, None)
+        if process is None or process.pid != pid:
+            return
+        logger.info('Worker process %s retires, starting the replacement', pid)
+        self._retiring.append(self._processes.pop(index))
+        self._restarts.pop(index, None)
+        self._start(index)
+
+    def _reload(self):
+        """Start new workers replacing running ones, old workers are stopped after the delay"""
+        self.reloading = False
+        logger.info('Reloading %s worker processes', self.concurrency)
+        for index in range(self.concurrency):
+            process = self._processes.pop(index, None)
+            if process is not None:
+                self._retiring.append(process)
+            self._restarts.pop(index, None)
+            self._start(index)
+        self._retire_at = time.monotonic() + self.reload_delay
+
+    def _stop_all(self):
+        """Stop all workers, killing them after the timeout"""
+        processes, self._processes = list(self._processes.values()) + self._retiring, {}
+        self._retiring = []
+        self._retire_at = None
+        self._restarts = {}
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('Killing worker process %s', process.pid)
+                os.kill(process.pid, signal.SIGKILL)  # Process.kill() is missing on Python 3.6
+                process.join()
+        logger.info('Worker processes stopped')
+
+
+def retire():
+    """
+    Ask the supervisor to start the replacement of this worker process going to exit
+
+    Does nothing if called not in the worker process started by the supervisor.
+    """
+    if _retirement is not None:
+        connection, index = _retirement
+        connection.send((index, os.getpid()))
+
+
+def _worker_main(target, index, retirement):
+    """Worker process entry point"""
+    global _retirement
+    _retirement = (retirement, index)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    target(index)
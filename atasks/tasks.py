@@ -2,25 +2,51 @@
 AIO Steve Task Jobs
 """
 
+import functools
 import logging
 
 
 logger = logging.getLogger(__name__)
 
 
-def atask(coro, name=None, namespace='default', **options):
+def atask(coro=None, name=None, namespace='default', **options):
     """
     Decorator for the task coroutine
 
+    May be used as `@atask` or `@atask(name=..., namespace=..., **options)`
+
     :param coro: coroutine to be decorated
     :type coro: coroutine
+    :param name: name of the atask, module and name of the coroutine by default
+    :type name: str
     :param namespace: namespace of the registry
     :type namespace: str
-    :param options: additional options
+    :param options: additional options, the following are recognized:
+                    - queue: name of the dedicated queue to receive requests for the atask
+                      by transports supporting queues
+                    - affinity: function getting atask parameters and returning a key,
+                      requests having the same key are sent to the same worker
+                      by transports supporting affinity
+                    - target: function getting atask parameters and returning the address of the worker,
+                      as returned by `local_address()` of its transport, requests are sent to this worker
+                      by transports addressing workers
+                    - reply: False to send requests with no reply, awaiting the atask returns None
+                      immediately after the transport has accepted the request
+                    - ref: True to keep the result in the object store of the worker,
+                      awaiting the atask returns `atasks.refs.RemoteRef` to the result
+                    - batch_size: max number of concurrent calls collected by the worker into a batch,
+                      the coroutine gets the list of parameters of calls and returns the list of results,
+                      every call should pass exactly one positional parameter
+                    - batch_wait: max time in seconds to wait for the batch to be full, 0 by default
+                    - blob_size: min size in bytes of the encoded argument sent once per worker,
+                      and passed by the digest of its content then, see `atasks.blobs`
     :type options: dict
     :returns: reference coroutine
     :rtype: coroutine
     """
+    if coro is None:
+        return functools.partial(atask, name=name, namespace=namespace, **options)
+
     name = '%s.%s' % (coro.__module__, coro.__name__) if name is None else name
 
     from atasks.router import get_router
@@ -0,0 +1,234 @@
+"""
+ATasks request trace recorder
+
+Records the shape of the traffic passing routers: names of atasks, sizes
+of requests and responses, arrival times, nesting and durations,
+without contents of requests:
+
+    recorder = Recorder(anonymize=True)
+    recorder.enable()
+    ...
+    recorder.disable()
+    recorder.dump('worker.trace.gz')
+
+Every request sent by the router is recorded as the `call` event, and every request
+received by the router is recorded as the `serve` event. Calls sent while the request
+is being served refer to the `serve` event as the parent. The trace is written
+as JSON lines, compressed if the file name ends with `.gz`, and replayed
+by `atasks.bench.replay`.
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import time
+
+from atasks.namespaces import namespaces
+from atasks.router import _serving, get_router
+
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+CALL = 'c'
+SERVE = 's'
+
+
+class Event(object):
+    """
+    Recorded request
+    """
+    __slots__ = ('kind', 'id', 'parent', 'name', 'start', 'size', 'response_size', 'duration')
+
+    def __init__(self, kind, id, parent, name, start, size, response_size=None, duration=None):
+        """
+        Constructor
+
+        :param kind: `CALL` for requests sent, `SERVE` for requests received
+        :type kind: str
+        :param id: id of the event unique for the trace
+        :type id: int
+        :param parent: id of the serve event the call has been sent from, or None
+        :type parent: int
+        :param name: name of the atask, or its hash if the trace is anonymized
+        :type name: str
+        :param start: time in seconds since the recording started
+        :type start: float
+        :param size: size of the request content in bytes
+        :type size: int
+        :param response_size: size of the response content in bytes, None for requests with no reply
+        :type response_size: int
+        :param duration: time in seconds until the response
+        :type duration: float
+        """
+        self.kind = kind
+        self.id = id
+        self.parent = parent
+        self.name = name
+        self.start = start
+        self.size = size
+        self.response_size = response_size
+        self.duration = duration
+
+    def row(self):
+        """
+        Compact representation written to the trace file
+
+        :returns: list of event attributes
+        :rtype: list
+        """
+        return [
+            self.kind, self.id, self.parent, self.name, round(self.start, 6), self.size,
+            self.response_size, round(self.duration, 6) if self.duration is not None else None,
+        ]
+
+
+class Recorder(object):
+    """
+    Request trace recorder
+    """
+    def __init__(self, anonymize=False, max_events=1000000):
+        """
+        Constructor
+
+        :param anonymize: replace names of atasks by their hashes
+        :type anonymize: bool
+        :param max_events: max number of events kept, next events are dropped
+        :type max_events: int
+        """
+        self.anonymize = anonymize
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self._ids = itertools.count(1)
+        self._started = None
+        self._routers = []
+        self._serving = {}  # ids of serve events by id of the request being served
+
+    def enable(self, namespace=None):
+        """
+        Start recording requests sent and received by routers
+
+        :param namespace: namespace of the router, all existing routers by default
+        :type namespace: str
+        """
+        routers = [get_router(namespace)] if namespace is not None else [
+            ns.router for name, ns in namespaces.items() if getattr(ns, 'router', None)
+        ]
+        for router in routers:
+            router.recorder = self
+        self._routers += routers
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def disable(self):
+        """Stop recording"""
+        for router in self._routers:
+            if router.recorder is self:
+                router.recorder = None
+        self._routers = []
+
+    def call(self, name, size):
+        """
+        Record the request sent
+
+        :param name: name of the atask
+        :type name: str
+        :param size: size of the request content in bytes
+        :type size: int
+        :returns: event to be passed to `finish()`, or None if dropped
+        :rtype: Event
+        """
+        return self._start(CALL, name, size)
+
+    def finish(self, event, response):
+        """
+        Record the response to the request sent
+
+        :param event: event returned by `call()`
+        :type event: Event
+        :param response: response content, or None for requests with no reply
+        :type response: bytes
+        """
+        if event is None:
+            return
+        event.duration = time.perf_counter() - self._started - event.start
+        event.response_size = len(response) if response is not None else None
+
+    def serve(self, request, size):
+        """
+        Record the request received, calls sent while it is being served refer to it as the parent
+
+        :param request: request being served by the router
+        :type request: atasks.router.Request
+        :param size: size of the request content in bytes
+        :type size: int
+        :returns: event to be passed to `served()`, or None if dropped
+        :rtype: Event
+        """
+        event = self._start(SERVE, request.name, size)
+        if event is not None:
+            self._serving[request.id] = event.id
+        return event
+
+    def served(self, request, event, response):
+        """
+        Record the response to the request received
+
+        :param request: request passed to `serve()`
+        :type request: atasks.router.Request
+        :param event: event returned by `serve()`
+        :type event: Event
+        :param response: response content, or None for requests with no reply
+        :type response: bytes
+        """
+        self._serving.pop(request.id, None)
+        self.finish(event, response)
+
+    def _start(self, kind, name, size):
+        """Record the request unless the trace is full"""
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return None
+        if self.anonymize:
+            name = hashlib.blake2b(name.encode('utf-8'), digest_size=6).hexdigest()
+        parent = None
+        if kind == CALL:
+            # the request being served by the router in the current context
+            request = _serving.get()
+            parent = self._serving.get(request.id, None) if request is not None else None
+        event = Event(kind, next(self._ids), parent, name, time.perf_counter() - self._started, size)
+        self.events.append(event)
+        return event
+
+    def dump(self, path):
+        """
+        Write the trace to the file
+
+        :param path: file name, the file is compressed if the name ends with `.gz`
+        :type path: str
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wt') as f:
+            f.write('%s\n' % json.dumps({'version': VERSION, 'anonymized': self.anonymize, 'dropped': self.dropped}))
+            for event in self.events:
+                f.write('%s\n' % json.dumps(event.row(), separators=(',', ':')))
+        logger.info('%s events written to %s', len(self.events), path)
+
+
+def read_trace(path):
+    """
+    Read the trace file
+
+    :param path: file name, the file is decompressed if the name ends with `.gz`
+    :type path: str
+    :returns: list of events
+    :rtype: list
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        header = json.loads(f.readline())
+        if header.get('version', None) != VERSION:
+            raise ValueError('Unsupported trace version in %s: %s' % (path, header.get('version', None)))
+        return [Event(*json.loads(line)) for line in f if line.strip()]
@@ -1,17 +1,127 @@
+"""
+ATasks AMQP Transport module
+"""
 import asyncio
+import itertools
 import logging
-import uuid
 
 import aio_pika
 from atasks.transport.base import Transport
+from atasks.transport.pending import Activity, PendingRequests
 
 
 logger = logging.getLogger(__name__)
 
+CONSISTENT_HASH = 'x-consistent-hash'
+ADDRESS_SCHEME = 'amqp:'  # prefix of worker addresses naming their exclusive request queues
+
+
+class AffinityNotSupported(Exception):
+    """The broker doesn't support the consistent hash exchange used for atasks having the affinity option"""
+    pass
+
+
+async def _declare_affinity_exchange(channel, name):
+    """
+    Declare the consistent hash exchange
+
+    :param channel: channel to declare the exchange on
+    :param name: name of the exchange
+    :type name: str
+    :returns: the exchange
+    :raises AffinityNotSupported: if the exchange can not be declared
+    """
+    try:
+        return await channel.declare_exchange(name, type=CONSISTENT_HASH, durable=True)
+    except Exception as ex:
+        raise AffinityNotSupported(
+            'Can not declare the %s exchange %r used for atasks having the affinity option, '
+            'is the rabbitmq_consistent_hash_exchange plugin enabled? %s' % (CONSISTENT_HASH, name, ex)
+        ) from ex
+
+
+class _Publisher(object):
+    """
+    Publishing channel with own exchanges and a window of unconfirmed messages
+    """
+    def __init__(self, channel, request_exchange, response_exchange, window):
+        """
+        Constructor
+
+        :param channel: channel used to publish messages
+        :param request_exchange: request exchange declared on the channel
+        :param response_exchange: response exchange declared on the channel
+        :param window: max number of messages published but not confirmed yet
+        :type window: int
+        """
+        self.channel = channel
+        self.request_exchange = request_exchange
+        self.response_exchange = response_exchange
+        self.window = asyncio.Semaphore(window)
+        self.pending = 0
+        self.affinity_exchanges = {}
+
+    async def affinity_exchange(self, name):
+        """
+        Get the consistent hash exchange declared on the channel
+
+        :param name: name of the exchange
+        :type name: str
+        """
+        if name not in self.affinity_exchanges:
+            self.affinity_exchanges[name] = await _declare_affinity_exchange(self.channel, name)
+        return self.affinity_exchanges[name]
+
+    async def publish(self, exchange, message, routing_key, mandatory=False):
+        """
+        Publish a message respecting the channel window
+
+        :param exchange: exchange declared on the channel
+        :param message: message to be published
+        :type message: aio_pika.Message
+        :param routing_key: routing key of the message
+        :type routing_key: str
+        :param mandatory: fail if the message is not routed to any queue
+        :type mandatory: bool
+        """
+        self.pending += 1
+        try:
+            async with self.window:
+                if mandatory:
+                    await exchange.publish(message, routing_key=routing_key, mandatory=True)
+                else:
+                    await exchange.publish(message, routing_key=routing_key)
+        finally:
+            self.pending -= 1
+
 
 class AMQPTransport(Transport):
     """
     AMQP transport which uses AMQP for enqueue requests and receive responces
+
+    Messages are published using a pool of channels opened over a pool of connections.
+    The response and request consumers use their own dedicated channels.
+
+    Requests are consumed from the queue named by the `queue` parameter and bound to names
+    of atasks registered in the namespace, unless the atask has the `queue` option naming
+    another queue. With `queue_per_atask` every atask having no `queue` option has its own
+    queue named `<queue>.<atask name>` instead, and the worker consumes queues of atasks
+    registered in the namespace only, so workers having different catalogs of atasks never
+    receive requests for atasks they don't know.
+
+    Requests for atasks having the `affinity` option are published to the consistent hash
+    exchange named after the atask queue with the `.affinity` suffix, using the affinity key
+    as a routing key. Every worker binds its own exclusive queue to this exchange,
+    so the broker rebalances keys among workers when they join or leave. The consistent
+    hash exchange is provided by the `rabbitmq_consistent_hash_exchange` RabbitMQ plugin.
+    It is declared only by workers registering atasks having the `affinity` option, and by
+    clients sending the first request having the affinity key, so the plugin is not required
+    unless affinity is used; `AffinityNotSupported` is raised if the exchange can not be declared.
+
+    Every worker also consumes its own exclusive request queue, and its `local_address()`
+    is `amqp:` followed by the name of this queue. Requests targeted to the worker are published
+    to this queue through the default exchange as mandatory messages, so they fail
+    if the worker is gone, as long as publisher confirms are enabled.
     """
 
     def __init__(
@@ -22,65 +132,144 @@ class AMQPTransport(Transport):
         response_exchange='atask',
         prefix='atask',
         queue='atask',
+        queue_per_atask=False,
+        connections=1,
+        channels=1,
+        channel_window=64,
+        prefetch_count=1,
+        affinity_weight='1',
+        publisher_confirms=True,
+        max_in_flight=None,
+        driver=None,
     ):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param url: URL of the AMQP broker
+        :type url: str
+        :param request_exchange: name of the exchange to publish requests
+        :type request_exchange: str
+        :param response_exchange: name of the exchange to publish responses
+        :type response_exchange: str
+        :param prefix: routing key prefix of requests
+        :type prefix: str
+        :param queue: name of the queue consuming requests for atasks having no own dedicated `queue` option,
+                      or the name prefix of their queues if `queue_per_atask` is set
+        :type queue: str
+        :param queue_per_atask: consume requests for every atask having no own dedicated `queue` option
+                                from its own queue named `<queue>.<atask name>`
+        :type queue_per_atask: bool
+        :param connections: number of connections to the broker
+        :type connections: int
+        :param channels: number of publishing channels opened for every connection
+        :type channels: int
+        :param channel_window: max number of unconfirmed messages published to one channel,
+                        publishing to the channel is suspended while the window is full
+        :type channel_window: int
+        :param prefetch_count: max number of unacknowledged requests delivered to the consumer of every request queue
+        :type prefetch_count: int
+        :param affinity_weight: weight of the worker on the consistent hash ring of affinity keys
+        :type affinity_weight: str
+        :param publisher_confirms: wait for the broker confirmation of every published message
+        :type publisher_confirms: bool
+        :param max_in_flight: max number of requests awaiting responses, sending more requests
+                              waits until some of them are responded, unlimited by default
+        :type max_in_flight: int
+        :param driver: module or object implementing the `aio_pika` API used to talk to the broker,
+                       like the in-memory `atasks.transport.memory.Broker`, `aio_pika` by default
+        """
         super().__init__(namespace=namespace)
         self.url = url
         self.request_exchange_name = request_exchange
         self.response_exchange_name = response_exchange
         self.prefix = prefix
         self.queue_name = queue
+        self.queue_per_atask = queue_per_atask
+        self.connections = connections
+        self.channels = channels
+        self.channel_window = channel_window
+        self.prefetch_count = prefetch_count
+        self.affinity_weight = affinity_weight
+        self.publisher_confirms = publisher_confirms
+        self.driver = driver or aio_pika
         self._lock = asyncio.Lock()
-        self._awaiting_requests = {}
+        self._pending = PendingRequests(max_in_flight)
+        self._activity = Activity()
+        self._connections = []
+        self._publishers = []
+        self._queues = {}
+        self._address_queue = None
+        self._counter = itertools.count()
 
     async def unregister_callback(self):
-        await self._lock.acquire()
-        try:
-            await self._queue.cancel(self._consumer)
-            del self._queue
-            del self._consumer
+        """
+        Overriden from the base class
+        """
+        async with self._lock:
+            for queue, consumer in self._queues.values():
+                await queue.cancel(consumer)
+            await self._request_channel.close()
+            self._queues = {}
+            self._address_queue = None
+            del self._request_channel
             await super().unregister_callback()
-        finally:
-            self._lock.release()
+
+    async def drain(self, timeout=None):
+        """
+        Overriden from the base class
+        """
+        return await self._activity.wait(timeout)
+
+    def pending_requests(self):
+        """
+        Overriden from the base class
+        """
+        return self._pending.snapshot()
+
+    def local_address(self):
+        """
+        Overriden from the base class
+        """
+        if self._address_queue is None:
+            return None
+        return ADDRESS_SCHEME + self._address_queue.name
 
     async def disconnect(self):
-        await self._lock.acquire()
-        try:
-            await self._connection.close()
-            del self._connection
-            del self._channel
-            del self._request_exchange
-            del self._response_exchange
+        """
+        Overriden from the base class
+        """
+        async with self._lock:
+            for connection in self._connections:
+                await connection.close()
+            self._connections = []
+            self._publishers = []
+            del self._response_channel
             del self._response_queue
             del self._response_consumer
-        finally:
-            self._lock.release()
 
     async def connect(self):
+        """
+        Overriden from the base class
+        """
         loop = asyncio.get_event_loop()
-        await self._lock.acquire()
-        if hasattr(self, '_connection'):
-            return
-        try:
+        async with self._lock:
+            if self._connections:
+                return
             logger.info('Connecting transport %s', self)
-            self._connection = await aio_pika.connect_robust(self.url, loop=loop)
-            self._channel = await self._connection.channel()
-            self._request_exchange = await self._channel.declare_exchange(
-                self.request_exchange_name,
-                type=aio_pika.ExchangeType.TOPIC,
-                durable=True,
-            )
-            self._response_exchange = self._request_exchange
-            if not self.response_exchange_name == self.request_exchange_name:
-                self._response_exchange = await self._channel.declare_exchange(
-                    self.response_exchange_name,
-                    type=aio_pika.ExchangeType.TOPIC,
-                    durable=True,
-                )
-            self._response_queue = await self._channel.declare_queue(
+            for i in range(self.connections):
+                self._connections.append(await self.driver.connect_robust(self.url, loop=loop))
+
+            for connection in self._connections:
+                for i in range(self.channels):
+                    self._publishers.append(await self._open_publisher(connection))
+
+            self._response_channel = await self._connections[0].channel()
+            self._response_queue = await self._response_channel.declare_queue(
                 '', exclusive=True,
             )
-            await self._response_queue.bind(self._response_exchange, self._response_queue.name)
-            await self._channel.set_qos(prefetch_count=1)
+            await self._response_queue.bind(self.response_exchange_name, self._response_queue.name)
 
             async def _on_response_message(message):
                 async with message.process():
@@ -88,68 +277,202 @@ class AMQPTransport(Transport):
                     response = message.body
                 correlation_id = info['correlation_id']
                 logger.info('Got response for [%s]', correlation_id)
-                future = self._awaiting_requests[correlation_id]
-                future.set_result(response)
+                if not (correlation_id or '').isdigit() or not self._pending.resolve(int(correlation_id), response):
+                    logger.warning('Nobody awaits response for [%s]', correlation_id)
 
             self._response_consumer = await self._response_queue.consume(_on_response_message)
-        finally:
-            self._lock.release()
 
-    async def register_callback(self, callback):
-        await self._lock.acquire()
-        try:
-            await super().register_callback(callback)
-            self._queue = await self._channel.declare_queue(
-                self.queue_name,
+    async def _open_publisher(self, connection):
+        """
+        Open a publishing channel and declare exchanges on it
+        """
+        channel = await connection.channel(publisher_confirms=self.publisher_confirms)
+        request_exchange = await channel.declare_exchange(
+            self.request_exchange_name,
+            type=self.driver.ExchangeType.TOPIC,
+            durable=True,
+        )
+        response_exchange = request_exchange
+        if not self.response_exchange_name == self.request_exchange_name:
+            response_exchange = await channel.declare_exchange(
+                self.response_exchange_name,
+                type=self.driver.ExchangeType.TOPIC,
+                durable=True,
             )
-            logger.info('Binding queue to %s', self.prefix + '.#')
-            await self._queue.bind(self._request_exchange, self.prefix + '.#')
+        return _Publisher(channel, request_exchange, response_exchange, self.channel_window)
 
-            async def _on_message(message):
-                async with message.process():
-                    info = message.info()
-                    request = message.body
-                name = info['routing_key'][len(self.prefix) + 1:]
-                correlation_id = info['correlation_id']
-                logger.info('Got request for %s[%s]', name, correlation_id)
-                response = await self.callback(name, request)
-
-                logger.info('Publishing result for %s[%s]', name, correlation_id)
-                await self._response_exchange.publish(
-                    aio_pika.Message(
-                        correlation_id=correlation_id,
-                        body=response
-                    ),
-                    routing_key=info['reply_to'],
-                )
-
-            self._consumer = await self._queue.consume(_on_message)
-        finally:
-            self._lock.release()
+    def _choose_publisher(self):
+        """
+        Choose the least busy publisher starting from the next one in turn
+        """
+        start = next(self._counter) % len(self._publishers)
+        publishers = self._publishers[start:] + self._publishers[:start]
+        return min(publishers, key=lambda publisher: publisher.pending)
+
+    async def register_callback(self, callback):
+        """
+        Overriden from the base class
+
+        Binds queues to receive requests only for atasks registered in the namespace.
+        """
+        async with self._lock:
+            await super().register_callback(callback)
+            self._request_channel = await self._connections[-1].channel()
+            await self._request_channel.set_qos(prefetch_count=self.prefetch_count)
+            queue = await self._request_channel.declare_queue('', exclusive=True)
+            consumer = await queue.consume(self._on_message)
+            self._queues[ADDRESS_SCHEME] = (queue, consumer)
+            self._address_queue = queue
+            for name, options in self.routes():
+                await self._bind(name, options)
         logger.info('Callback registered %s', callback)
 
-    async def send_request(self, name, content):
+    async def register_atask(self, name, options):
         """
         Overriden from the base class
         """
-        await self._lock.acquire()
+        async with self._lock:
+            if self.callback is not None:
+                await self._bind(name, options)
+
+    async def _bind(self, name, options):
+        """
+        Bind the atask queue to receive requests for the atask
+        """
+        queue_name = self._queue_name(name, options)
+        if queue_name not in self._queues:
+            queue = await self._request_channel.declare_queue(queue_name)
+            consumer = await queue.consume(self._on_message)
+            self._queues[queue_name] = (queue, consumer)
+        queue, consumer = self._queues[queue_name]
+        routing_key = '%s.%s' % (self.prefix, name)
+        logger.info('Binding queue %s to %s', queue_name, routing_key)
+        await queue.bind(self.request_exchange_name, routing_key)
+
+        exchange_name = self._affinity_exchange_name(name, options)
+        if options.get('affinity', None) and exchange_name not in self._queues:
+            await _declare_affinity_exchange(self._request_channel, exchange_name)
+            queue = await self._request_channel.declare_queue('', exclusive=True)
+            logger.info('Binding queue %s to %s', queue.name, exchange_name)
+            await queue.bind(exchange_name, self.affinity_weight)
+            consumer = await queue.consume(self._on_message)
+            self._queues[exchange_name] = (queue, consumer)
+
+    async def _route(self, publisher, name, key, target=None):
+        """
+        Exchange and routing key to publish a request
+        """
+        if target is not None:
+            return publisher.channel.default_exchange, target[len(ADDRESS_SCHEME):]
+        if key is not None:
+            exchange = await publisher.affinity_exchange(self._affinity_exchange_name(name, self.options(name)))
+            return exchange, str(key)
+        return publisher.request_exchange, '%s.%s' % (self.prefix, name)
+
+    def _queue_name(self, name, options):
+        """
+        Name of the queue consuming requests for the atask having the options
+        """
+        if options.get('queue', None):
+            return options['queue']
+        if self.queue_per_atask:
+            return '%s.%s' % (self.queue_name, name)
+        return self.queue_name
+
+    def _affinity_exchange_name(self, name, options):
+        """
+        Name of the consistent hash exchange used for the atask having the options
+        """
+        return '%s.affinity' % self._queue_name(name, options)
+
+    async def _on_message(self, message):
+        """
+        Process a request message and publish the response
+        """
+        callback = self.callback
+        self._activity.enter()
         try:
-            correlation_id = uuid.uuid4().hex  # probably not unique but with almost zero probability
-            future = asyncio.Future()
-            self._awaiting_requests[correlation_id] = future
+            async with message.process():
+                info = message.info()
+                request = message.body
+            name = info.get('type', None) or info['routing_key'][len(self.prefix) + 1:]
+            correlation_id = info['correlation_id']
+            logger.info('Got request for %s[%s]', name, correlation_id)
+            response = await callback(name, request)
+            if not info['reply_to']:
+                return
+
+            logger.info('Publishing result for %s[%s]', name, correlation_id)
+            publisher = self._choose_publisher()
+            await publisher.publish(
+                publisher.response_exchange,
+                self.driver.Message(
+                    correlation_id=correlation_id,
+                    body=response
+                ),
+                routing_key=info['reply_to'],
+            )
+        finally:
+            self._activity.leave()
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+
+        Requests with no reply are published without `reply_to` and
+        return as soon as the broker accepted the message.
+
+        Requests targeted to the worker which is gone are not responded, returning None.
+        """
+        if target is not None and not target.startswith(ADDRESS_SCHEME):
+            target = None
+        if not reply:
+            publisher = self._choose_publisher()
+            exchange, routing_key = await self._route(publisher, name, key, target)
+            logger.info('Publishing for %s with no reply', name)
+            if not await self._publish(
+                publisher, exchange,
+                self.driver.Message(body=content, type=name),
+                routing_key, target,
+            ):
+                logger.error('Request %s is not delivered to %s', name, target)
+            return None
+
+        async with self._pending.open(name) as (request_id, future):
+            correlation_id = str(request_id)
             logger.info('Publishing for %s[%s]', name, correlation_id)
-            await self._request_exchange.publish(
-                aio_pika.Message(
+            publisher = self._choose_publisher()
+            exchange, routing_key = await self._route(publisher, name, key, target)
+            if not await self._publish(
+                publisher, exchange,
+                self.driver.Message(
                     correlation_id=correlation_id,
                     body=content,
                     reply_to=self._response_queue.name,
+                    type=name,
                 ),
-                routing_key='%s.%s' % (self.prefix, name),
-            )
+                routing_key, target,
+            ):
+                logger.error('Request %s[%s] is not delivered to %s', name, correlation_id, target)
+                return None
             logger.debug('Published for %s[%s]', name, correlation_id)
-        finally:
-            self._lock.release()
-        ret = await future
-        logger.debug('Got a result for %s[%s]', name, correlation_id)
-        del self._awaiting_requests[correlation_id]
+            ret = await future
+            logger.debug('Got a result for %s[%s]', name, correlation_id)
         return ret
+
+    async def _publish(self, publisher, exchange, message, routing_key, target):
+        """
+        Publish the request, requests targeted to the worker are published as mandatory
+
+        :returns: False if the targeted request has not been routed to the worker
+        :rtype: bool
+        """
+        if target is None:
+            await publisher.publish(exchange, message, routing_key=routing_key)
+            return True
+        try:
+            await publisher.publish(exchange, message, routing_key=routing_key, mandatory=True)
+        except Exception as ex:
+            logger.debug('Error publishing to %s: %s', target, ex)
+            return False
+        return True
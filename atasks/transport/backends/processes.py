@@ -0,0 +1,381 @@
+"""
+ATasks Process Pool Transport module
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+
+from atasks.codecs import get_codec
+from atasks.loader import load_module
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+from atasks.transport.base import Transport
+from atasks.transport.hashring import HashRing
+from atasks.transport.streams import HELLO, Connection, read_frame
+
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_SCHEME = 'process:'  # prefix of worker addresses, followed by the pool socket path and the worker index
+_TARGET = '\0'  # separates the target from the name of the request passed by the worker to the pool
+
+
+class _Slot(object):
+    """
+    Worker process slot supervised by the transport
+    """
+    def __init__(self, index):
+        """
+        Constructor
+
+        :param index: index of the slot in the pool
+        :type index: int
+        """
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.ready = None
+        self.connected = False
+
+
+class ProcessPoolTransport(Transport):
+    """
+    Transport passing requests to a pool of local worker processes.
+
+    The transport starts and supervises worker processes. Every worker process
+    imports atask modules and activates a router for the namespace. Requests
+    are passed to workers over Unix socket connections, every next request is passed
+    to the worker having the least number of requests in flight.
+
+    Workers pass their own requests back to the transport, which dispatches
+    them among workers the same way.
+
+    The `local_address()` of the worker is `process:<pool socket path>#<index>`,
+    requests targeted to this address are passed to the worker of the pool having the index,
+    and fail if the worker is not connected.
+    """
+    def __init__(
+        self,
+        namespace='default',
+        workers=None,
+        modules=None,
+        restart=True,
+        restart_delay=1.0,
+        start_method='spawn',
+        max_in_flight=None,
+    ):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param workers: number of worker processes, CPU count by default
+        :type workers: int
+        :param modules: file or module names to be loaded by workers,
+                        modules containing atasks registered in the namespace by default
+        :type modules: list
+        :param restart: restart worker processes exited unexpectedly
+        :type restart: bool
+        :param restart_delay: delay in seconds before restarting a worker which has exited while starting
+        :type restart_delay: float
+        :param start_method: multiprocessing start method used to start workers
+        :type start_method: str
+        :param max_in_flight: max number of requests awaiting responses from every worker, sending more requests
+                              to the worker waits until some of them are responded, unlimited by default
+        :type max_in_flight: int
+        """
+        super().__init__(namespace=namespace)
+        self.workers = workers or os.cpu_count() or 1
+        self.modules = modules
+        self.restart = restart
+        self.restart_delay = restart_delay
+        self.max_in_flight = max_in_flight
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = []
+        self._ring = HashRing()
+        self._server = None
+        self._directory = None
+        self._path = None
+        self._stopping = False
+        self._counter = itertools.count()
+
+    async def connect(self):
+        """
+        Overriden from the base class
+        """
+        if self._slots:
+            return
+        logger.info('Starting %s worker processes for %s', self.workers, self)
+        self._stopping = False
+        self._directory = tempfile.mkdtemp(prefix='atasks-')
+        self._path = os.path.join(self._directory, 'pool.sock')
+        self._server = await asyncio.start_unix_server(self._on_connection, path=self._path)
+        self._slots = [_Slot(i) for i in range(self.workers)]
+        for slot in self._slots:
+            self._start(slot)
+        await asyncio.wait([slot.ready for slot in self._slots])
+
+    async def disconnect(self):
+        """
+        Overriden from the base class
+        """
+        logger.info('Stopping worker processes for %s', self)
+        self._stopping = True
+        loop = asyncio.get_event_loop()
+        slots, self._slots = self._slots, []
+        self._ring = HashRing()
+        for slot in slots:
+            if slot.process:
+                loop.remove_reader(slot.process.sentinel)
+            if slot.connection:
+                await slot.connection.close()
+        for slot in slots:
+            if slot.process:
+                await loop.run_in_executor(None, slot.process.join, 5)
+                if slot.process.is_alive():
+                    logger.warning('Terminating worker process %s', slot.process.pid)
+                    slot.process.terminate()
+        self._server.close()
+        await self._server.wait_closed()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+
+        Requests having the affinity key are sent to the worker owning the key
+        on the hash ring of connected workers.
+        """
+        prefix = '%s%s#' % (ADDRESS_SCHEME, self._path)
+        if target is not None and self._path and target.startswith(prefix):
+            index = target[len(prefix):]
+            if not index.isdecimal() or int(index) >= len(self._slots):
+                logger.error('No worker %s to send a request %s using %s', index, name, self)
+                return None
+            slot = self._slots[int(index)]
+            if not slot.connected:
+                logger.error('Worker %s is not connected to send a request %s using %s', index, name, self)
+                return None
+        else:
+            slot = await self._choose_slot(key)
+        if slot is None:
+            logger.error('No workers to send a request %s using %s', name, self)
+            return None
+        logger.info('Sending a request %s to the worker %s', name, slot.index)
+        return await slot.connection.send_request(name, content, reply=reply)
+
+    async def choose_target(self, name, key=None):
+        """
+        Overriden from the base class
+        """
+        slot = await self._choose_slot(key)
+        return '%s%s#%s' % (ADDRESS_SCHEME, self._path, slot.index) if slot is not None else None
+
+    def pending_requests(self):
+        """
+        Overriden from the base class
+        """
+        requests = []
+        for slot in list(self._slots):
+            if slot.connection is not None:
+                requests += [dict(request, worker=slot.index) for request in slot.connection.pending.snapshot()]
+        return requests
+
+    async def _choose_slot(self, key=None):
+        """Choose a connected worker owning the key, or having the least number of requests in flight"""
+        while self._slots:
+            if key is not None and len(self._ring):
+                return self._slots[self._ring.get(key)]
+            slots = [slot for slot in self._slots if slot.connected]
+            if slots:
+                start = next(self._counter) % len(slots)
+                slots = slots[start:] + slots[:start]
+                return min(slots, key=lambda slot: slot.connection.inflight)
+            await asyncio.wait([slot.ready for slot in self._slots], return_when=asyncio.FIRST_COMPLETED)
+        return None
+
+    def _modules(self):
+        """Modules to be loaded by workers"""
+        if self.modules is not None:
+            return list(self.modules)
+        registry = self.served_registry()
+        modules = []
+        for name, item in registry.items() if registry else []:
+            module = getattr(item, 'source', None) or item.coro.__module__
+            if module == '__main__':
+                logger.warning('Atask %s defined in __main__ is not available for workers', name)
+            elif module not in modules:
+                modules.append(module)
+        return modules
+
+    def _reset_ready(self, slot):
+        """Create a new future awaiting the slot to be connected if necessary"""
+        if slot.ready is None or slot.ready.done():
+            slot.ready = asyncio.get_event_loop().create_future()
+
+    def _start(self, slot):
+        """Start a worker process for the slot"""
+        loop = asyncio.get_event_loop()
+        self._reset_ready(slot)
+        slot.process = self._context.Process(
+            target=_worker_main,
+            args=(self.namespace, self._path, slot.index, self._modules(), get_codec(self.namespace)),
+            name='atasks-%s-%s' % (self.namespace, slot.index),
+            daemon=True,
+        )
+        slot.process.start()
+        logger.info('Worker process %s started for %s', slot.process.pid, self)
+        loop.add_reader(slot.process.sentinel, self._on_exit, slot, slot.process)
+
+    def _on_exit(self, slot, process):
+        """Worker process exit handler"""
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(process.sentinel)
+        process.join()
+        if self._stopping or slot.process is not process:
+            return
+        logger.error('Worker process %s exited with code %s', process.pid, process.exitcode)
+        slot.process = None
+        if self.restart:
+            delay = 0 if slot.connected or slot.ready.done() else self.restart_delay
+            loop.call_later(delay, self._restart, slot)
+
+    def _restart(self, slot):
+        """Restart a worker process for the slot if still necessary"""
+        if self._stopping or slot.process is not None or slot not in self._slots:
+            return
+        self._start(slot)
+
+    async def _on_connection(self, reader, writer):
+        """Worker connection handler"""
+        try:
+            kind, index, name, key, content = await read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if kind != HELLO or index >= len(self._slots):
+            logger.error('Unexpected connection to %s', self)
+            writer.close()
+            return
+        slot = self._slots[index]
+        slot.connection = Connection(
+            reader, writer,
+            callback=self._on_worker_request,
+            on_close=lambda c: self._on_close(slot, c),
+            hints=True,
+            max_in_flight=self.max_in_flight,
+        )
+        slot.connection.start()
+        slot.connected = True
+        self._ring.add(slot.index)
+        if not slot.ready.done():
+            slot.ready.set_result(True)
+        logger.info('Worker %s connected to %s', index, self)
+
+    async def _on_worker_request(self, name, content, key=None, reply=True):
+        """Dispatch the request passed by the worker to the target worker or any worker"""
+        target = None
+        if name.startswith(_TARGET):
+            target, sep, name = name[1:].partition(_TARGET)
+        return await self.send_request(name, content, key=key, reply=reply, target=target)
+
+    def _on_close(self, slot, connection):
+        """Worker connection close handler"""
+        if slot.connection is not connection:
+            return
+        slot.connected = False
+        self._ring.remove(slot.index)
+        self._reset_ready(slot)
+
+
+class _WorkerTransport(Transport):
+    """
+    Transport used by the worker process to talk to the pool
+    """
+    def __init__(self, namespace, connection, index, path):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param connection: connection to the pool
+        :type connection: Connection
+        :param index: index of the worker in the pool
+        :type index: int
+        :param path: path of the pool socket
+        :type path: str
+        """
+        super().__init__(namespace=namespace)
+        self.connection = connection
+        self.index = index
+        self.address = '%s%s#%s' % (ADDRESS_SCHEME, path, index)
+
+    async def connect(self):
+        """
+        Overriden from the base class
+        """
+        self.connection.start()
+        await self.connection.hello(self.index)
+
+    async def disconnect(self):
+        """
+        Overriden from the base class
+        """
+        await self.connection.close()
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+        """
+        if target is not None and target.startswith(ADDRESS_SCHEME):
+            name = _TARGET + target + _TARGET + name
+        return await self.connection.send_request(name, content, key, reply)
+
+    def local_address(self):
+        """
+        Overriden from the base class
+        """
+        return self.address
+
+    async def register_callback(self, callback):
+        """
+        Overriden from the base class
+        """
+        await super().register_callback(callback)
+        self.connection.callback = callback
+
+    async def unregister_callback(self):
+        """
+        Overriden from the base class
+        """
+        await super().unregister_callback()
+        self.connection.callback = None
+
+
+def _worker_main(namespace, path, index, modules, codec):
+    """Worker process entry point"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_worker_serve(namespace, path, index, modules, codec))
+    finally:
+        loop.close()
+
+
+async def _worker_serve(namespace, path, index, modules, codec):
+    """Worker process body"""
+    if codec is not None:
+        namespaces.register(namespace, codec=codec)
+    reader, writer = await asyncio.open_unix_connection(path)
+    transport = _WorkerTransport(namespace, Connection(reader, writer), index, path)
+    for module in modules:
+        load_module(module)
+    await get_router(namespace).activate(transport)
+    await transport.connect()
+    await transport.connection.wait_closed()
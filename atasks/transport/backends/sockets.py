@@ -0,0 +1,420 @@
+"""
+ATasks Socket Transport module
+"""
+import asyncio
+import itertools
+import logging
+import os
+import random
+
+from atasks.transport.base import Transport
+from atasks.transport.hashring import HashRing
+from atasks.transport.pending import _set_result
+from atasks.transport.streams import Connection, RequestRefused
+
+
+logger = logging.getLogger(__name__)
+
+BALANCE_POLICIES = ('round-robin', 'least-loaded', 'p2c')
+MIN_LATENCY = 0.001  # response time assumed for workers not measured yet
+
+
+def parse_address(address):
+    """
+    Parse a socket address
+
+    :param address: address like `tcp://host:port` or `unix:///path/to/socket`
+    :type address: str
+    :returns: scheme and parameters of the address
+    :rtype: tuple
+    """
+    scheme, sep, rest = address.partition('://')
+    if scheme == 'unix' and sep:
+        return scheme, (rest,)
+    if scheme == 'tcp' and sep:
+        host, sep, port = rest.rpartition(':')
+        if sep:
+            return scheme, (host.strip('[]'), int(port))
+    raise ValueError('Unsupported address: %s' % address)
+
+
+async def open_connection(address):
+    """
+    Open a stream connection to the address
+
+    :param address: address like `tcp://host:port` or `unix:///path/to/socket`
+    :type address: str
+    :returns: reader and writer of the connection
+    :rtype: tuple
+    """
+    scheme, params = parse_address(address)
+    if scheme == 'unix':
+        return await asyncio.open_unix_connection(*params)
+    return await asyncio.open_connection(*params)
+
+
+async def start_server(callback, address, reuse_port=False):
+    """
+    Start a stream server listening on the address
+
+    :param callback: connection handler
+    :type callback: awaitable(reader, writer)
+    :param address: address like `tcp://host:port` or `unix:///path/to/socket`
+    :type address: str
+    :param reuse_port: allow several processes to listen on the same TCP port
+    :type reuse_port: bool
+    :returns: server and actual address the server listens on
+    :rtype: tuple
+    """
+    scheme, params = parse_address(address)
+    if scheme == 'unix':
+        if os.path.exists(params[0]):
+            os.unlink(params[0])
+        server = await asyncio.start_unix_server(callback, *params)
+        return server, address
+    server = await asyncio.start_server(callback, *params, reuse_port=reuse_port or None)
+    host, port = server.sockets[0].getsockname()[:2]
+    return server, 'tcp://%s:%s' % (params[0] or host, port)
+
+
+class _Peer(object):
+    """
+    Persistent connection to a worker
+    """
+    def __init__(self, address):
+        """
+        Constructor
+
+        :param address: address of the worker
+        :type address: str
+        """
+        self.address = address
+        self.connection = None
+        self.down_until = 0
+        self.lock = asyncio.Lock()
+        self.latency = {}  # EWMA of response time by atask name, and of all atasks by None
+
+    def observe(self, name, elapsed, decay):
+        """
+        Take the response time into account
+
+        :param name: name of the atask
+        :type name: str
+        :param elapsed: response time in seconds
+        :type elapsed: float
+        :param decay: weight of the new response time
+        :type decay: float
+        """
+        for key in (name, None):
+            previous = self.latency.get(key, None)
+            self.latency[key] = elapsed if previous is None else previous + decay * (elapsed - previous)
+
+
+class SocketTransport(Transport):
+    """
+    Brokerless transport passing requests directly to workers over TCP or Unix sockets.
+
+    The worker side listens on the socket when the callback is registered.
+    The client side keeps persistent connections to the configured list of workers,
+    and multiplexes many requests in flight over every connection.
+
+    Requests having an affinity key are sent to the worker owning the key on the
+    hash ring of workers. If the worker is not available, the next one
+    on the ring takes the key over.
+
+    The worker side unregistering the callback stops listening and refuses
+    new requests over open connections, while requests being processed are finished.
+    The client side reconnects and sends refused requests to another worker.
+
+    Workers sharing the listening TCP port additionally listen on a private port,
+    so requests may be targeted to the particular worker by its `local_address()`.
+
+    Workers report their load to connected clients periodically: the number of requests
+    in flight, the event loop lag and the event loop queue delay. Requests having no affinity
+    key are distributed among workers according to the `balance` policy:
+
+    - `round-robin` sends requests to workers in turn
+    - `least-loaded` sends the request to the worker having the least estimated response time
+    - `p2c` (power of two choices) compares estimated response times of two random workers
+
+    The response time is estimated by the number of requests in flight reported by the worker
+    or awaited by the client, the moving average of the response time of the atask
+    measured by the client, the event loop lag of the worker, and the time to run callbacks
+    queued in the event loop of the worker, measured by the callback queued after them.
+    """
+    def __init__(
+        self,
+        namespace='default',
+        workers=None,
+        listen='tcp://127.0.0.1:0',
+        retry_interval=1.0,
+        max_in_flight=None,
+        reuse_port=False,
+        balance='round-robin',
+        load_interval=1.0,
+        latency_decay=0.2,
+    ):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param workers: addresses like `tcp://host:port` or `unix:///path/to/socket`
+                        of workers to send requests to, the own listening address by default
+        :type workers: list
+        :param listen: address to listen on for requests, the port 0 means any free port
+        :type listen: str
+        :param retry_interval: interval in seconds to skip a worker after the failed connection attempt
+        :type retry_interval: float
+        :param max_in_flight: max number of requests awaiting responses from every worker, sending more requests
+                              to the worker waits until some of them are responded, unlimited by default
+        :type max_in_flight: int
+        :param reuse_port: allow several worker processes to listen on the same TCP port
+        :type reuse_port: bool
+        :param balance: policy distributing requests among workers, `round-robin`, `least-loaded` or `p2c`
+        :type balance: str
+        :param load_interval: interval in seconds of reporting the worker load to clients, 0 to not report
+        :type load_interval: float
+        :param latency_decay: weight of the new response time in the moving average of response times
+        :type latency_decay: float
+        """
+        if balance not in BALANCE_POLICIES:
+            raise ValueError('Unknown balance policy: %s' % balance)
+        super().__init__(namespace=namespace)
+        self.workers = list(workers) if workers else []
+        self.listen = listen
+        self.retry_interval = retry_interval
+        self.max_in_flight = max_in_flight
+        self.reuse_port = reuse_port
+        self.balance = balance
+        self.load_interval = load_interval
+        self.latency_decay = latency_decay
+        self.address = None
+        self.direct_address = None
+        self._server = None
+        self._direct_server = None
+        self._connections = set()
+        self._refused = set()  # connections to draining workers, still awaiting responses
+        self._peers = {}
+        self._ring = HashRing(self.workers)
+        self._counter = itertools.count()
+        self._reporter = None
+
+    async def connect(self):
+        """
+        Overriden from the base class
+        """
+        for address in self.workers:
+            await self._get_connection(self._peer(address))
+
+    async def disconnect(self):
+        """
+        Overriden from the base class
+        """
+        peers, self._peers = self._peers, {}
+        for peer in peers.values():
+            if peer.connection:
+                await peer.connection.close()
+        for connection in list(self._connections) + list(self._refused):
+            await connection.close()
+
+    async def register_callback(self, callback):
+        """
+        Overriden from the base class
+        """
+        await super().register_callback(callback)
+        self._server, self.address = await start_server(self._on_connection, self.listen, self.reuse_port)
+        logger.info('Listening on %s for %s', self.address, self)
+        scheme, params = parse_address(self.address)
+        if self.reuse_port and scheme == 'tcp':
+            host, port = params
+            self._direct_server, self.direct_address = await start_server(self._on_connection, 'tcp://%s:0' % host)
+            logger.info('Listening on %s directly for %s', self.direct_address, self)
+        if self.load_interval:
+            self._reporter = asyncio.ensure_future(self._report_load())
+
+    async def unregister_callback(self):
+        """
+        Overriden from the base class
+        """
+        if self._reporter is not None:
+            self._reporter.cancel()
+            self._reporter = None
+        for server in (self._server, self._direct_server):
+            if server:
+                server.close()
+                await server.wait_closed()
+        self._server = self._direct_server = None
+        for connection in self._connections:
+            connection.refuse()
+        await super().unregister_callback()
+
+    async def drain(self, timeout=None):
+        """
+        Overriden from the base class
+        """
+        connections = list(self._connections)
+        processed = await asyncio.gather(*[connection.wait_processed(timeout) for connection in connections])
+        for connection in connections:
+            if connection.refusing:
+                await connection.close()
+        return all(processed)
+
+    def local_address(self):
+        """
+        Overriden from the base class
+        """
+        return self.direct_address or self.address
+
+    def pending_requests(self):
+        """
+        Overriden from the base class
+        """
+        requests = []
+        for peer in list(self._peers.values()):
+            if peer.connection is not None:
+                requests += [dict(request, worker=peer.address) for request in peer.connection.pending.snapshot()]
+        for connection in list(self._refused):
+            requests += connection.pending.snapshot()
+        return requests
+
+    def add_worker(self, address):
+        """
+        Add a worker to send requests to
+
+        :param address: address of the worker
+        :type address: str
+        """
+        if address not in self.workers:
+            self.workers.append(address)
+            self._ring.add(address)
+
+    def remove_worker(self, address):
+        """
+        Remove a worker, requests are not sent to it anymore
+
+        :param address: address of the worker
+        :type address: str
+        """
+        if address in self.workers:
+            self.workers.remove(address)
+            self._ring.remove(address)
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+        """
+        peers = [self._peer(target)] if target is not None else self._candidates(key, name)
+        loop = asyncio.get_event_loop()
+        for peer in peers:
+            for attempt in range(2):
+                connection = await self._get_connection(peer)
+                if connection is None:
+                    break
+                logger.info('Sending a request %s to %s', name, peer.address)
+                try:
+                    started = loop.time()
+                    response = await connection.send_request(name, content, reply=reply)
+                    if response is not None:
+                        peer.observe(name, loop.time() - started, self.latency_decay)
+                    return response
+                except RequestRefused:
+                    # the worker is draining, another worker may listen on the same address
+                    logger.info('Request %s refused by %s, reconnecting', name, peer.address)
+        logger.error('No workers available to send a request %s using %s', name, self)
+        return None
+
+    async def choose_target(self, name, key=None):
+        """
+        Overriden from the base class
+        """
+        now = asyncio.get_event_loop().time()
+        peers = [peer for peer in self._candidates(key, name) if peer.down_until <= now]
+        return peers[0].address if peers else None
+
+    def _candidates(self, key=None, name=None):
+        """Workers to try sending the next request to, in order of preference"""
+        if key is not None and self.workers:
+            return [self._peer(address) for address in self._ring.iterate(key)]
+        addresses = self.workers or ([self.address] if self.address else [])
+        peers = [self._peer(address) for address in addresses]
+        if not peers:
+            return []
+        start = next(self._counter) % len(peers)
+        peers = peers[start:] + peers[:start]
+        if self.balance == 'p2c' and len(peers) > 2:
+            chosen = min(random.sample(peers, 2), key=lambda peer: self._estimate(peer, name))
+            return [chosen] + [peer for peer in peers if peer is not chosen]
+        if self.balance != 'round-robin':
+            return sorted(peers, key=lambda peer: self._estimate(peer, name))
+        return peers
+
+    def _estimate(self, peer, name):
+        """Estimated response time of the worker for the atask"""
+        inflight, lag, delay = 0, 0, 0
+        connection = peer.connection
+        if connection is not None and not connection.closed:
+            inflight = connection.inflight
+            fresh = connection.load_time is not None and asyncio.get_event_loop().time() - connection.load_time <= 3 * self.load_interval
+            if fresh:
+                reported, lag, delay = connection.load
+                inflight = max(inflight, reported)
+        latency = peer.latency.get(name, None) or peer.latency.get(None, None) or MIN_LATENCY
+        return (inflight + 1) * latency + lag + delay
+
+    async def _report_load(self):
+        """Report the load of the worker to connected clients periodically"""
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.load_interval
+            await asyncio.sleep(self.load_interval)
+            lag = max(0, loop.time() - expected)
+            connections = list(self._connections)
+            inflight = sum(connection.processing for connection in connections)
+            delay = await _queue_delay(loop)
+            for connection in connections:
+                connection.report_load(inflight, lag, delay)
+
+    def _peer(self, address):
+        """Get or create a peer for the address"""
+        peer = self._peers.get(address, None)
+        if peer is None:
+            peer = self._peers[address] = _Peer(address)
+        return peer
+
+    async def _get_connection(self, peer):
+        """Get an open connection to the peer, connecting if necessary"""
+        async with peer.lock:
+            if peer.connection is not None and not peer.connection.closed:
+                if not peer.connection.refused:
+                    return peer.connection
+                self._refused.add(peer.connection)
+                peer.connection = None
+            loop = asyncio.get_event_loop()
+            if peer.down_until > loop.time():
+                return None
+            try:
+                reader, writer = await open_connection(peer.address)
+            except (OSError, ValueError) as ex:
+                logger.error('Error connecting to %s: %s', peer.address, ex)
+                peer.down_until = loop.time() + self.retry_interval
+                return None
+            logger.info('Connected to %s', peer.address)
+            peer.connection = Connection(reader, writer, on_close=self._refused.discard, max_in_flight=self.max_in_flight)
+            peer.connection.start()
+            return peer.connection
+
+    async def _on_connection(self, reader, writer):
+        """Client connection handler"""
+        connection = Connection(reader, writer, callback=self.callback, on_close=self._connections.discard)
+        self._connections.add(connection)
+        connection.start()
+
+
+async def _queue_delay(loop):
+    """Time in seconds to run callbacks ready to run in the event loop, measured by the callback queued after them"""
+    probe = loop.create_future()
+    started = loop.time()
+    loop.call_soon(_set_result, probe, None)
+    await probe
+    return loop.time() - started
@@ -0,0 +1,167 @@
+"""
+ATasks Thread Pool Transport module
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+
+from atasks.transport.base import Transport
+from atasks.transport.hashring import HashRing
+from atasks.transport.pending import _set_result
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Worker(object):
+    """
+    Worker thread running own event loop
+    """
+    def __init__(self, transport, index):
+        """
+        Constructor
+
+        :param transport: transport the worker belongs to
+        :type transport: ThreadPoolTransport
+        :param index: index of the worker in the pool
+        :type index: int
+        """
+        self.transport = transport
+        self.index = index
+        self.loop = None
+        self.queue = None
+        self.tasks = set()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run,
+            name='atasks-%s-%s' % (transport.namespace, index),
+            daemon=True,
+        )
+
+    def start(self):
+        """Start the worker thread and wait until the worker loop is ready"""
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self):
+        """Ask the worker loop to finish after all accepted requests are processed"""
+        self.submit(None)
+
+    def submit(self, request):
+        """
+        Pass a request to the worker loop, may be called from any thread
+
+        :param request: a tuple of name, content, awaiting future and loop of the future,
+                        or None to stop the worker; the future is None for requests with no reply
+        """
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, request)
+
+    def _run(self):
+        """Thread body"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.queue = asyncio.Queue()
+            self.ready.set()
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        """Get requests from the queue and start processing them"""
+        while True:
+            request = await self.queue.get()
+            if request is None:
+                break
+            task = asyncio.ensure_future(self._process(*request))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+
+    async def _process(self, name, content, future, loop):
+        """Process a request and pass the response back to the awaiting loop"""
+        callback = self.transport.callback
+        response = None
+        try:
+            if callback is None:
+                logger.error('No callback registered for %s to process %s', self.transport, name)
+            else:
+                response = await callback(name, content)
+        except Exception as ex:
+            logger.error('Error while calling a callback: %s', ex)
+        if future is not None:
+            loop.call_soon_threadsafe(_set_result, future, response)
+
+
+class ThreadPoolTransport(Transport):
+    """
+    In-process transport passing requests to a pool of worker threads.
+
+    Every worker thread runs its own event loop processing requests
+    using the registered callback. Requests and responses are passed
+    among loops in a thread-safe manner, so the transport may be used
+    by any of the worker loops as well as the loop which connected it.
+
+    All worker threads call the same registered callback, normally the
+    router of the namespace, which processes every request in the loop
+    of the worker thread and guards its state shared among threads by the lock.
+    """
+    def __init__(self, namespace='default', workers=None):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param workers: number of worker threads, CPU count by default
+        :type workers: int
+        """
+        super().__init__(namespace=namespace)
+        self.workers = workers or os.cpu_count() or 1
+        self._workers = []
+        self._counter = itertools.count()
+
+    async def connect(self):
+        """
+        Overriden from the base class
+        """
+        if self._workers:
+            return
+        logger.info('Starting %s worker threads for %s', self.workers, self)
+        self._workers = [_Worker(self, i) for i in range(self.workers)]
+        self._ring = HashRing(range(self.workers))
+        for worker in self._workers:
+            worker.start()
+
+    async def disconnect(self):
+        """
+        Overriden from the base class
+        """
+        logger.info('Stopping worker threads for %s', self)
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+        loop = asyncio.get_event_loop()
+        for worker in workers:
+            await loop.run_in_executor(None, worker.thread.join)
+
+    def _choose_worker(self, key=None):
+        """Choose a worker to process the next request"""
+        if key is not None:
+            return self._workers[self._ring.get(key)]
+        return self._workers[next(self._counter) % len(self._workers)]
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+        """
+        logger.info('Sending a request %s using %s', name, self)
+        worker = self._choose_worker(key)
+        if not reply:
+            worker.submit((name, content, None, None))
+            return None
+        future = asyncio.get_event_loop().create_future()
+        worker.submit((name, content, future, asyncio.get_event_loop()))
+        return await future
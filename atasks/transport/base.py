@@ -2,6 +2,7 @@
 ATasks Base Transport module
 """
 
+import asyncio
 import logging
 
 from atasks.namespaces import namespaces
@@ -49,7 +50,7 @@ class Transport(object):
         """
         raise NotImplementedError()
 
-    async def send_request(self, name, content):
+    async def send_request(self, name, content, key=None, reply=True, target=None):
         """
         Send a request to a service
 
@@ -57,11 +58,47 @@ class Transport(object):
         :type name: str
         :param content: request to be sent
         :type content: bytes
+        :param key: affinity key, requests having the same key should be sent
+                    to the same service if the transport supports affinity
+        :type key: any
+        :param reply: False to send a request with no reply,
+                      the transport returns None as soon as the request is accepted
+        :type reply: bool
+        :param target: address of the worker to send the request to, as returned by `local_address()`
+                       of the worker transport, ignored by transports not addressing workers
+        :type target: str
         :returns: response to the request
         :rtype: bytes
         """
         raise NotImplementedError()
 
+    async def choose_target(self, name, key=None):
+        """
+        Choose the worker to send the next request to
+
+        Can be used to override in ancestors balancing requests among workers on the client side,
+        so the caller may keep the state of every worker, f.e. large arguments already sent to it.
+
+        :param name: name of the request
+        :type name: str
+        :param key: affinity key of the request
+        :type key: any
+        :returns: address passed as the `target` of the request, or None if the worker is not chosen by the client
+        :rtype: str
+        """
+        return None
+
+    def local_address(self):
+        """
+        Address of this worker which other workers may send requests to
+
+        Can be used to override in ancestor addressing workers.
+
+        :returns: address passed as the `target` of requests, or None if workers are not addressable
+        :rtype: str
+        """
+        return None
+
     async def register_callback(self, callback):
         """
         Register a callback to receive requests.
@@ -91,6 +128,85 @@ class Transport(object):
         logger.info("Unregistering a callback for %s in %s", self, self.namespace)
         self.callback = None
 
+    async def drain(self, timeout=None):
+        """
+        Wait until responses to requests received before unregistering the callback are sent
+
+        Can be used to override in ancestor, to flush responses
+        before the transport is disconnected.
+
+        :param timeout: max time to wait in seconds, unlimited by default
+        :type timeout: float
+        :returns: True if all responses have been sent
+        :rtype: bool
+        """
+        return True
+
+    def pending_requests(self):
+        """
+        Requests sent by the transport and awaiting responses
+
+        Can be used to override in ancestor keeping the table of requests in flight.
+
+        :returns: list of request id used by the transport, name and age in seconds
+        :rtype: list
+        """
+        return []
+
+    async def register_atask(self, name, options):
+        """
+        Notify about the atask registered while the callback is registered
+
+        Can be used to override in ancestor, to start receiving
+        requests for the atask registered after the callback.
+
+        :param name: name of the atask
+        :type name: str
+        :param options: options of the atask
+        :type options: dict
+        """
+        pass
+
+    def options(self, name):
+        """
+        Get options of the atask registered in the namespace of the transport
+
+        :param name: name of the atask
+        :type name: str
+        :returns: options of the atask, or empty options if the atask is not registered
+        :rtype: dict
+        """
+        registry = self.served_registry()
+        item = registry.get(name) if registry else None
+        return item.options if item else {}
+
+    def routes(self):
+        """
+        Get atasks registered in the namespace of the transport
+
+        Can be used by ancestors to receive requests only for registered atasks.
+
+        :returns: list of name and options pairs
+        :rtype: list
+        """
+        registry = self.served_registry()
+        if not registry:
+            return []
+        return [(name, item.options) for name, item in registry.items()]
+
+    def served_registry(self):
+        """
+        Get the registry of atasks served by the transport
+
+        The registry of the namespace of the transport, or the multiplexer registered in the namespace
+        if the transport is shared by namespaces, see `atasks.transport.multiplex`.
+
+        :returns: registry having `get()` and `items()` methods, or None
+        :rtype: atasks.registry.Manager
+        """
+        ns = namespaces.get(self.namespace)
+        return getattr(ns, 'multiplexer', None) or getattr(ns, 'registry', None)
+
 
 class LoopbackTransport(Transport):
     """
@@ -108,16 +224,28 @@ class LoopbackTransport(Transport):
         """
         logger.info('Disconnecting Loopback transport %s', self)
 
-    async def send_request(self, name, content):
+    async def send_request(self, name, content, key=None, reply=True, target=None):
         """
         Overriden from the base class
         """
         logger.info('Sending a request %s using Loopback transport', name)
+        if not reply:
+            asyncio.ensure_future(self._notify(name, content))
+            return None
         try:
             return await self.callback(name, content)
         except Exception as ex:
             logger.error('Error while calling a callback: %s', ex)
 
+    async def _notify(self, name, content):
+        """
+        Call a callback for a request with no reply
+        """
+        try:
+            await self.callback(name, content)
+        except Exception as ex:
+            logger.error('Error while calling a callback: %s', ex)
+
 
 def get_transport(namespace='default'):
     """
@@ -0,0 +1,96 @@
+"""
+ATasks consistent hash ring used for key-affinity routing
+"""
+import bisect
+import hashlib
+
+
+def _hash(value):
+    """Stable hash of the value, the same among processes and hosts"""
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """
+    Consistent hash ring
+
+    Maps keys to nodes. Adding or removing a node remaps only keys
+    which belong to that node.
+    """
+    def __init__(self, nodes=(), replicas=64):
+        """
+        Constructor
+
+        :param nodes: initial nodes of the ring
+        :type nodes: iterable
+        :param replicas: number of points of every node on the ring
+        :type replicas: int
+        """
+        self.replicas = replicas
+        self._points = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    def __contains__(self, node):
+        """Check whether the node is on the ring"""
+        return node in self._nodes
+
+    def __len__(self):
+        """Number of nodes on the ring"""
+        return len(self._nodes)
+
+    def add(self, node):
+        """
+        Add a node to the ring
+
+        :param node: node to be added, should have stable `str()` representation
+        """
+        if node in self._nodes:
+            return
+        points = [(_hash('%s#%s' % (node, i)), node) for i in range(self.replicas)]
+        self._nodes[node] = points
+        for point in points:
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        """
+        Remove a node from the ring
+
+        :param node: node to be removed
+        """
+        points = set(self._nodes.pop(node, ()))
+        if points:
+            self._points = [point for point in self._points if point not in points]
+
+    def get(self, key):
+        """
+        Get the node for the key
+
+        :param key: key, should have stable `str()` representation
+        :returns: node or None if the ring is empty
+        """
+        for node in self.iterate(key):
+            return node
+        return None
+
+    def iterate(self, key):
+        """
+        Iterate over distinct nodes in order of preference for the key
+
+        The first node is the owner of the key, next ones
+        take the key over if previous ones are not available.
+
+        :param key: key, should have stable `str()` representation
+        """
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, (_hash(key),))
+        seen = set()
+        for i in range(len(self._points)):
+            point, node = self._points[(start + i) % len(self._points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self._nodes):
+                    return
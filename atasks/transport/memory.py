@@ -0,0 +1,665 @@
+"""
+ATasks in-memory AMQP broker
+
+Implements the subset of the `aio_pika` API used by the `AMQPTransport`
+over an in-process broker, to exercise, load-test and benchmark
+the transport with no real AMQP broker available:
+
+    from atasks.transport.memory import Broker
+
+    broker = Broker(latency=0.001, bandwidth=100000000)
+    AMQPTransport(driver=broker)
+
+Transports sharing the same broker instance exchange messages with each other.
+The broker injects the configured latency into every delivery and publisher
+confirmation, and passes published bytes through the single link
+of the configured bandwidth.
+"""
+import asyncio
+import enum
+import itertools
+import logging
+
+from atasks.transport.hashring import HashRing
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExchangeType(enum.Enum):
+    """
+    Exchange types supported by the broker
+    """
+    DIRECT = 'direct'
+    FANOUT = 'fanout'
+    TOPIC = 'topic'
+    CONSISTENT_HASH = 'x-consistent-hash'
+
+
+class BrokerError(Exception):
+    """
+    Error reported by the broker, like a missing exchange
+    """
+
+
+class Message(object):
+    """
+    Message to be published
+    """
+    def __init__(self, body, correlation_id=None, reply_to=None, type=None, headers=None):
+        """
+        Constructor
+
+        :param body: body of the message
+        :type body: bytes
+        :param correlation_id: correlation id of the message
+        :type correlation_id: str
+        :param reply_to: name of the queue to reply to
+        :type reply_to: str
+        :param type: type of the message
+        :type type: str
+        :param headers: headers of the message
+        :type headers: dict
+        """
+        self.body = body
+        self.correlation_id = correlation_id
+        self.reply_to = reply_to
+        self.type = type
+        self.headers = headers or {}
+
+    @property
+    def body_size(self):
+        """Size of the message body"""
+        return len(self.body)
+
+    def info(self):
+        """Dict representation of the message"""
+        return {
+            'body_size': self.body_size,
+            'correlation_id': self.correlation_id,
+            'reply_to': self.reply_to,
+            'type': self.type,
+            'headers': self.headers,
+        }
+
+
+class IncomingMessage(Message):
+    """
+    Message delivered to a consumer
+    """
+    def __init__(self, message, exchange, routing_key, consumer, delivery_tag):
+        """
+        Constructor
+
+        :param message: published message
+        :type message: Message
+        :param exchange: name of the exchange the message has been published to
+        :type exchange: str
+        :param routing_key: routing key of the message
+        :type routing_key: str
+        :param consumer: consumer the message is delivered to
+        :type consumer: _Consumer
+        :param delivery_tag: delivery tag of the message
+        :type delivery_tag: int
+        """
+        super().__init__(message.body, message.correlation_id, message.reply_to, message.type, message.headers)
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.consumer = consumer
+        self.consumer_tag = consumer.tag
+        self.delivery_tag = delivery_tag
+        self.processed = False
+
+    def info(self):
+        """Dict representation of the message"""
+        info = super().info()
+        info.update(
+            consumer_tag=self.consumer_tag,
+            delivery_tag=self.delivery_tag,
+            exchange=self.exchange,
+            redelivered=False,
+            routing_key=self.routing_key,
+        )
+        return info
+
+    def ack(self):
+        """Acknowledge the message"""
+        self._settle()
+
+    def reject(self, requeue=False):
+        """
+        Reject the message
+
+        :param requeue: return the message back to the queue
+        :type requeue: bool
+        """
+        self._settle()
+        if requeue:
+            self.consumer.queue.put(self, self.exchange, self.routing_key)
+
+    def process(self, requeue=False):
+        """
+        Acknowledge the message when the block is finished, or reject it on exception
+
+        :param requeue: return the message back to the queue on exception
+        :type requeue: bool
+        :returns: asynchronous context manager returning the message
+        """
+        return _Processing(self, requeue)
+
+    def _settle(self):
+        """Release the prefetch window of the consumer"""
+        if self.processed:
+            raise BrokerError('Message %s is already processed' % self.delivery_tag)
+        self.processed = True
+        self.consumer.release()
+
+
+class _Processing(object):
+    """
+    Asynchronous context manager settling the message when the block is finished
+    """
+    def __init__(self, message, requeue):
+        """
+        Constructor
+
+        :param message: message being processed
+        :type message: Message
+        :param requeue: return the message back to the queue on exception
+        :type requeue: bool
+        """
+        self.message = message
+        self.requeue = requeue
+
+    async def __aenter__(self):
+        """Start processing the message"""
+        return self.message
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """Acknowledge the message, or reject it on exception"""
+        if exc_type is None:
+            self.message.ack()
+        elif issubclass(exc_type, Exception):
+            self.message.reject(requeue=self.requeue)
+        return False
+
+
+class Exchange(object):
+    """
+    Exchange routing published messages to bound queues
+    """
+    def __init__(self, broker, name, type):
+        """
+        Constructor
+
+        :param broker: broker owning the exchange
+        :type broker: Broker
+        :param name: name of the exchange
+        :type name: str
+        :param type: type of the exchange
+        :type type: ExchangeType
+        """
+        self.broker = broker
+        self.name = name
+        self.type = ExchangeType(getattr(type, 'value', type))
+        self.bindings = {}
+        self._ring = HashRing()
+
+    def bind(self, queue, routing_key):
+        """Bind the queue to the exchange"""
+        self.bindings[(queue.name, routing_key)] = queue
+        if self.type == ExchangeType.CONSISTENT_HASH:
+            for i in range(int(routing_key or 1)):
+                self._ring.add((queue.name, i))
+
+    def unbind(self, queue):
+        """Unbind the queue from the exchange"""
+        for name, routing_key in list(self.bindings):
+            if name == queue.name:
+                del self.bindings[(name, routing_key)]
+                for i in range(int(routing_key or 1) if self.type == ExchangeType.CONSISTENT_HASH else 0):
+                    self._ring.remove((name, i))
+
+    def route(self, routing_key):
+        """
+        Queues receiving the message published with the routing key
+
+        :param routing_key: routing key of the message
+        :type routing_key: str
+        :returns: list of queues
+        :rtype: list
+        """
+        if self.type == ExchangeType.CONSISTENT_HASH:
+            node = self._ring.get(routing_key)
+            return [self.broker.queues[node[0]]] if node else []
+        queues = []
+        for (name, key), queue in self.bindings.items():
+            if queue in queues:
+                continue
+            if self.type == ExchangeType.FANOUT:
+                queues.append(queue)
+            elif self.type == ExchangeType.DIRECT and key == routing_key:
+                queues.append(queue)
+            elif self.type == ExchangeType.TOPIC and _topic_match(key, routing_key):
+                queues.append(queue)
+        return queues
+
+
+class _ChannelExchange(object):
+    """
+    Exchange as seen through a channel
+    """
+    def __init__(self, channel, exchange):
+        """
+        Constructor
+
+        :param channel: channel the exchange is used through
+        :type channel: Channel
+        :param exchange: exchange of the broker, None for the default exchange
+        :type exchange: Exchange
+        """
+        self.channel = channel
+        self.exchange = exchange
+        self.name = exchange.name if exchange else ''
+
+    async def publish(self, message, routing_key, mandatory=False):
+        """
+        Publish the message
+
+        Waits until the message is passed through the link, and additionally
+        until the broker confirms it if the channel has publisher confirms enabled.
+
+        :param message: message to be published
+        :type message: Message
+        :param routing_key: routing key of the message
+        :type routing_key: str
+        :param mandatory: raise `BrokerError` if the message is not routed to any queue
+        :type mandatory: bool
+        """
+        broker = self.channel.connection.broker
+        self.channel.check()
+        await broker.transfer(message.body_size)
+        if self.exchange is None:
+            queue = broker.queues.get(routing_key, None)
+            queues = [queue] if queue else []
+        else:
+            queues = self.exchange.route(routing_key)
+        if not queues:
+            logger.debug('Message published to %r with %r is not routed', self.name, routing_key)
+            if mandatory:
+                await asyncio.sleep(2 * broker.latency)
+                raise BrokerError('Message published to %r with %r is returned' % (self.name, routing_key))
+        loop = asyncio.get_event_loop()
+        for queue in queues:
+            loop.call_later(broker.latency, queue.put, message, self.name, routing_key)
+        if self.channel.publisher_confirms:
+            await asyncio.sleep(2 * broker.latency)
+
+
+class _Consumer(object):
+    """
+    Consumer of the queue
+    """
+    def __init__(self, queue, channel, callback, tag, no_ack):
+        """
+        Constructor
+
+        :param queue: consumed queue
+        :type queue: Queue
+        :param channel: channel of the consumer
+        :type channel: Channel
+        :param callback: callback receiving messages
+        :type callback: awaitable(message: IncomingMessage)
+        :param tag: consumer tag
+        :type tag: str
+        :param no_ack: messages are acknowledged when delivered
+        :type no_ack: bool
+        """
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.tag = tag
+        self.no_ack = no_ack
+        self.prefetch_count = channel.prefetch_count
+        self.unacked = 0
+
+    @property
+    def available(self):
+        """The consumer may receive the next message"""
+        return self.no_ack or not self.prefetch_count or self.unacked < self.prefetch_count
+
+    def release(self):
+        """Release a place in the prefetch window"""
+        if not self.no_ack:
+            self.unacked -= 1
+            self.queue.dispatch()
+
+
+class Queue(object):
+    """
+    Queue of messages
+    """
+    def __init__(self, broker, name, exclusive=False, owner=None):
+        """
+        Constructor
+
+        :param broker: broker owning the queue
+        :type broker: Broker
+        :param name: name of the queue
+        :type name: str
+        :param exclusive: the queue is deleted when the owner connection is closed
+        :type exclusive: bool
+        :param owner: connection declared the exclusive queue
+        :type owner: Connection
+        """
+        self.broker = broker
+        self.name = name
+        self.exclusive = exclusive
+        self.owner = owner
+        self.messages = []
+        self.consumers = []
+        self._rotation = 0
+
+    def put(self, message, exchange, routing_key):
+        """Enqueue the message and deliver it if possible"""
+        if self.broker.queues.get(self.name, None) is not self:
+            return
+        self.messages.append((message, exchange, routing_key))
+        self.dispatch()
+
+    def dispatch(self):
+        """Deliver enqueued messages to available consumers in turn"""
+        while self.messages and self.consumers:
+            consumers = self.consumers[self._rotation:] + self.consumers[:self._rotation]
+            consumer = next((c for c in consumers if c.available), None)
+            if consumer is None:
+                return
+            self._rotation = (self.consumers.index(consumer) + 1) % len(self.consumers)
+            message, exchange, routing_key = self.messages.pop(0)
+            incoming = IncomingMessage(message, exchange, routing_key, consumer, next(self.broker.tags))
+            if consumer.no_ack:
+                incoming.processed = True
+            else:
+                consumer.unacked += 1
+            asyncio.ensure_future(self._deliver(consumer, incoming))
+
+    async def _deliver(self, consumer, message):
+        """Pass the message to the consumer callback"""
+        try:
+            await consumer.callback(message)
+        except Exception as ex:
+            logger.error('Error while consuming %s from %s: %s', message.delivery_tag, self.name, ex)
+
+
+class _ChannelQueue(object):
+    """
+    Queue as seen through a channel
+    """
+    def __init__(self, channel, queue):
+        """
+        Constructor
+
+        :param channel: channel the queue is used through
+        :type channel: Channel
+        :param queue: queue of the broker
+        :type queue: Queue
+        """
+        self.channel = channel
+        self.queue = queue
+        self.name = queue.name
+
+    async def bind(self, exchange, routing_key=None):
+        """
+        Bind the queue to the exchange
+
+        :param exchange: exchange or its name
+        :param routing_key: binding key, or the weight of the queue for the consistent hash exchange
+        :type routing_key: str
+        """
+        self.channel.check()
+        name = getattr(exchange, 'name', exchange)
+        broker = self.channel.connection.broker
+        if name not in broker.exchanges:
+            raise BrokerError('Exchange %r not found' % name)
+        broker.exchanges[name].bind(self.queue, self.name if routing_key is None else routing_key)
+
+    async def consume(self, callback, no_ack=False):
+        """
+        Start consuming messages from the queue
+
+        :param callback: callback receiving messages
+        :type callback: awaitable(message: IncomingMessage)
+        :param no_ack: messages are acknowledged when delivered
+        :type no_ack: bool
+        :returns: consumer tag
+        :rtype: str
+        """
+        self.channel.check()
+        tag = 'ctag.%s' % next(self.channel.connection.broker.tags)
+        consumer = _Consumer(self.queue, self.channel, callback, tag, no_ack)
+        self.queue.consumers.append(consumer)
+        self.channel.consumers.append(consumer)
+        self.queue.dispatch()
+        return tag
+
+    async def cancel(self, consumer_tag):
+        """
+        Stop consuming messages by the consumer
+
+        :param consumer_tag: consumer tag returned by `consume`
+        :type consumer_tag: str
+        """
+        for consumer in list(self.queue.consumers):
+            if consumer.tag == consumer_tag:
+                self.channel.cancel(consumer)
+
+
+class Channel(object):
+    """
+    Channel opened over the connection
+    """
+    def __init__(self, connection, publisher_confirms=True):
+        """
+        Constructor
+
+        :param connection: connection owning the channel
+        :type connection: Connection
+        :param publisher_confirms: publishing waits for the broker confirmation
+        :type publisher_confirms: bool
+        """
+        self.connection = connection
+        self.publisher_confirms = publisher_confirms
+        self.prefetch_count = 0
+        self.consumers = []
+        self.closed = False
+        self.default_exchange = _ChannelExchange(self, None)
+
+    def check(self):
+        """Raise an exception if the channel is closed"""
+        if self.closed:
+            raise BrokerError('Channel is closed')
+
+    async def set_qos(self, prefetch_count=0):
+        """
+        Limit the number of unacknowledged messages delivered to every next consumer
+
+        :param prefetch_count: max number of unacknowledged messages, 0 means no limit
+        :type prefetch_count: int
+        """
+        self.check()
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(self, name, type=ExchangeType.DIRECT, durable=False):
+        """
+        Declare the exchange
+
+        :param name: name of the exchange
+        :type name: str
+        :param type: type of the exchange
+        :type type: ExchangeType or str
+        :param durable: ignored, the broker keeps everything in memory
+        :type durable: bool
+        :returns: exchange
+        """
+        self.check()
+        broker = self.connection.broker
+        if ExchangeType(getattr(type, 'value', type)) == ExchangeType.CONSISTENT_HASH and not broker.consistent_hash:
+            raise BrokerError('Unknown exchange type %r' % ExchangeType.CONSISTENT_HASH.value)
+        exchange = broker.exchanges.get(name, None)
+        if exchange is None:
+            exchange = broker.exchanges[name] = Exchange(broker, name, type)
+        elif exchange.type != ExchangeType(getattr(type, 'value', type)):
+            raise BrokerError('Exchange %r is declared with another type' % name)
+        return _ChannelExchange(self, exchange)
+
+    async def declare_queue(self, name='', exclusive=False, durable=False):
+        """
+        Declare the queue
+
+        :param name: name of the queue, the name is generated if empty
+        :type name: str
+        :param exclusive: the queue is deleted when the connection is closed
+        :type exclusive: bool
+        :param durable: ignored, the broker keeps everything in memory
+        :type durable: bool
+        :returns: queue
+        """
+        self.check()
+        broker = self.connection.broker
+        name = name or 'amq.gen-%s' % next(broker.tags)
+        queue = broker.queues.get(name, None)
+        if queue is None:
+            queue = broker.queues[name] = Queue(broker, name, exclusive, self.connection if exclusive else None)
+        elif queue.exclusive and queue.owner is not self.connection:
+            raise BrokerError('Queue %r is exclusive' % name)
+        return _ChannelQueue(self, queue)
+
+    def cancel(self, consumer):
+        """Cancel the consumer"""
+        if consumer in consumer.queue.consumers:
+            consumer.queue.consumers.remove(consumer)
+        if consumer in self.consumers:
+            self.consumers.remove(consumer)
+        consumer.queue.dispatch()
+
+    async def close(self):
+        """Close the channel"""
+        for consumer in list(self.consumers):
+            self.cancel(consumer)
+        self.closed = True
+
+
+class Connection(object):
+    """
+    Connection to the broker
+    """
+    def __init__(self, broker):
+        """
+        Constructor
+
+        :param broker: broker to connect to
+        :type broker: Broker
+        """
+        self.broker = broker
+        self.channels = []
+        self.closed = False
+
+    async def channel(self, publisher_confirms=True):
+        """
+        Open a channel
+
+        :param publisher_confirms: publishing waits for the broker confirmation
+        :type publisher_confirms: bool
+        :returns: channel
+        :rtype: Channel
+        """
+        if self.closed:
+            raise BrokerError('Connection is closed')
+        channel = Channel(self, publisher_confirms=publisher_confirms)
+        self.channels.append(channel)
+        return channel
+
+    async def close(self):
+        """Close the connection deleting exclusive queues declared by it"""
+        for channel in self.channels:
+            await channel.close()
+        self.closed = True
+        self.broker.delete_exclusive(self)
+
+
+class Broker(object):
+    """
+    In-memory broker, may be passed instead of the `aio_pika` module
+    as a driver of the `AMQPTransport`
+    """
+    Message = Message
+    ExchangeType = ExchangeType
+
+    def __init__(self, latency=0, bandwidth=None, consistent_hash=True):
+        """
+        Constructor
+
+        :param latency: one-way delay in seconds between the client and the broker
+        :type latency: float
+        :param bandwidth: bandwidth of the link in bytes per second shared by all clients, unlimited by default
+        :type bandwidth: float
+        :param consistent_hash: the consistent hash exchange type is supported,
+                                like RabbitMQ having the `rabbitmq_consistent_hash_exchange` plugin enabled
+        :type consistent_hash: bool
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.consistent_hash = consistent_hash
+        self.exchanges = {'': Exchange(self, '', ExchangeType.DIRECT)}
+        self.queues = {}
+        self.tags = itertools.count(1)
+        self._link_free = 0
+
+    async def connect_robust(self, url=None, loop=None):
+        """
+        Connect to the broker
+
+        :param url: ignored, the broker is in the same process
+        :type url: str
+        :returns: connection
+        :rtype: Connection
+        """
+        await asyncio.sleep(2 * self.latency)
+        return Connection(self)
+
+    async def transfer(self, size):
+        """
+        Wait until the number of bytes is passed through the link
+
+        :param size: number of bytes
+        :type size: int
+        """
+        if not self.bandwidth:
+            return
+        loop = asyncio.get_event_loop()
+        self._link_free = max(self._link_free, loop.time()) + size / self.bandwidth
+        await asyncio.sleep(self._link_free - loop.time())
+
+    def delete_exclusive(self, connection):
+        """Delete exclusive queues declared by the connection"""
+        for name, queue in list(self.queues.items()):
+            if queue.owner is connection:
+                del self.queues[name]
+                for exchange in self.exchanges.values():
+                    exchange.unbind(queue)
+
+
+def _topic_match(binding_key, routing_key):
+    """Check whether the routing key matches the topic binding key"""
+    return _match_words((binding_key or '').split('.'), routing_key.split('.'))
+
+
+def _match_words(pattern, words):
+    """Match words of the routing key by words of the binding key"""
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(_match_words(pattern[1:], words[i:]) for i in range(len(words) + 1))
+    if not words or pattern[0] not in ('*', words[0]):
+        return False
+    return _match_words(pattern[1:], words[1:])
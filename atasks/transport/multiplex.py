@@ -0,0 +1,216 @@
+"""
+ATasks transport shared by namespaces
+
+Many namespaces may share one transport, f.e. one connection to the broker
+with its channels and the response queue, instead of creating a transport for every namespace:
+
+    shared = Multiplexer(AMQPTransport('shared', url=url))
+    MultiplexedTransport('billing', shared)
+    MultiplexedTransport('reports', shared)
+
+Requests are sent by the shared transport with the namespace in the request name,
+like `billing/charge`, and dispatched by the receiving side to the namespace.
+The namespace of the shared transport is dedicated to it, and should not be used otherwise.
+"""
+import logging
+
+from atasks.namespaces import namespaces
+from atasks.transport.base import Transport
+
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = '/'
+
+
+def envelope(namespace, name):
+    """
+    Name of the request sent by the shared transport
+
+    :param namespace: namespace of the atask
+    :type namespace: str
+    :param name: name of the atask
+    :type name: str
+    :returns: name containing the namespace
+    :rtype: str
+    """
+    return '%s%s%s' % (namespace, SEPARATOR, name)
+
+
+class Multiplexer(object):
+    """
+    Transport shared by namespaces
+
+    Registered as the multiplexer of the namespace of the shared transport,
+    so the shared transport receives requests for atasks of all namespaces
+    served by multiplexed transports, see `Transport.served_registry()`.
+    """
+    def __init__(self, transport):
+        """
+        Constructor
+
+        :param transport: transport to be shared
+        :type transport: Transport
+        """
+        self.transport = transport
+        self.transports = {}  # multiplexed transports by namespace
+        self._connected = set()
+        namespaces.register(transport.namespace, multiplexer=self)
+
+    def get(self, name):
+        """
+        Registry item of the atask of the served namespace
+
+        :param name: name of the request sent by the shared transport
+        :type name: str
+        :returns: registry item or None
+        :rtype: atasks.registry.RegistryItem
+        """
+        namespace, sep, name = name.partition(SEPARATOR)
+        registry = getattr(namespaces.get(namespace), 'registry', None)
+        if not sep or namespace not in self.transports or registry is None:
+            return None
+        return registry.get(name)
+
+    def items(self):
+        """
+        Registered atasks of served namespaces
+
+        :returns: list of request name and registry item pairs
+        :rtype: list
+        """
+        items = []
+        for namespace, transport in self.transports.items():
+            registry = getattr(namespaces.get(namespace), 'registry', None)
+            if transport.callback is None or registry is None:
+                continue
+            items += [(envelope(namespace, name), item) for name, item in registry.items()]
+        return items
+
+    async def connect(self, transport):
+        """
+        Connect the shared transport for the multiplexed one
+
+        :param transport: multiplexed transport
+        :type transport: MultiplexedTransport
+        """
+        if not self._connected:
+            await self.transport.connect()
+        self._connected.add(transport.namespace)
+
+    async def disconnect(self, transport):
+        """
+        Disconnect the shared transport if no multiplexed transports are connected
+
+        :param transport: multiplexed transport
+        :type transport: MultiplexedTransport
+        """
+        self._connected.discard(transport.namespace)
+        if not self._connected:
+            await self.transport.disconnect()
+
+    async def serve(self, transport):
+        """
+        Start receiving requests for the namespace of the multiplexed transport
+
+        :param transport: multiplexed transport having the callback registered
+        :type transport: MultiplexedTransport
+        """
+        if self.transport.callback is None:
+            await self.transport.register_callback(self._on_request)
+            return
+        for name, options in transport.routes():
+            await self.transport.register_atask(envelope(transport.namespace, name), options)
+
+    async def stop(self, transport):
+        """
+        Stop receiving requests if no multiplexed transports have callbacks registered
+
+        Requests for atasks of the namespace may still be received by the shared transport,
+        they fail then.
+
+        :param transport: multiplexed transport having the callback unregistered
+        :type transport: MultiplexedTransport
+        """
+        if self.transport.callback is not None and all(t.callback is None for t in self.transports.values()):
+            await self.transport.unregister_callback()
+
+    async def _on_request(self, name, content, **hints):
+        """Dispatch the request received by the shared transport to the namespace"""
+        namespace, sep, name = name.partition(SEPARATOR)
+        transport = self.transports.get(namespace, None)
+        if transport is None or transport.callback is None:
+            logger.error('No callback registered for %s in %s', name, namespace)
+            return None
+        return await transport.callback(name, content, **hints)
+
+
+class MultiplexedTransport(Transport):
+    """
+    Transport of the namespace sending and receiving requests using the shared transport
+    """
+    def __init__(self, namespace, multiplexer):
+        """
+        Create a transport
+
+        :param namespace: namespace where the transport should be registered to work for
+        :type namespace: str
+        :param multiplexer: shared transport
+        :type multiplexer: Multiplexer
+        """
+        super().__init__(namespace=namespace)
+        self.multiplexer = multiplexer
+        multiplexer.transports[namespace] = self
+
+    async def connect(self):
+        """
+        Overriden from the base class
+        """
+        await self.multiplexer.connect(self)
+
+    async def disconnect(self):
+        """
+        Overriden from the base class
+        """
+        await self.multiplexer.disconnect(self)
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """
+        Overriden from the base class
+        """
+        return await self.multiplexer.transport.send_request(
+            envelope(self.namespace, name), content, key=key, reply=reply, target=target,
+        )
+
+    def local_address(self):
+        """
+        Overriden from the base class
+        """
+        return self.multiplexer.transport.local_address()
+
+    async def register_callback(self, callback):
+        """
+        Overriden from the base class
+        """
+        await super().register_callback(callback)
+        await self.multiplexer.serve(self)
+
+    async def unregister_callback(self):
+        """
+        Overriden from the base class
+        """
+        await super().unregister_callback()
+        await self.multiplexer.stop(self)
+
+    async def drain(self, timeout=None):
+        """
+        Overriden from the base class
+        """
+        return await self.multiplexer.transport.drain(timeout)
+
+    async def register_atask(self, name, options):
+        """
+        Overriden from the base class
+        """
+        if self.callback is not None:
+            await self.multiplexer.transport.register_atask(envelope(self.namespace, name), options)
@@ -0,0 +1,207 @@
+"""
+ATasks table of requests awaiting responses
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending(object):
+    """
+    Request awaiting a response
+    """
+    __slots__ = ('future', 'name', 'started')
+
+    def __init__(self, future, name):
+        """
+        Constructor
+
+        :param future: future awaiting the response
+        :type future: asyncio.Future
+        :param name: name of the request
+        :type name: str
+        """
+        self.future = future
+        self.name = name
+        self.started = time.monotonic()
+
+
+class _Opened(object):
+    """
+    Asynchronous context manager of the request opened in the table
+    """
+    def __init__(self, table, name):
+        """
+        Constructor
+
+        :param table: table of requests
+        :type table: PendingRequests
+        :param name: name of the request
+        :type name: str
+        """
+        self.table = table
+        self.name = name
+        self.request_id = None
+        self.future = None
+
+    async def __aenter__(self):
+        """Wait for a free place in the window and put the request to the table"""
+        table = self.table
+        if table._window is not None:
+            await table._window.acquire()
+        self.request_id = next(table._ids)
+        self.future = asyncio.get_event_loop().create_future()
+        table._requests[self.request_id] = _Pending(self.future, self.name)
+        return self.request_id, self.future
+
+    async def __aexit__(self, exc_type, exc, tb):
+        """Remove the request from the table"""
+        table = self.table
+        del table._requests[self.request_id]
+        if not self.future.done():
+            self.future.cancel()
+        if table._window is not None:
+            table._window.release()
+        return False
+
+
+class PendingRequests(object):
+    """
+    Table of requests sent and awaiting responses
+
+    Requests are identified by integer ids unique for the table.
+    The number of requests in flight may be limited, callers
+    opening a request above the limit wait until other requests are finished.
+    """
+    def __init__(self, max_in_flight=None):
+        """
+        Constructor
+
+        :param max_in_flight: max number of requests in flight, unlimited by default
+        :type max_in_flight: int
+        """
+        self.max_in_flight = max_in_flight
+        self._requests = {}
+        self._ids = itertools.count(1)
+        self._window = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
+    def __len__(self):
+        """Number of requests in flight"""
+        return len(self._requests)
+
+    def __contains__(self, request_id):
+        """Check whether the request is in flight"""
+        return request_id in self._requests
+
+    def open(self, name=''):
+        """
+        Open a request, waiting for a free place in the window if necessary
+
+        The request is removed from the table when the block is finished,
+        whether the response has been received, or the caller failed or has been cancelled.
+
+        :param name: name of the request
+        :type name: str
+        :returns: asynchronous context manager returning id of the request and the future awaiting the response
+        """
+        return _Opened(self, name)
+
+    def resolve(self, request_id, response):
+        """
+        Pass the response to the request awaiting it
+
+        :param request_id: id of the request
+        :type request_id: int
+        :param response: response to the request
+        :type response: bytes
+        :returns: True if the request has been awaiting the response
+        :rtype: bool
+        """
+        pending = self._requests.get(request_id, None)
+        if pending is None or pending.future.done():
+            return False
+        pending.future.set_result(response)
+        return True
+
+    def snapshot(self):
+        """
+        Requests in flight
+
+        :returns: list of request id, name and age in seconds
+        :rtype: list
+        """
+        now = time.monotonic()
+        return [
+            {'id': request_id, 'name': pending.name, 'age': now - pending.started}
+            for request_id, pending in list(self._requests.items())
+        ]
+
+    def resolve_all(self, response=None):
+        """
+        Pass the same response to all requests in flight, f.e. when the connection is lost
+
+        :param response: response to requests
+        :type response: bytes
+        """
+        for pending in self._requests.values():
+            if not pending.future.done():
+                pending.future.set_result(response)
+
+
+def _set_result(future, result):
+    """Set a future result unless the future is already done (cancelled f.e.)"""
+    if not future.done():
+        future.set_result(result)
+
+
+class Activity(object):
+    """
+    Counter of requests being processed, allows waiting until all of them are finished
+
+    May be entered and left from any thread.
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.count = 0
+        self._lock = threading.Lock()
+        self._waiters = []
+
+    def enter(self):
+        """Start processing a request"""
+        with self._lock:
+            self.count += 1
+
+    def leave(self):
+        """Finish processing a request"""
+        with self._lock:
+            self.count -= 1
+            if self.count:
+                return
+            waiters, self._waiters = self._waiters, []
+        for future, loop in waiters:
+            loop.call_soon_threadsafe(_set_result, future, True)
+
+    async def wait(self, timeout=None):
+        """
+        Wait until all requests are finished
+
+        :param timeout: max time to wait in seconds, unlimited by default
+        :type timeout: float
+        :returns: True if all requests are finished, False on timeout
+        :rtype: bool
+        """
+        with self._lock:
+            if not self.count:
+                return True
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self._waiters.append((future, loop))
+        done, pending = await asyncio.wait([future], timeout=timeout)
+        return bool(done)
@@ -0,0 +1,281 @@
+"""
+ATasks stream connections used by brokerless transports
+
+Every message is passed as a length-prefixed frame containing a frame kind,
+a request id, a request name, an optional affinity key and content bytes.
+Both sides of the connection may send requests, many requests may be in flight
+simultaneously, responses are matched to requests by the request id.
+
+A side being drained refuses new requests, so the other side may send them elsewhere.
+It notifies the other side by the refusing frame with zero request id, so the other side
+stops sending new requests over the connection before it is closed.
+
+A worker may report its load to the other side periodically, the last report
+is available as the `load` of the connection.
+"""
+import asyncio
+import logging
+import struct
+
+from atasks.transport.pending import PendingRequests
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST = 1
+RESPONSE = 2
+ERROR = 3
+HELLO = 4
+NOTIFY = 5
+REFUSED = 6
+LOAD = 7
+
+_HEADER = struct.Struct('!BQHHQ')  # kind, request id, name length, key length, content length
+_LOAD = struct.Struct('!Idd')  # requests in flight, loop lag, loop queue delay
+
+
+class RequestRefused(Exception):
+    """The request has been refused by the other side being drained, and not processed"""
+    pass
+
+
+async def read_frame(reader):
+    """
+    Read a frame from the stream
+
+    :param reader: stream to read a frame from
+    :type reader: asyncio.StreamReader
+    :returns: kind, request id, name, key and content of the frame
+    :rtype: tuple
+    """
+    header = await reader.readexactly(_HEADER.size)
+    kind, request_id, name_size, key_size, content_size = _HEADER.unpack(header)
+    name = (await reader.readexactly(name_size)).decode() if name_size else ''
+    key = (await reader.readexactly(key_size)).decode() if key_size else None
+    content = await reader.readexactly(content_size) if content_size else b''
+    return kind, request_id, name, key, content
+
+
+def write_frame(writer, kind, request_id, name='', content=b'', key=None):
+    """
+    Write a frame to the stream
+
+    :param writer: stream to write a frame to
+    :type writer: asyncio.StreamWriter
+    :param kind: kind of the frame
+    :type kind: int
+    :param request_id: id of the request
+    :type request_id: int
+    :param name: name of the request
+    :type name: str
+    :param content: content of the frame
+    :type content: bytes
+    :param key: affinity key of the request
+    :type key: any
+    """
+    name = name.encode()
+    key = str(key).encode() if key is not None else b''
+    writer.writelines([_HEADER.pack(kind, request_id, len(name), len(key), len(content)), name, key, content])
+
+
+class Connection(object):
+    """
+    Persistent connection multiplexing requests in both directions
+    """
+    def __init__(self, reader, writer, callback=None, on_close=None, hints=False, max_in_flight=None):
+        """
+        Constructor
+
+        :param reader: stream to read frames from
+        :type reader: asyncio.StreamReader
+        :param writer: stream to write frames to
+        :type writer: asyncio.StreamWriter
+        :param callback: callback to process requests received from the other side
+        :type callback: awaitable(name: str, content: bytes): bytes
+        :param on_close: function called with the connection when the connection is closed
+        :type on_close: callable
+        :param hints: pass `key` and `reply` parameters of requests to the callback,
+                      used to forward requests to another transport
+        :type hints: bool
+        :param max_in_flight: max number of requests sent by this side and awaiting responses,
+                              sending more requests waits until some of them are responded, unlimited by default
+        :type max_in_flight: int
+        """
+        self.reader = reader
+        self.writer = writer
+        self.callback = callback
+        self.on_close = on_close
+        self.hints = hints
+        self.pending = PendingRequests(max_in_flight)
+        self.closed = False
+        self.refusing = False  # this side refuses new requests
+        self.refused = False  # the other side refuses new requests
+        self.load = None  # the last load reported by the other side, see `report_load()`
+        self.load_time = None  # loop time when the load has been reported
+        self._drain_lock = asyncio.Lock()
+        self._tasks = set()
+        self._reader_task = None
+
+    @property
+    def inflight(self):
+        """Number of requests sent by this side and not responded yet"""
+        return len(self.pending)
+
+    @property
+    def processing(self):
+        """Number of requests received from the other side and being processed"""
+        return len(self._tasks)
+
+    def start(self):
+        """Start reading frames from the connection"""
+        self._reader_task = asyncio.ensure_future(self._read())
+
+    async def wait_closed(self):
+        """Wait until the connection is closed"""
+        await asyncio.wait([self._reader_task])
+
+    async def close(self):
+        """Close the connection"""
+        self.writer.close()
+        if self._reader_task:
+            await self.wait_closed()
+
+    def refuse(self):
+        """Refuse new requests from the other side, requests being processed are finished"""
+        if self.refusing or self.closed:
+            return
+        self.refusing = True
+        write_frame(self.writer, REFUSED, 0)
+
+    async def wait_processed(self, timeout=None):
+        """
+        Wait until requests received from the other side are processed and responded
+
+        :param timeout: max time to wait in seconds, unlimited by default
+        :type timeout: float
+        :returns: True if all requests have been processed
+        :rtype: bool
+        """
+        if not self._tasks:
+            return True
+        done, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        return not pending
+
+    def report_load(self, inflight, lag, delay):
+        """
+        Report the load of this side to the other side
+
+        :param inflight: number of requests being processed
+        :type inflight: int
+        :param lag: event loop lag in seconds
+        :type lag: float
+        :param delay: time in seconds to run callbacks waiting in the event loop
+        :type delay: float
+        """
+        if not self.closed:
+            write_frame(self.writer, LOAD, 0, content=_LOAD.pack(inflight, lag, delay))
+
+    async def hello(self, ident):
+        """
+        Send a greeting frame identifying this side
+
+        :param ident: number identifying this side
+        :type ident: int
+        """
+        write_frame(self.writer, HELLO, ident)
+        await self._drain()
+
+    async def send_request(self, name, content, key=None, reply=True):
+        """
+        Send a request to the other side and wait for the response
+
+        :param name: name of the request
+        :type name: str
+        :param content: request to be sent
+        :type content: bytes
+        :param key: affinity key of the request
+        :type key: any
+        :param reply: False to send a request with no reply
+        :type reply: bool
+        :returns: response to the request or None if the request failed or has no reply
+        :rtype: bytes
+        :raises RequestRefused: if the request has been refused by the other side
+        """
+        if self.closed:
+            return None
+        if self.refused:
+            raise RequestRefused(name)
+        if not reply:
+            write_frame(self.writer, NOTIFY, 0, name, content, key)
+            await self._drain()
+            return None
+        async with self.pending.open(name) as (request_id, future):
+            if self.closed:
+                return None
+            write_frame(self.writer, REQUEST, request_id, name, content, key)
+            await self._drain()
+            response = await future
+            if response is REFUSED:
+                raise RequestRefused(name)
+            return response
+
+    async def _drain(self):
+        """Flush the write buffer, concurrent drains are serialized"""
+        async with self._drain_lock:
+            await self.writer.drain()
+
+    async def _read(self):
+        """Read frames and dispatch them until the connection is closed"""
+        try:
+            while True:
+                kind, request_id, name, key, content = await read_frame(self.reader)
+                if kind == REQUEST and self.refusing:
+                    write_frame(self.writer, REFUSED, request_id)
+                elif kind in (REQUEST, NOTIFY):
+                    task = asyncio.ensure_future(self._process(request_id, name, key, content, kind == REQUEST))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif kind in (RESPONSE, ERROR):
+                    self.pending.resolve(request_id, content if kind == RESPONSE else None)
+                elif kind == LOAD:
+                    self.load = _LOAD.unpack(content)
+                    self.load_time = asyncio.get_event_loop().time()
+                elif kind == REFUSED and not request_id:
+                    self.refused = True
+                elif kind == REFUSED:
+                    self.refused = True
+                    self.pending.resolve(request_id, REFUSED)
+                else:
+                    logger.warning('Unexpected frame %s received from %s', kind, self)
+        except (asyncio.IncompleteReadError, ConnectionError) as ex:
+            logger.debug('Connection %s closed: %s', self, ex)
+        finally:
+            self.closed = True
+            self.pending.resolve_all(None)
+            for task in self._tasks:
+                task.cancel()
+            self.writer.close()
+            if self.on_close:
+                self.on_close(self)
+
+    async def _process(self, request_id, name, key, content, reply):
+        """Process a request received from the other side and send the response back"""
+        response = None
+        hints = {'key': key, 'reply': reply} if self.hints else {}
+        try:
+            if self.callback is None:
+                logger.error('No callback registered for %s to process %s', self, name)
+            else:
+                response = await self.callback(name, content, **hints)
+        except Exception as ex:
+            logger.error('Error while calling a callback: %s', ex)
+        if self.closed or not reply:
+            return
+        if response is None:
+            write_frame(self.writer, ERROR, request_id)
+        else:
+            write_frame(self.writer, RESPONSE, request_id, content=response)
+        try:
+            await self._drain()
+        except ConnectionError as ex:
+            logger.debug('Connection %s lost while responding: %s', self, ex)
@@ -5,6 +5,7 @@ Processed scenarios
 import asyncio
 import logging
 
+from atasks.refs import resolve
 from atasks.tasks import atask
 
 
@@ -58,6 +59,32 @@ async def request_parallel():
     return returns
 
 
+@atask(ref=True)
+async def task_ref(a):
+    """Example task keeping the result on the worker"""
+    return list(range(a))
+
+
+@atask
+async def task_resolve(refs):
+    """Example task resolving references passed inside the list, fetching results from other workers"""
+    return [sum(await resolve(ref)) for ref in refs]
+
+
+@atask(blob_size=1000)
+async def task_lookup(table, key):
+    """Get the value from the large table"""
+    return table[key]
+
+
+BENCHMARKS = [
+    ('task_three', task_three, (1,)),
+    ('task_one', task_one, (1,)),
+    ('request_sequence', request_sequence, ()),
+    ('request_parallel', request_parallel, ()),
+]
+
+
 async def aiomain(**options):
     """The non-task main function calls tasks from atasks worker, not self process"""
 
@@ -4,6 +4,7 @@ Transport tests
 import asyncio
 
 from atasks.transport.base import LoopbackTransport, Transport, get_transport
+from atasks.transport.pending import PendingRequests
 
 from django.test import TestCase
 
@@ -36,3 +37,34 @@ class ModuleTest(TestCase):
             self.assertEqual(result, b'123')
 
         asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_pending_requests(self):
+        """Test, whether the pending table limits requests in flight and cleans up finished ones"""
+        async def _test_():
+            """Async test body"""
+            pending = PendingRequests(max_in_flight=2)
+            ids = []
+
+            async def _request(response):
+                async with pending.open('test') as (request_id, future):
+                    ids.append(request_id)
+                    return await future
+
+            tasks = [asyncio.ensure_future(_request(i)) for i in range(3)]
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(pending), 2)
+            self.assertEqual(ids, [1, 2])
+
+            tasks[0].cancel()
+            await asyncio.sleep(0.01)
+            self.assertNotIn(1, pending)
+            self.assertEqual(ids, [1, 2, 3])
+            self.assertFalse(pending.resolve(1, b'late'))
+
+            self.assertTrue(pending.resolve(2, b'2'))
+            self.assertEqual(await tasks[1], b'2')
+            pending.resolve_all(None)
+            self.assertIsNone(await tasks[2])
+            self.assertEqual(len(pending), 0)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -2,9 +2,12 @@
 Router tests
 """
 import asyncio
+import threading
 
 from atasks.codecs import PickleCodec
+from atasks.namespaces import namespaces
 from atasks.router import get_router
+from atasks.tasks import atask
 from atasks.transport.base import LoopbackTransport
 
 from django.test import TestCase
@@ -30,3 +33,100 @@ class ModuleTest(TestCase):
             self.assertEqual(returns, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4])
 
         asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_atask_options(self):
+        """Test atask options passed to the registry and the transport"""
+        async def _test_():
+            """Async test body"""
+            registered = []
+
+            class _Transport(LoopbackTransport):
+                """Transport recording registered atasks"""
+                async def register_atask(self, name, options):
+                    """Overriden from the base class"""
+                    registered.append((name, options))
+
+            PickleCodec('options test')
+            transport = _Transport('options test')
+            await get_router('options test').activate(transport)
+
+            @atask(name='the options test', namespace='options test', queue='hot')
+            async def _coro(a):
+                """Atask with options"""
+                return a
+
+            await asyncio.sleep(0)
+            item = namespaces.get('options test').registry.get('the options test')
+            self.assertEqual(item.options, {'queue': 'hot'})
+            self.assertEqual(transport.routes(), [('the options test', {'queue': 'hot'})])
+            self.assertEqual(registered, [('the options test', {'queue': 'hot'})])
+            self.assertEqual(await _coro(42), 42)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_no_reply(self):
+        """Test atasks with no reply"""
+        async def _test_():
+            """Async test body"""
+            called = asyncio.Event()
+
+            @atask(name='the no reply test', namespace='no reply test', reply=False)
+            async def _coro(a):
+                """Atask with no reply"""
+                called.set()
+                return a
+
+            PickleCodec('no reply test')
+            transport = LoopbackTransport('no reply test')
+            await get_router('no reply test').activate(transport)
+            self.assertEqual(await _coro(42), None)
+            self.assertFalse(called.is_set())
+            await asyncio.wait_for(called.wait(), 1)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_registering_threads(self):
+        """Test, whether requests wait for atasks being registered in the loop of another thread"""
+        async def _test_():
+            """Async test body"""
+            registered = []
+
+            class _Transport(LoopbackTransport):
+                """Transport registering atasks slowly"""
+                async def register_atask(self, name, options):
+                    """Overriden from the base class"""
+                    await asyncio.sleep(0.2)
+                    registered.append(name)
+
+            PickleCodec('registering test')
+            transport = _Transport('registering test')
+            router = get_router('registering test')
+            await router.activate(transport)
+            started = threading.Event()
+
+            async def _register():
+                router.register_atask('the registering test', coro=_echo)
+                started.set()
+                await asyncio.sleep(0.5)
+
+            def _thread():
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                try:
+                    loop.run_until_complete(_register())
+                finally:
+                    loop.close()
+                    asyncio.set_event_loop(None)
+
+            async def _echo(a):
+                return a
+
+            loop = asyncio.get_event_loop()
+            thread = loop.run_in_executor(None, _thread)
+            await loop.run_in_executor(None, started.wait)
+            self.assertEqual(await router.send_request('the registering test', 42), 42)
+            self.assertEqual(registered, ['the registering test'])
+            await thread
+            self.assertEqual(router._registering, {})
+
+        asyncio.get_event_loop().run_until_complete(_test_())
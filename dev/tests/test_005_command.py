@@ -1,6 +1,11 @@
 """
 Router tests
 """
+import os
+import tempfile
+
+from atasks.manifest import read_manifest
+from django_atasks.management.commands.run_atask import Command
 
 from django.core.management import call_command
 from django.test import TestCase
@@ -11,3 +16,29 @@ class ModuleTest(TestCase):
     def test_run_atask(self):
         """Test scenarios"""
         call_command('run_atask', 'dev.tests.scenarios', verbosity=3, mode='loopback')
+
+    def test_run_atask_threads(self):
+        """Test scenarios using thread pool transport"""
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=3, mode='loopback', transport='threads', workers=2)
+
+    def test_run_atask_processes(self):
+        """Test scenarios using process pool transport"""
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', transport='processes', workers=2)
+
+    def test_run_atask_sockets(self):
+        """Test scenarios using socket transport"""
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', transport='sockets', url='tcp://127.0.0.1:0')
+
+    def test_run_atask_manifest(self):
+        """Test writing the manifest after loading scenarios"""
+        path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', manifest=path)
+        names = [entry['name'] for entry in read_manifest(path)['atasks'] if entry['source'] == 'dev.tests.scenarios']
+        self.assertIn('dev.tests.scenarios.request_parallel', names)
+
+    def test_run_atask_concurrency(self):
+        """Test, whether the server runs in the command process unless worker processes are requested"""
+        command = Command()
+        parser = command.create_parser('manage.py', 'run_atask')
+        self.assertEqual(parser.parse_args(['dev.tests.scenarios', '-M', 'server', '-T', 'amqp']).concurrency, 0)
+        self.assertEqual(parser.parse_args(['dev.tests.scenarios', '-M', 'server', '-T', 'amqp', '-C', '4']).concurrency, 4)
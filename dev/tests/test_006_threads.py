@@ -0,0 +1,84 @@
+"""
+Thread pool transport tests
+"""
+import asyncio
+import threading
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.transport.backends.threads import ThreadPoolTransport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_thread_pool_transport(self):
+        """Test, whether requests are processed by worker threads concurrently"""
+        async def _test_():
+            """Async test body"""
+            t = ThreadPoolTransport('threads test', workers=3)
+            await t.connect()
+            threads = set()
+
+            async def _callback(name, content):
+                threads.add(threading.get_ident())
+                await asyncio.sleep(0.1)
+                return name.encode() + content
+
+            await t.register_callback(_callback)
+            results = await asyncio.gather(*[t.send_request('test', b'%d' % i) for i in range(6)])
+            self.assertEqual(results, [b'test%d' % i for i in range(6)])
+            self.assertEqual(len(threads), 3)
+            self.assertNotIn(threading.get_ident(), threads)
+            await t.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_scenarios(self):
+        """Test scenarios"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = ThreadPoolTransport(workers=2)
+            await transport.connect()
+            router = get_router()
+            await router.activate(transport)
+            from dev.tests.scenarios import (
+                request_sequence, request_parallel
+            )
+
+            await request_sequence()
+            returns = await request_parallel()
+            self.assertEqual(returns, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4])
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_shared_router(self):
+        """Test, whether the router keeps its state consistent while serving requests in worker threads"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec('threads router')
+            transport = ThreadPoolTransport('threads router', workers=4)
+            await transport.connect()
+            router = get_router('threads router')
+            await router.activate(transport)
+
+            async def _yielding(i):
+                for k in range(3):
+                    await asyncio.sleep(0)
+                return i
+
+            stub = router.register_atask('yielding', coro=_yielding)
+            received = router.wait_requests(2000)
+            results = await asyncio.gather(*[stub(i) for i in range(2000)])
+            self.assertEqual(results, list(range(2000)))
+            self.assertEqual(await received, 2000)
+            self.assertEqual(router.requests, 2000)
+            self.assertEqual((router.running, router.serving, router.active), ({}, {}, 0))
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
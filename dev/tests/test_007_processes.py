@@ -0,0 +1,78 @@
+"""
+Process pool transport tests
+"""
+import asyncio
+import os
+import signal
+
+from atasks.codecs import PickleCodec
+from atasks.refs import RefNotFound, RemoteRef, resolve
+from atasks.transport.backends.processes import ProcessPoolTransport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_scenarios(self):
+        """Test scenarios"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = ProcessPoolTransport(workers=2, modules=['dev.tests.scenarios'])
+            await transport.connect()
+            from dev.tests.scenarios import (
+                task_three, request_sequence, request_parallel
+            )
+
+            self.assertEqual(await task_three(24), 24)
+            await request_sequence()
+            returns = await request_parallel()
+            self.assertEqual(returns, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4])
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_restart(self):
+        """Test, whether crashed worker processes are restarted"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = ProcessPoolTransport(workers=2, modules=['dev.tests.scenarios'])
+            await transport.connect()
+            from dev.tests.scenarios import task_three
+
+            pid = transport._slots[0].process.pid
+            os.kill(pid, signal.SIGKILL)
+            await asyncio.sleep(0.5)
+            await transport._slots[0].ready
+            self.assertNotEqual(transport._slots[0].process.pid, pid)
+            returns = await asyncio.gather(*[task_three(a) for a in range(10)])
+            self.assertEqual(returns, list(range(10)))
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_refs(self):
+        """Test, whether referenced results are fetched from the worker holding them"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = ProcessPoolTransport(workers=2, modules=['dev.tests.scenarios'])
+            await transport.connect()
+            from dev.tests.scenarios import task_ref, task_resolve
+
+            refs = [await task_ref(a) for a in (10, 20, 30, 40)]
+            owners = set(ref.owner for ref in refs)
+            self.assertEqual(owners, set('process:%s#%s' % (transport._path, index) for index in range(2)))
+            self.assertEqual([sum(await resolve(ref)) for ref in refs], [45, 190, 435, 780])
+            for i in range(4):
+                self.assertEqual(await task_resolve(refs), [45, 190, 435, 780])
+            with self.assertRaises(RefNotFound):
+                await resolve(RemoteRef('unknown', refs[0].owner))
+            for index in ('2', '-1', 'x', ''):
+                target = 'process:%s#%s' % (transport._path, index)
+                self.assertIsNone(await transport.send_request('test', b'', target=target))
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
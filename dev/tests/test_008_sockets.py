@@ -0,0 +1,165 @@
+"""
+Socket transport tests
+"""
+import asyncio
+import os
+import tempfile
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.transport.backends.sockets import SocketTransport, parse_address
+from atasks.transport.streams import REQUEST, read_frame, write_frame
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_parse_address(self):
+        """Test socket address parsing"""
+        self.assertEqual(parse_address('tcp://127.0.0.1:8000'), ('tcp', ('127.0.0.1', 8000)))
+        self.assertEqual(parse_address('tcp://[::1]:8000'), ('tcp', ('::1', 8000)))
+        self.assertEqual(parse_address('unix:///tmp/a.sock'), ('unix', ('/tmp/a.sock',)))
+        self.assertRaises(ValueError, parse_address, 'udp://127.0.0.1:8000')
+
+    def test_002_multiplexing(self):
+        """Test, whether many requests are multiplexed over one connection"""
+        async def _test_():
+            """Async test body"""
+            server = SocketTransport('sockets server')
+
+            async def _callback(name, content):
+                await asyncio.sleep(0.1)
+                return name.encode() + content
+
+            await server.register_callback(_callback)
+            client = SocketTransport('sockets client', workers=[server.address])
+            await client.connect()
+            results = await asyncio.gather(*[client.send_request('test', b'%d' % i) for i in range(50)])
+            self.assertEqual(results, [b'test%d' % i for i in range(50)])
+            self.assertEqual(len(server._connections), 1)
+            await client.disconnect()
+            await server.unregister_callback()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_unix_socket(self):
+        """Test, whether the transport works over the Unix socket"""
+        async def _test_():
+            """Async test body"""
+            directory = tempfile.mkdtemp()
+            address = 'unix://' + os.path.join(directory, 'test.sock')
+            server = SocketTransport('sockets server', listen=address)
+
+            async def _callback(name, content):
+                return content
+
+            await server.register_callback(_callback)
+            client = SocketTransport('sockets client', workers=[address])
+            self.assertEqual(await client.send_request('test', b'123'), b'123')
+            await client.disconnect()
+            await server.unregister_callback()
+            self.assertEqual(await client.send_request('test', b'123'), None)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_scenarios(self):
+        """Test scenarios"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = SocketTransport()
+            await transport.connect()
+            router = get_router()
+            await router.activate(transport)
+            from dev.tests.scenarios import (
+                request_sequence, request_parallel
+            )
+
+            await request_sequence()
+            returns = await request_parallel()
+            self.assertEqual(returns, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4])
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_005_affinity(self):
+        """Test, whether requests having the same key are sent to the same worker"""
+        async def _test_():
+            """Async test body"""
+            def _callback_for(server):
+                """Create a callback returning the server address"""
+                async def _callback(name, content):
+                    return server.address.encode()
+                return _callback
+
+            servers = [SocketTransport('sockets server %s' % i) for i in range(3)]
+            for server in servers:
+                await server.register_callback(_callback_for(server))
+            client = SocketTransport('sockets client', workers=[server.address for server in servers])
+            owners = {}
+            for key in range(30):
+                owners[key] = await client.send_request('test', b'', key=key)
+                self.assertEqual(await client.send_request('test', b'', key=key), owners[key])
+            self.assertEqual(len(set(owners.values())), 3)
+
+            removed = servers[0].address
+            client.remove_worker(removed)
+            for key in range(30):
+                owner = await client.send_request('test', b'', key=key)
+                if owners[key] != removed.encode():
+                    self.assertEqual(owner, owners[key])
+                else:
+                    self.assertNotEqual(owner, owners[key])
+            await client.disconnect()
+            for server in servers:
+                await server.unregister_callback()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_006_no_reply(self):
+        """Test, whether requests with no reply are processed"""
+        async def _test_():
+            """Async test body"""
+            received = asyncio.Queue()
+
+            async def _callback(name, content):
+                await received.put(content)
+                return content
+
+            server = SocketTransport('sockets server')
+            await server.register_callback(_callback)
+            client = SocketTransport('sockets client', workers=[server.address])
+            self.assertEqual(await client.send_request('test', b'123', reply=False), None)
+            self.assertEqual(await asyncio.wait_for(received.get(), 1), b'123')
+            self.assertEqual(await client.send_request('test', b'456'), b'456')
+            await client.disconnect()
+            await server.unregister_callback()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_007_large_frames(self):
+        """Test, whether frames longer than 4 GiB are framed correctly"""
+        class _Content(bytes):
+            """Content pretending to be longer than 4 GiB"""
+            def __len__(self):
+                return 2 ** 32 + 3
+
+        class _Writer(object):
+            """Writer collecting the data written"""
+            def writelines(self, data):
+                self.data = data
+
+        async def _test_():
+            """Async test body"""
+            writer = _Writer()
+            write_frame(writer, REQUEST, 1, 'test', _Content(b'123'))
+            reader = asyncio.StreamReader()
+            reader.feed_data(writer.data[0] + b'test')
+            reader.feed_eof()
+            with self.assertRaises(asyncio.IncompleteReadError) as error:
+                await read_frame(reader)
+            self.assertEqual(error.exception.expected, 2 ** 32 + 3)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
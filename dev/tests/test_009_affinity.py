@@ -0,0 +1,60 @@
+"""
+Affinity routing tests
+"""
+import asyncio
+import threading
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.threads import ThreadPoolTransport
+from atasks.transport.hashring import HashRing
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_hash_ring(self):
+        """Test consistent hash ring"""
+        ring = HashRing(['a', 'b', 'c'])
+        self.assertEqual(len(ring), 3)
+        owners = dict((key, ring.get(key)) for key in range(1000))
+        self.assertEqual(set(owners.values()), {'a', 'b', 'c'})
+        self.assertEqual(sorted(ring.iterate(1)), ['a', 'b', 'c'])
+        self.assertEqual(next(ring.iterate(1)), owners[1])
+
+        ring.remove('b')
+        self.assertNotIn('b', ring)
+        for key, owner in owners.items():
+            if owner != 'b':
+                self.assertEqual(ring.get(key), owner)
+
+        ring.add('b')
+        self.assertEqual(dict((key, ring.get(key)) for key in range(1000)), owners)
+        self.assertEqual(HashRing().get(1), None)
+
+    def test_002_thread_affinity(self):
+        """Test, whether requests having the same key are processed by the same worker"""
+        async def _test_():
+            """Async test body"""
+            threads = {}
+
+            @atask(name='the affinity test', namespace='affinity test', affinity=lambda tenant, a: tenant)
+            async def _coro(tenant, a):
+                """Atask with affinity"""
+                threads.setdefault(tenant, set()).add(threading.get_ident())
+                return a
+
+            PickleCodec('affinity test')
+            transport = ThreadPoolTransport('affinity test', workers=4)
+            await transport.connect()
+            await get_router('affinity test').activate(transport)
+            results = await asyncio.gather(*[_coro(tenant, a) for tenant in range(10) for a in range(10)])
+            self.assertEqual(results, list(range(10)) * 10)
+            for tenant in range(10):
+                self.assertEqual(len(threads[tenant]), 1)
+            self.assertGreater(len(set.union(*threads.values())), 1)
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,70 @@
+"""
+Benchmark runner tests
+"""
+import asyncio
+import os
+import tempfile
+
+from atasks.bench import runner
+from atasks.codecs import get_codec
+from atasks.namespaces import namespaces
+from atasks.transport.base import get_transport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_percentile(self):
+        """Test percentile calculation"""
+        values = list(range(1, 101))
+        self.assertEqual(runner.percentile(values, 0.5), 50)
+        self.assertEqual(runner.percentile(values, 0.99), 99)
+        self.assertEqual(runner.percentile([3], 0.95), 3)
+
+    def test_002_benchmark(self):
+        """Test, whether the benchmark measures workloads and compares results"""
+        async def _test_():
+            """Async test body"""
+            from dev.tests.scenarios import task_three
+
+            registry = getattr(namespaces.get('default'), 'registry', None)
+            self.assertFalse([name for name, item in registry.items() if name.startswith(runner.WORKLOADS)])
+            codec, transport = get_codec('default'), get_transport('default')
+            benchmark = runner.Benchmark(
+                transports=['loopback', 'threads', 'processes'],
+                sizes=[10, 1000],
+                widths=[2],
+                depths=[3],
+                iterations=3,
+                concurrency=2,
+                scenarios=[('task_three', task_three, (1,))],
+                workers=2,
+            )
+            results = await benchmark.run()
+            self.assertIs(get_codec('default'), codec)
+            self.assertIs(get_transport('default'), transport)
+            return results
+
+        results = asyncio.get_event_loop().run_until_complete(_test_())
+        self.assertEqual(len(results), 15)
+        self.assertEqual(
+            sorted(set(runner.result_key(result) for result in results)),
+            sorted((workload, param, transport, 'pickle') for transport in ('loopback', 'threads', 'processes') for workload, param in (
+                ('echo', 10), ('echo', 1000), ('fanout', 2), ('nest', 3), ('task_three', None)
+            ))
+        )
+        for result in results:
+            self.assertGreater(result['throughput'], 0)
+            self.assertLessEqual(result['p50'], result['p99'])
+
+        path = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        runner.write_results(path, results)
+        baseline = runner.read_results(path)
+        self.assertEqual(runner.compare(results, baseline), [])
+        for result in baseline:
+            result['throughput'] *= 2
+        regressions = runner.compare(results, baseline)
+        self.assertEqual(len(regressions), 15)
+        self.assertEqual(set(regression['metric'] for regression in regressions), {'throughput'})
+        self.assertEqual(len(runner.format_results(results)), 16)
@@ -0,0 +1,284 @@
+"""
+AMQP transport tests using the in-memory broker
+"""
+import asyncio
+import time
+
+from atasks.codecs import PickleCodec
+from atasks.router import JobNotFound, get_router
+from atasks.tasks import atask
+from atasks.transport.backends.amqp import AffinityNotSupported, AMQPTransport
+from atasks.transport.memory import Broker, ExchangeType
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_broker(self):
+        """Test routing and prefetch of the in-memory broker"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker()
+            connection = await broker.connect_robust()
+            channel = await connection.channel()
+            exchange = await channel.declare_exchange('x', type=ExchangeType.TOPIC)
+            received = {}
+
+            async def _consume(message):
+                received.setdefault(message.info()['routing_key'], []).append(message)
+
+            for key in ('a.*', 'a.#', 'b'):
+                queue = await channel.declare_queue(key)
+                await queue.bind(exchange, key)
+                await queue.consume(_consume)
+            for key in ('a.b', 'a.b.c', 'a', 'b', 'c'):
+                await exchange.publish(broker.Message(body=key.encode()), routing_key=key)
+            await asyncio.sleep(0.01)
+            self.assertEqual(dict((key, len(messages)) for key, messages in received.items()), {'a.b': 2, 'a.b.c': 1, 'a': 1, 'b': 1})
+
+            await channel.set_qos(prefetch_count=1)
+            queue = await channel.declare_queue('limited')
+            await queue.consume(_consume)
+            for i in range(3):
+                await channel.default_exchange.publish(broker.Message(body=b'%d' % i), routing_key='limited')
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(received['limited']), 1)
+            async with received['limited'][0].process():
+                pass
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(received['limited']), 2)
+
+            exclusive = await channel.declare_queue('', exclusive=True)
+            self.assertIn(exclusive.name, broker.queues)
+            await connection.close()
+            self.assertNotIn(exclusive.name, broker.queues)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_latency_and_bandwidth(self):
+        """Test, whether the broker injects latency and limits bandwidth"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker(latency=0.05, bandwidth=10000000)
+            connection = await broker.connect_robust()
+            channel = await connection.channel()
+            queue = await channel.declare_queue('q')
+            received = asyncio.get_event_loop().create_future()
+
+            async def _consume(message):
+                received.set_result(time.perf_counter())
+
+            await queue.consume(_consume, no_ack=True)
+            started = time.perf_counter()
+            await channel.default_exchange.publish(broker.Message(body=b'x' * 1000000), routing_key='q')
+            self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+            self.assertGreaterEqual(await received - started, 0.15)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_concurrent_requests(self):
+        """Test, whether requests are published and processed concurrently"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='amqp concurrent', namespace='amqp test')
+            async def _coro(a):
+                """Slow atask"""
+                await asyncio.sleep(0.1)
+                return a
+
+            PickleCodec('amqp test')
+            transport = AMQPTransport('amqp test', driver=Broker(latency=0.01))
+            await transport.connect()
+            router = get_router('amqp test')
+            await router.activate(transport)
+            started = time.perf_counter()
+            results = await asyncio.gather(*[_coro(a) for a in range(20)])
+            self.assertEqual(results, list(range(20)))
+            self.assertLess(time.perf_counter() - started, 0.5)
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_workers(self):
+        """Test dedicated queues, affinity and requests with no reply among several workers"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='amqp affinity', namespace='amqp workers', affinity=lambda tenant: tenant, queue='tenants')
+            async def _coro(tenant):
+                """Atask with affinity"""
+
+            @atask(name='amqp notify', namespace='amqp workers', reply=False)
+            async def _notify():
+                """Atask with no reply"""
+
+            broker = Broker()
+            workers = {}
+            processed = []
+            for index in range(3):
+                worker = AMQPTransport('amqp workers', driver=broker)
+                await worker.connect()
+
+                async def _callback(name, content, index=index):
+                    processed.append((name, index))
+                    return b'%d' % index
+
+                await worker.register_callback(_callback)
+                workers[index] = worker
+            self.assertIn('tenants', broker.queues)
+            self.assertIn('tenants.affinity', broker.exchanges)
+            self.assertIn('atask', broker.queues)  # the common queue by default
+            self.assertNotIn('atask.amqp notify', broker.queues)
+
+            client = AMQPTransport('amqp workers', driver=broker)
+            await client.connect()
+            owners = {}
+            for i in range(3):
+                for tenant in range(20):
+                    owner = await client.send_request('amqp affinity', b'', key=tenant)
+                    self.assertEqual(owners.setdefault(tenant, owner), owner)
+            self.assertEqual(len(set(owners.values())), 3)
+
+            del processed[:]
+            self.assertIsNone(await client.send_request('amqp notify', b'', reply=False))
+            await asyncio.sleep(0.01)
+            self.assertEqual([name for name, index in processed], ['amqp notify'])
+
+            await workers[0].unregister_callback()
+            await workers[0].disconnect()
+            for tenant in range(20):
+                self.assertNotEqual(await client.send_request('amqp affinity', b'', key=tenant), b'0')
+            await client.disconnect()
+            for index in (1, 2):
+                await workers[index].unregister_callback()
+                await workers[index].disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_005_scenarios(self):
+        """Test scenarios"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = AMQPTransport(driver=Broker(latency=0.001))
+            await transport.connect()
+            router = get_router()
+            await router.activate(transport)
+            from dev.tests.scenarios import (
+                request_sequence, request_parallel
+            )
+
+            await request_sequence()
+            returns = await request_parallel()
+            self.assertEqual(returns, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4])
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_006_max_in_flight(self):
+        """Test, whether callers wait while the window of requests in flight is full"""
+        async def _test_():
+            """Async test body"""
+            transport = AMQPTransport('amqp window', driver=Broker(), max_in_flight=2)
+            await transport.connect()
+            running = []
+            maximum = []
+
+            async def _callback(name, content):
+                running.append(content)
+                maximum.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(content)
+                return content
+
+            await transport.register_callback(_callback)
+            await transport.register_atask('window', {})
+            results = await asyncio.gather(*[transport.send_request('window', b'%d' % i) for i in range(10)])
+            self.assertEqual(results, [b'%d' % i for i in range(10)])
+            self.assertEqual(max(maximum), 2)
+            self.assertEqual(len(transport._pending), 0)
+            await transport.unregister_callback()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_007_fleets(self):
+        """Test, whether workers having different catalogs receive requests only for their atasks"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker()
+            served = []
+            routers = []
+            for fleet, names in (('a', ('fleet x', 'fleet shared a')), ('b', ('fleet y', 'fleet shared b'))):
+                namespace = 'amqp fleet %s' % fleet
+                PickleCodec(namespace)
+                transport = AMQPTransport(namespace, driver=broker, queue_per_atask=True)
+                await transport.connect()
+                router = get_router(namespace)
+
+                for name in names:
+                    async def _serve(name=name, fleet=fleet):
+                        served.append((name, fleet))
+                        return fleet
+
+                    router.register_atask(name, coro=_serve, options={'queue': 'fleets'} if 'shared' in name else {})
+                await router.activate(transport)
+                routers.append((router, transport))
+            self.assertIn('atask.fleet x', broker.queues)
+            self.assertNotIn('atask', broker.queues)
+
+            PickleCodec('amqp fleet client')
+            client = AMQPTransport('amqp fleet client', driver=broker, queue_per_atask=True)
+            await client.connect()
+            router = get_router('amqp fleet client')
+            results = await asyncio.gather(*[router.send_request('fleet x') for i in range(20)])
+            self.assertEqual(results, ['a'] * 20)
+            results = await asyncio.gather(*[router.send_request('fleet y') for i in range(20)])
+            self.assertEqual(results, ['b'] * 20)
+            self.assertEqual(sorted(set(served)), [('fleet x', 'a'), ('fleet y', 'b')])
+
+            # both fleets consume the queue named by the option, the fleet not knowing the atask replies with an error
+            outcomes = []
+            for i in range(4):
+                try:
+                    outcomes.append(await asyncio.wait_for(router.send_request('fleet shared a'), 1))
+                except JobNotFound:
+                    outcomes.append(None)
+            self.assertCountEqual(outcomes, ['a', 'a', None, None])
+
+            await client.disconnect()
+            for router, transport in routers:
+                await router.deactivate()
+                await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_008_no_consistent_hash(self):
+        """Test, whether the broker having no consistent hash exchange is used unless affinity is required"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker(consistent_hash=False)
+            worker = AMQPTransport('amqp no hash', driver=broker)
+            await worker.connect()
+
+            async def _callback(name, content):
+                return content
+
+            await worker.register_callback(_callback)
+            await worker.register_atask('amqp plain', {})
+            with self.assertRaisesRegex(AffinityNotSupported, 'rabbitmq_consistent_hash_exchange'):
+                await worker.register_atask('amqp keyed', {'affinity': lambda key: key})
+
+            client = AMQPTransport('amqp no hash', driver=broker)
+            await client.connect()
+            self.assertEqual(await client.send_request('amqp plain', b'x'), b'x')
+            with self.assertRaises(AffinityNotSupported):
+                await client.send_request('amqp keyed', b'x', key=1)
+            self.assertEqual(await client.send_request('amqp plain', b'y'), b'y')
+            await client.disconnect()
+            await worker.unregister_callback()
+            await worker.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
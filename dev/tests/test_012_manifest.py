@@ -0,0 +1,85 @@
+"""
+Atask manifest tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from atasks.codecs import PickleCodec
+from atasks.manifest import (
+    build_manifest,
+    prewarm,
+    read_manifest,
+    register_manifest,
+    write_manifest,
+)
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+SOURCE = '''
+from atasks.tasks import atask
+
+
+@atask(name='lazy echo', namespace='manifest test', affinity=lambda a: a, queue='lazy')
+async def echo(a):
+    return a
+
+
+@atask(name='lazy double', namespace='manifest test')
+async def double(a):
+    return a * 2
+'''
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_lazy_atasks(self):
+        """Test, whether atasks registered from the manifest are loaded on the first request"""
+        async def _test_():
+            """Async test body"""
+            directory = tempfile.mkdtemp()
+            source = os.path.join(directory, 'lazy_atasks_module.py')
+            with open(source, 'w') as f:
+                f.write(SOURCE)
+            path = os.path.join(directory, 'manifest.json')
+            write_manifest(path, {
+                'version': 1,
+                'atasks': [
+                    {'namespace': 'manifest test', 'name': 'lazy echo', 'source': source, 'options': {'affinity': True, 'queue': 'lazy'}},
+                    {'namespace': 'manifest test', 'name': 'lazy double', 'source': source, 'options': {}},
+                ],
+            })
+            manifest = read_manifest(path)
+            register_manifest(manifest)
+            self.assertNotIn('lazy_atasks_module', sys.modules)
+
+            PickleCodec('manifest test')
+            transport = LoopbackTransport('manifest test')
+            router = get_router('manifest test')
+            await router.activate(transport)
+            self.assertEqual(dict(transport.routes())['lazy echo'], {'affinity': True, 'queue': 'lazy'})
+            self.assertNotIn('lazy_atasks_module', sys.modules)
+
+            self.assertEqual(await router.send_request('lazy double', 21), 42)
+            self.assertIn('lazy_atasks_module', sys.modules)
+            registry = namespaces.get('manifest test').registry
+            self.assertFalse(hasattr(registry.get('lazy echo'), 'source'))
+            self.assertTrue(callable(registry.get('lazy echo').options['affinity']))
+            self.assertEqual(await router.send_request('lazy echo', 1), 1)
+
+            built = build_manifest([source])
+            self.assertIn({
+                'namespace': 'manifest test', 'name': 'lazy echo', 'source': source, 'options': {'affinity': True, 'queue': 'lazy'},
+            }, built['atasks'])
+
+            register_manifest(built)
+            self.assertFalse(hasattr(registry.get('lazy echo'), 'source'))
+            await prewarm(built)
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
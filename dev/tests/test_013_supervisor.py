@@ -0,0 +1,99 @@
+"""
+Worker process supervisor tests
+"""
+import os
+import tempfile
+import threading
+import time
+
+from atasks.supervisor import Supervisor, retire
+
+from django.test import TestCase
+
+
+def _recycled(directory, index):
+    """Worker exiting normally as after processing max requests"""
+    with open(os.path.join(directory, '%s-%s' % (index, os.getpid())), 'w'):
+        pass
+    time.sleep(0.1)
+
+
+def _retiring(directory, index):
+    """Worker asking for the replacement and finishing its work then"""
+    _recycled(directory, index)
+    retire()
+    time.sleep(0.5)
+
+
+def _crashed(directory, index):
+    """Worker crashing immediately"""
+    _recycled(directory, index)
+    os._exit(3)
+
+
+def _running(directory, index):
+    """Worker running until terminated"""
+    _recycled(directory, index)
+    time.sleep(60)
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def _supervise(self, target, concurrency, duration, **options):
+        """Run the supervisor for the duration and return names of files written by workers"""
+        directory = tempfile.mkdtemp()
+        supervisor = Supervisor(lambda index: target(directory, index), concurrency=concurrency, **options)
+        thread = threading.Thread(target=supervisor.run, kwargs={'handle_signals': False})
+        thread.start()
+        time.sleep(duration)
+        pids = supervisor.pids
+        supervisor.stop()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        for pid in pids:
+            self.assertRaises(OSError, os.kill, pid, 0)
+        return [name.split('-') for name in os.listdir(directory)]
+
+    def test_001_restart(self):
+        """Test, whether exited workers are restarted immediately"""
+        started = self._supervise(_recycled, 2, 1)
+        self.assertEqual(set(index for index, pid in started), {'0', '1'})
+        self.assertGreater(len(started), 6)
+
+    def test_002_crash_delay(self):
+        """Test, whether crashed workers are restarted after the delay"""
+        started = self._supervise(_crashed, 1, 1, restart_delay=0.4)
+        self.assertIn(len(started), (2, 3))
+
+    def test_003_stop(self):
+        """Test, whether running workers are terminated on stop"""
+        started = self._supervise(_running, 3, 0.5, stop_timeout=2)
+        self.assertEqual(sorted(index for index, pid in started), ['0', '1', '2'])
+
+    def test_004_retire(self):
+        """Test, whether the replacement of the retiring worker is started before it exits"""
+        started = self._supervise(_retiring, 1, 1)
+        self.assertGreater(len(started), 5)
+
+    def test_005_reload(self):
+        """Test, whether new workers are started before old ones are stopped on reload"""
+        directory = tempfile.mkdtemp()
+        supervisor = Supervisor(lambda index: _running(directory, index), concurrency=2, reload_delay=0.5)
+        thread = threading.Thread(target=supervisor.run, kwargs={'handle_signals': False})
+        thread.start()
+        time.sleep(0.5)
+        old = supervisor.pids
+        supervisor.reload()
+        time.sleep(0.3)
+        new = supervisor.pids
+        self.assertEqual(len(set(old + new)), 4)
+        for pid in old + new:
+            os.kill(pid, 0)
+        time.sleep(1)
+        for pid in old:
+            self.assertRaises(OSError, os.kill, pid, 0)
+        self.assertEqual(supervisor.pids, new)
+        supervisor.stop()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(os.listdir(directory)), 4)
@@ -0,0 +1,86 @@
+"""
+Event loop lag monitor tests
+"""
+import asyncio
+import time
+
+from atasks.codecs import PickleCodec
+from atasks.monitor import LoopMonitor
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.threads import ThreadPoolTransport
+from atasks.transport.base import LoopbackTransport
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_stall_attribution(self):
+        """Test, whether the loop stall is attributed to the blocking atask"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='blocking', namespace='monitor test')
+            async def _blocking(a):
+                """Atask blocking the loop"""
+                await asyncio.sleep(0.05)
+                time.sleep(0.3)
+                return a
+
+            @atask(name='polite', namespace='monitor test')
+            async def _polite(a):
+                """Atask sleeping asynchronously"""
+                await asyncio.sleep(0.3)
+                return a
+
+            PickleCodec('monitor test')
+            transport = LoopbackTransport('monitor test')
+            router = get_router('monitor test')
+            await router.activate(transport)
+            monitor = LoopMonitor(interval=0.01, threshold=0.1)
+            monitor.start()
+            self.assertEqual(await asyncio.gather(_blocking(1), _polite(2)), [1, 2])
+            await asyncio.sleep(0.05)
+            await monitor.stop()
+            await router.deactivate()
+
+            snapshot = monitor.snapshot()
+            self.assertEqual(len(snapshot['stalls']), 1)
+            stall = snapshot['stalls'][0]
+            self.assertEqual(stall['atasks'], ['blocking'])
+            self.assertGreaterEqual(stall['duration'], 0.2)
+            self.assertIn('time.sleep(0.3)', stall['samples'][0])
+            self.assertGreaterEqual(snapshot['max_lag'], 0.2)
+            self.assertEqual(snapshot['histogram'][-3:], [[1, 0], [5, 0], [None, 0]])
+            self.assertGreater(sum(count for bound, count in snapshot['histogram']), 5)
+            self.assertLessEqual(monitor.percentile(0.5), 0.05)
+            self.assertEqual(router.running, {})
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_thread_workers(self):
+        """Test, whether the monitor of the main loop is not disturbed by worker threads"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='blocking worker', namespace='monitor threads')
+            async def _blocking():
+                """Atask blocking the worker loop"""
+                time.sleep(0.3)
+
+            PickleCodec('monitor threads')
+            transport = ThreadPoolTransport('monitor threads', workers=1)
+            await transport.connect()
+            await get_router('monitor threads').activate(transport)
+            monitor = LoopMonitor(interval=0.01, threshold=0.1)
+            monitor.start()
+            await _blocking()
+            await monitor.stop()
+            await transport.disconnect()
+            self.assertEqual(monitor.snapshot()['stalls'], [])
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_run_atask_monitor(self):
+        """Test scenarios with the monitor enabled"""
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', monitor=0.5)
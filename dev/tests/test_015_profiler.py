@@ -0,0 +1,138 @@
+"""
+Per-atask profiler tests
+"""
+import asyncio
+import os
+import pstats
+import tempfile
+import time
+
+from atasks.codecs import PickleCodec
+from atasks.profiler import Profiler
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.threads import ThreadPoolTransport
+from atasks.transport.base import LoopbackTransport
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+def _burn(seconds):
+    """Spend CPU time"""
+    finish = time.process_time() + seconds
+    while time.process_time() < finish:
+        pass
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_interleaved_atasks(self):
+        """Test, whether the cost of interleaved atasks is attributed to every atask separately"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='busy', namespace='profiler test')
+            async def _busy():
+                """Atask spending CPU time in several steps"""
+                for i in range(3):
+                    _burn(0.05)
+                    await asyncio.sleep(0.01)
+                return [0] * 100000
+
+            @atask(name='idle', namespace='profiler test')
+            async def _idle():
+                """Atask waiting"""
+                await asyncio.sleep(0.3)
+
+            @atask(name='failing', namespace='profiler test')
+            async def _failing():
+                """Atask raising an exception"""
+                raise ValueError()
+
+            PickleCodec('profiler test')
+            transport = LoopbackTransport('profiler test')
+            router = get_router('profiler test')
+            await router.activate(transport)
+            profiler = Profiler(memory=True, interval=0.005)
+            profiler.enable('profiler test')
+            await asyncio.gather(_busy(), _busy(), _idle())
+            with self.assertRaises(ValueError):
+                await _failing()
+            profiler.disable()
+            await router.deactivate()
+
+            stats = profiler.stats()
+            self.assertEqual(stats['busy']['calls'], 2)
+            self.assertGreaterEqual(stats['busy']['cpu'], 0.25)
+            self.assertGreaterEqual(stats['busy']['wall'], 0.3)
+            self.assertGreater(stats['busy']['memory'], 0)
+            self.assertEqual(stats['idle']['calls'], 1)
+            self.assertGreaterEqual(stats['idle']['wall'], 0.3)
+            self.assertLess(stats['idle']['cpu'], 0.05)
+            self.assertEqual(stats['failing']['errors'], 1)
+
+            directory = tempfile.mkdtemp()
+            profiler.dump(directory)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'stats.json')))
+            functions = [function for filename, line, function in pstats.Stats(os.path.join(directory, 'busy.pstats')).stats]
+            self.assertIn('_burn', functions)
+            self.assertNotIn('_burn', [function for filename, line, function in pstats.Stats(os.path.join(directory, 'idle.pstats')).stats])
+            with open(os.path.join(directory, 'stacks.folded')) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(any(line.startswith('busy;') and ':_burn ' in line for line in lines))
+            self.assertFalse(any(line.startswith('idle;') and ':_burn ' in line for line in lines))
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_sample_rate(self):
+        """Test, whether only the fraction of calls is profiled"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='sampled', namespace='profiler sampling')
+            async def _sampled():
+                """Atask being sampled"""
+
+            PickleCodec('profiler sampling')
+            transport = LoopbackTransport('profiler sampling')
+            router = get_router('profiler sampling')
+            await router.activate(transport)
+            profiler = Profiler(sample_rate=0.1, profile=False)
+            profiler.enable('profiler sampling')
+            for i in range(500):
+                await _sampled()
+            profiler.disable()
+            await router.deactivate()
+            self.assertLess(profiler.stats()['sampled']['calls'], 150)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_run_atask_profile(self):
+        """Test scenarios with profiling enabled"""
+        directory = tempfile.mkdtemp()
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', profile=directory)
+        self.assertTrue(os.path.exists(os.path.join(directory, str(os.getpid()), 'stats.json')))
+
+    def test_004_threads(self):
+        """Test, whether statistics of atasks processed by several threads are consistent"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='stepping', namespace='profiler threads')
+            async def _stepping():
+                """Atask having several steps"""
+                for i in range(3):
+                    await asyncio.sleep(0)
+
+            PickleCodec('profiler threads')
+            transport = ThreadPoolTransport('profiler threads', workers=4)
+            await transport.connect()
+            router = get_router('profiler threads')
+            await router.activate(transport)
+            profiler = Profiler(profile=False)
+            profiler.enable('profiler threads')
+            await asyncio.gather(*[_stepping() for i in range(1000)])
+            profiler.disable()
+            await router.deactivate()
+            await transport.disconnect()
+            self.assertEqual(profiler.stats()['stepping']['calls'], 1000)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,71 @@
+"""
+Graceful drain tests
+"""
+import asyncio
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.sockets import SocketTransport
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_router_drain(self):
+        """Test, whether the router finishes requests being processed in the grace period"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='slow', namespace='drain router')
+            async def _slow(delay):
+                """Atask processed slowly"""
+                await asyncio.sleep(delay)
+                return delay
+
+            PickleCodec('drain router')
+            transport = LoopbackTransport('drain router')
+            router = get_router('drain router')
+            await router.activate(transport)
+            received = router.wait_requests(2)
+            first = asyncio.ensure_future(_slow(0.2))
+            await asyncio.sleep(0.05)
+            self.assertFalse(received.done())
+            second = asyncio.ensure_future(_slow(1))
+            self.assertEqual(await received, 2)
+            self.assertEqual(router.active, 2)
+            self.assertFalse(await router.drain(0.3))
+            self.assertIsNone(router.server)
+            self.assertEqual(await first, 0.2)
+            self.assertFalse(second.done())
+            self.assertTrue(await router.drain(1))
+            self.assertEqual(await second, 1)
+            self.assertEqual(router.active, 0)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_sockets_refuse(self):
+        """Test, whether the draining worker finishes requests and refuses new ones sent then to another worker"""
+        async def _test_():
+            """Async test body"""
+            servers = [SocketTransport('drain server %s' % i) for i in range(2)]
+            for i, server in enumerate(servers):
+                async def _callback(name, content, prefix=b'%d' % i):
+                    await asyncio.sleep(0.2)
+                    return prefix + content
+
+                await server.register_callback(_callback)
+            client = SocketTransport('drain client', workers=[server.address for server in servers])
+            slow = asyncio.ensure_future(client.send_request('test', b'a'))
+            await asyncio.sleep(0.05)
+            await servers[0].unregister_callback()
+            self.assertEqual(await asyncio.gather(*[client.send_request('test', b'%d' % i) for i in range(2)]), [b'10', b'11'])
+            self.assertTrue(await servers[0].drain(1))
+            self.assertEqual(await slow, b'0a')
+            self.assertEqual(servers[0]._connections, set())
+            await client.disconnect()
+            await servers[1].unregister_callback()
+            await servers[1].disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,170 @@
+"""
+Remote result references tests
+"""
+import asyncio
+import time
+
+from atasks.codecs import PickleCodec
+from atasks.refs import ObjectStore, RefNotFound, RemoteRef, resolve
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.amqp import AMQPTransport
+from atasks.transport.backends.sockets import SocketTransport
+from atasks.transport.base import LoopbackTransport
+from atasks.transport.memory import Broker
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_store(self):
+        """Test TTL and eviction of the object store"""
+        store = ObjectStore('refs store', ttl=0.2, max_items=2)
+        first = store.put(1)
+        second = store.put(2)
+        self.assertEqual(store.get(first), 1)
+        third = store.put(3)
+        self.assertNotIn(second, store)
+        self.assertEqual(store.get(first), 1)
+        self.assertEqual(store.get(third), 3)
+        store.delete(third)
+        fourth = store.put(4)
+        time.sleep(0.3)
+        self.assertRaises(RefNotFound, store.get, first)
+        self.assertNotIn(fourth, store)
+        self.assertEqual(len(store), 0)
+
+    def test_002_loopback(self):
+        """Test, whether the referenced result is passed to another atask"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='load', namespace='refs loopback', ref=True)
+            async def _load(size):
+                """Atask returning the large result"""
+                return list(range(size))
+
+            @atask(name='total', namespace='refs loopback')
+            async def _total(data, offset=0):
+                """Atask using the large result"""
+                return sum(data) + offset
+
+            PickleCodec('refs loopback')
+            transport = LoopbackTransport('refs loopback')
+            router = get_router('refs loopback')
+            await router.activate(transport)
+            ref = await _load(100)
+            self.assertIsInstance(ref, RemoteRef)
+            self.assertIsNone(ref.owner)
+            self.assertEqual(await _total(ref), 4950)
+            self.assertEqual(await _total(data=ref, offset=1), 4951)
+            self.assertEqual(await resolve(ref), list(range(100)))
+            with self.assertRaises(RefNotFound):
+                await _total(RemoteRef('unknown', namespace='refs loopback'))
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_worker_to_worker(self):
+        """Test, whether the referenced result is fetched from the worker holding it"""
+        async def _test_():
+            """Async test body"""
+            stores = {}
+            transports = []
+            for i in range(2):
+                namespace = 'refs worker %s' % i
+                stores[i] = ObjectStore(namespace)
+                PickleCodec(namespace)
+
+                @atask(name='load', namespace=namespace, ref=True)
+                async def _load(size):
+                    """Atask returning the large result"""
+                    return list(range(size))
+
+                @atask(name='total', namespace=namespace)
+                async def _total(data):
+                    """Atask using the large result"""
+                    return sum(data)
+
+                transport = SocketTransport(namespace)
+                await get_router(namespace).activate(transport)
+                transports.append(transport)
+
+            PickleCodec('refs client')
+            client = SocketTransport('refs client', workers=[transport.address for transport in transports])
+            router = get_router('refs client')
+            load = router.register_atask('load')
+            total = router.register_atask('total')
+            ref = await load(10)
+            self.assertIn(ref.owner, [transport.address for transport in transports])
+            owner = [transport.address for transport in transports].index(ref.owner)
+            self.assertIn(ref.key, stores[owner])
+            for i in range(4):
+                # the request is sent to the worker holding the result
+                self.assertEqual(await total(ref), 45)
+            # the result is fetched by another worker
+            other = get_router('refs worker %s' % (1 - owner))
+            self.assertEqual(await other.resolve_ref(RemoteRef(ref.key, ref.owner, 'refs worker %s' % (1 - owner))), list(range(10)))
+            self.assertEqual(await resolve(RemoteRef(ref.key, ref.owner, 'refs client')), list(range(10)))
+            await client.disconnect()
+            for transport in transports:
+                await get_router(transport.namespace).deactivate()
+                await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_amqp(self):
+        """Test, whether AMQP workers are addressed by their exclusive queues to fetch referenced results"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker()
+            transports = []
+            for i in range(2):
+                namespace = 'refs amqp %s' % i
+                PickleCodec(namespace)
+
+                @atask(name='amqp load', namespace=namespace, ref=True)
+                async def _load(size):
+                    """Atask returning the large result"""
+                    return list(range(size))
+
+                @atask(name='amqp total', namespace=namespace)
+                async def _total(data):
+                    """Atask using the large result"""
+                    return sum(data)
+
+                transport = AMQPTransport(namespace, driver=broker)
+                await transport.connect()
+                await get_router(namespace).activate(transport)
+                transports.append(transport)
+
+            addresses = [transport.local_address() for transport in transports]
+            self.assertTrue(all(address.startswith('amqp:') for address in addresses))
+            PickleCodec('refs amqp client')
+            client = AMQPTransport('refs amqp client', driver=broker)
+            await client.connect()
+            self.assertIsNone(client.local_address())
+            router = get_router('refs amqp client')
+            load = router.register_atask('amqp load')
+            total = router.register_atask('amqp total')
+            refs = [await load(10 * i) for i in range(1, 5)]
+            self.assertEqual(set(ref.owner for ref in refs), set(addresses))
+            refs = [RemoteRef(ref.key, ref.owner, 'refs amqp client') for ref in refs]
+            for i, ref in enumerate(refs):
+                self.assertEqual(await resolve(ref), list(range(10 * (i + 1))))
+                self.assertEqual(await total(ref), sum(range(10 * (i + 1))))
+            ref = refs[0]
+            other = 1 - addresses.index(ref.owner)
+            namespace = 'refs amqp %s' % other
+            self.assertEqual(await get_router(namespace).resolve_ref(RemoteRef(ref.key, ref.owner, namespace)), list(range(10)))
+
+            owner = transports[addresses.index(ref.owner)]
+            await get_router(owner.namespace).deactivate()
+            await owner.disconnect()
+            with self.assertRaises(RefNotFound):
+                await asyncio.wait_for(resolve(ref), 1)
+            await client.disconnect()
+            await get_router(transports[other].namespace).deactivate()
+            await transports[other].disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
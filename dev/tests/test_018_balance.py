@@ -0,0 +1,118 @@
+"""
+Load balancing tests
+"""
+import asyncio
+import collections
+import time
+import types
+
+from atasks.transport.backends.sockets import SocketTransport, _queue_delay
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    async def _servers(self, delays, **options):
+        """Start socket servers processing requests with delays, and count requests received by every server"""
+        counts = collections.Counter()
+        servers = []
+        for i, delay in enumerate(delays):
+            server = SocketTransport('balance server %s' % i, **options)
+
+            async def _callback(name, content, i=i, delay=delay):
+                counts[i] += 1
+                await asyncio.sleep(delay)
+                return content
+
+            await server.register_callback(_callback)
+            servers.append(server)
+        return servers, counts
+
+    async def _stop(self, client, servers):
+        """Stop the client and servers"""
+        await client.disconnect()
+        for server in servers:
+            await server.unregister_callback()
+            await server.disconnect()
+
+    def test_001_load_report(self):
+        """Test, whether the worker reports requests in flight to clients"""
+        async def _test_():
+            """Async test body"""
+            servers, counts = await self._servers([0.5], load_interval=0.05)
+            busy = SocketTransport('balance busy', workers=[servers[0].address])
+            idle = SocketTransport('balance idle', workers=[servers[0].address])
+            await idle.connect()
+            requests = [asyncio.ensure_future(busy.send_request('test', b'%d' % i)) for i in range(5)]
+            await asyncio.sleep(0.2)
+            connection = idle._peers[servers[0].address].connection
+            inflight, lag, delay = connection.load
+            self.assertEqual(inflight, 5)
+            self.assertLess(lag, 0.05)
+            self.assertLess(delay, 0.05)
+            await asyncio.gather(*requests)
+            await busy.disconnect()
+            await self._stop(idle, servers)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_least_loaded(self):
+        """Test, whether requests are sent mostly to the fast worker"""
+        async def _test_():
+            """Async test body"""
+            servers, counts = await self._servers([0.1, 0.005])
+            client = SocketTransport('balance client', workers=[server.address for server in servers], balance='least-loaded')
+            for i in range(30):
+                self.assertEqual(await client.send_request('test', b'%d' % i), b'%d' % i)
+            self.assertGreater(counts[1], 25)
+            await self._stop(client, servers)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_power_of_two_choices(self):
+        """Test, whether concurrent requests avoid the slow worker"""
+        async def _test_():
+            """Async test body"""
+            servers, counts = await self._servers([0.2, 0.01, 0.01, 0.01], load_interval=0.05)
+            client = SocketTransport('balance client', workers=[server.address for server in servers], balance='p2c')
+            for i in range(10):
+                await asyncio.gather(*[client.send_request('test', b'%d' % i) for i in range(4)])
+            self.assertLess(counts[0], 10)
+            self.assertEqual(sum(counts.values()), 40)
+            await self._stop(client, servers)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_round_robin(self):
+        """Test, whether requests are sent to workers in turn by default"""
+        async def _test_():
+            """Async test body"""
+            servers, counts = await self._servers([0.1, 0.005])
+            client = SocketTransport('balance client', workers=[server.address for server in servers])
+            for i in range(10):
+                await client.send_request('test', b'%d' % i)
+            self.assertEqual(counts, {0: 5, 1: 5})
+            await self._stop(client, servers)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_005_queue_delay(self):
+        """Test, whether callbacks queued in the worker event loop make the estimated response time longer"""
+        loop = asyncio.get_event_loop()
+
+        async def _busy():
+            for i in range(5):
+                loop.call_soon(time.sleep, 0.01)
+            return await _queue_delay(loop)
+
+        self.assertGreaterEqual(loop.run_until_complete(_busy()), 0.05)
+        self.assertLess(loop.run_until_complete(_queue_delay(loop)), 0.05)
+
+        client = SocketTransport('balance queue delay', workers=['tcp://127.0.0.1:1', 'tcp://127.0.0.1:2'])
+        for address, delay in (('tcp://127.0.0.1:1', 0.0), ('tcp://127.0.0.1:2', 0.05)):
+            client._peer(address).connection = types.SimpleNamespace(
+                closed=False, inflight=0, load_time=loop.time(), load=(0, 0.0, delay),
+            )
+        quiet, busy = [client._estimate(client._peer(address), 'test') for address in client.workers]
+        self.assertLess(quiet, busy)
@@ -0,0 +1,73 @@
+"""
+Batched atasks tests
+"""
+import asyncio
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.threads import ThreadPoolTransport
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_batches(self):
+        """Test, whether concurrent calls are collected into batches, and results are scattered back"""
+        async def _test_():
+            """Async test body"""
+            batches = []
+
+            @atask(name='square', namespace='batch test', batch_size=4, batch_wait=0.05)
+            async def _square(items):
+                """Batched atask"""
+                batches.append(items)
+                return [ValueError(item) if item < 0 else item * item for item in items]
+
+            @atask(name='broken', namespace='batch test', batch_size=2)
+            async def _broken(items):
+                """Batched atask returning the wrong number of results"""
+                return []
+
+            PickleCodec('batch test')
+            transport = LoopbackTransport('batch test')
+            router = get_router('batch test')
+            await router.activate(transport)
+
+            results = await asyncio.gather(*[_square(i) for i in range(10)])
+            self.assertEqual(results, [i * i for i in range(10)])
+            self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+
+            results = await asyncio.gather(_square(2), _square(-1), _square(3), return_exceptions=True)
+            self.assertEqual(results[0], 4)
+            self.assertIsInstance(results[1], ValueError)
+            self.assertEqual(results[2], 9)
+
+            with self.assertRaises(TypeError):
+                await _square(1, 2)
+            with self.assertRaises(TypeError):
+                await _broken(1)
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_thread_workers(self):
+        """Test, whether batches are collected by every worker loop separately"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='double', namespace='batch threads', batch_size=8, batch_wait=0.05)
+            async def _double(items):
+                """Batched atask"""
+                return [item * 2 for item in items]
+
+            PickleCodec('batch threads')
+            transport = ThreadPoolTransport('batch threads', workers=2)
+            await transport.connect()
+            await get_router('batch threads').activate(transport)
+            results = await asyncio.gather(*[_double(i) for i in range(40)])
+            self.assertEqual(results, [i * 2 for i in range(40)])
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,79 @@
+"""
+Django ORM integration tests
+"""
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.base import LoopbackTransport
+from django_atasks import db
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_pool(self):
+        """Test, whether calls are processed by the sized pool of threads"""
+        async def _test_():
+            """Async test body"""
+            executor = db.DatabaseExecutor(max_workers=3)
+
+            def _call():
+                time.sleep(0.05)
+                return threading.get_ident()
+
+            started = time.monotonic()
+            threads = await asyncio.gather(*[executor.run(_call) for i in range(12)])
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(len(set(threads)), 3)
+            self.assertNotIn(threading.get_ident(), threads)
+            executor.shutdown()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_connections(self):
+        """Test, whether connections of the thread are reused, and old ones are closed around every call"""
+        async def _test_():
+            """Async test body"""
+            executor = db.DatabaseExecutor(max_workers=1, health_checks=True)
+
+            def _query():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                return id(connection.connection)
+
+            with mock.patch('django_atasks.db.close_old_connections') as close_old_connections:
+                first = await executor.run(_query)
+                second = await executor.run(_query)
+            self.assertEqual(first, second)
+            self.assertEqual(close_old_connections.call_count, 4)
+            executor.shutdown()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_atask(self):
+        """Test the atask using the ORM"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='users', namespace='db test')
+            @db.database_sync_to_async
+            def _users(prefix):
+                """Atask using the ORM"""
+                return sorted(User.objects.filter(username__startswith=prefix).values_list('username', flat=True))
+
+            PickleCodec('db test')
+            transport = LoopbackTransport('db test')
+            router = get_router('db test')
+            await router.activate(transport)
+            self.assertEqual(await _users('nobody'), [])
+            self.assertIs(db.get_executor(), db.get_executor())
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,122 @@
+"""
+Shared transport tests
+"""
+import asyncio
+
+from atasks.codecs import PickleCodec
+from atasks.namespaces import namespaces
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.amqp import AMQPTransport
+from atasks.transport.base import LoopbackTransport
+from atasks.transport.memory import Broker
+from atasks.transport.multiplex import (
+    MultiplexedTransport,
+    Multiplexer,
+    envelope,
+)
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_dispatch(self):
+        """Test dispatching requests received by the shared transport to namespaces"""
+        async def _test_():
+            """Async test body"""
+            shared = Multiplexer(LoopbackTransport('mux loopback'))
+            transports = {}
+            for namespace in ('mux first', 'mux second'):
+                @atask(name='whoami', namespace=namespace)
+                async def _coro(namespace=namespace):
+                    """Atask having the same name in both namespaces"""
+                    return namespace
+
+                PickleCodec(namespace)
+                transports[namespace] = MultiplexedTransport(namespace, shared)
+                await transports[namespace].connect()
+                await get_router(namespace).activate(transports[namespace])
+
+            self.assertIsNone(getattr(namespaces.get('mux loopback'), 'registry', None))
+            self.assertIs(shared.transport.served_registry(), shared)
+            self.assertEqual(
+                sorted(name for name, options in shared.transport.routes()),
+                [envelope('mux first', 'whoami'), envelope('mux second', 'whoami')],
+            )
+            self.assertIsNotNone(shared.get(envelope('mux first', 'whoami')))
+            self.assertIsNone(shared.get('whoami'))
+            self.assertIsNone(shared.get(envelope('mux unknown', 'whoami')))
+            self.assertEqual(
+                sorted(name for name, item in shared.items()),
+                [envelope('mux first', 'whoami'), envelope('mux second', 'whoami')],
+            )
+
+            codec = PickleCodec('mux first')
+            for namespace, transport in transports.items():
+                response = await transport.send_request('whoami', await codec.encode(((), {})))
+                self.assertEqual(await codec.decode(response), (True, namespace))
+
+            await get_router('mux second').deactivate()
+            self.assertIsNotNone(shared.transport.callback)
+            self.assertIsNone(await shared.transport.send_request(envelope('mux second', 'whoami'), b''))
+            await get_router('mux first').deactivate()
+            self.assertIsNone(shared.transport.callback)
+            for transport in transports.values():
+                await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_amqp(self):
+        """Test namespaces sharing one connection to the broker"""
+        async def _test_():
+            """Async test body"""
+            broker = Broker()
+            connections = []
+            connect_robust = broker.connect_robust
+
+            async def _connect_robust(*argv, **kwargs):
+                connections.append(await connect_robust(*argv, **kwargs))
+                return connections[-1]
+
+            broker.connect_robust = _connect_robust
+            shared = Multiplexer(AMQPTransport('mux amqp', driver=broker))
+
+            @atask(name='mux add', namespace='mux billing')
+            async def _add(a, b):
+                """Atask of the first namespace"""
+                return a + b
+
+            @atask(name='mux mul', namespace='mux reports')
+            async def _mul(a, b):
+                """Atask of the second namespace"""
+                return a * b
+
+            for namespace in ('mux billing', 'mux reports'):
+                PickleCodec(namespace)
+                transport = MultiplexedTransport(namespace, shared)
+                await transport.connect()
+                await get_router(namespace).activate(transport)
+
+            @atask(name='mux sub', namespace='mux reports')
+            async def _sub(a, b):
+                """Atask registered after the router is activated"""
+                return a - b
+
+            self.assertEqual(await _add(2, 3), 5)
+            self.assertEqual(await _mul(2, 3), 6)
+            self.assertEqual(await _sub(2, 3), -1)
+            results = await asyncio.gather(*([_add(a, 1) for a in range(5)] + [_mul(a, 2) for a in range(5)]))
+            self.assertEqual(results, [1, 2, 3, 4, 5, 0, 2, 4, 6, 8])
+            self.assertEqual(len(connections), 1)
+            # the response queue and the request queue addressing the worker
+            self.assertEqual(len([q for q in broker.queues.values() if q.exclusive]), 2)
+
+            for namespace in ('mux billing', 'mux reports'):
+                router = get_router(namespace)
+                transport = router.server
+                await router.deactivate()
+                await transport.disconnect()
+            self.assertFalse([q for q in broker.queues.values() if q.exclusive])
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,133 @@
+"""
+Request trace recorder and replay tests
+"""
+import asyncio
+import os
+import tempfile
+
+from atasks.bench.replay import Replay, Trace
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.trace import CALL, SERVE, Recorder, read_trace
+from atasks.transport.base import LoopbackTransport
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_record(self):
+        """Test recording names, sizes, nesting and durations of requests"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='inner', namespace='trace test')
+            async def _inner(payload):
+                """Nested atask"""
+                await asyncio.sleep(0.02)
+                return payload * 2
+
+            @atask(name='outer', namespace='trace test')
+            async def _outer(payload):
+                """Atask calling nested atasks sequentially"""
+                first = await _inner(payload)
+                return await _inner(first)
+
+            PickleCodec('trace test')
+            router = get_router('trace test')
+            await router.activate(LoopbackTransport('trace test'))
+            recorder = Recorder()
+            recorder.enable('trace test')
+            await asyncio.gather(_outer(b'x' * 1000), _outer(b'x' * 1000))
+            recorder.disable()
+            await _outer(b'')
+            await router.deactivate()
+
+            path = os.path.join(tempfile.mkdtemp(), 'test.trace.gz')
+            recorder.dump(path)
+            events = read_trace(path)
+            self.assertEqual(len(events), 12)
+            roots = [event for event in events if event.parent is None and event.kind == CALL]
+            self.assertEqual([event.name for event in roots], ['outer', 'outer'])
+            self.assertTrue(all(event.size > 1000 and event.response_size > 4000 for event in roots))
+            self.assertTrue(all(event.duration >= 0.04 for event in roots))
+            served = dict((event.id, event) for event in events if event.kind == SERVE)
+            nested = [event for event in events if event.parent is not None]
+            self.assertEqual(len(nested), 4)
+            self.assertTrue(all(event.name == 'inner' and served[event.parent].name == 'outer' for event in nested))
+            self.assertTrue(all(event.kind == CALL and event.duration >= 0.02 for event in nested))
+
+            anonymous = Recorder(anonymize=True)
+            anonymous.enable('trace test')
+            await router.activate(LoopbackTransport('trace test'))
+            await _outer(b'')
+            await router.deactivate()
+            anonymous.disable()
+            names = set(event.name for event in anonymous.events)
+            self.assertEqual(len(names), 2)
+            self.assertFalse(names & {'inner', 'outer'})
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_replay(self):
+        """Test replaying the recorded load with synthetic atasks"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='leaf', namespace='replay source')
+            async def _leaf(payload):
+                """Nested atask"""
+                await asyncio.sleep(0.05)
+                return payload
+
+            @atask(name='root', namespace='replay source')
+            async def _root(payload):
+                """Atask calling nested atasks in parallel"""
+                await asyncio.gather(_leaf(payload), _leaf(payload[:10]))
+                return len(payload)
+
+            PickleCodec('replay source')
+            router = get_router('replay source')
+            await router.activate(LoopbackTransport('replay source'))
+            recorder = Recorder()
+            recorder.enable('replay source')
+            for i in range(5):
+                await _root(b'x' * 5000)
+                await asyncio.sleep(0.1)
+            recorder.disable()
+            await router.deactivate()
+            path = os.path.join(tempfile.mkdtemp(), 'test.trace')
+            recorder.dump(path)
+
+            PickleCodec('replay test')
+            router = get_router('replay test')
+            await router.activate(LoopbackTransport('replay test'))
+            replay = Replay(Trace.load(path), 'replay test', speed=2)
+            replay.register()
+            replayed = Recorder()
+            replayed.enable('replay test')
+            results = await replay.run()
+            replayed.disable()
+            await router.deactivate()
+
+            self.assertEqual(results['calls'], 5)
+            self.assertEqual(results['errors'], 0)
+            self.assertGreaterEqual(results['p50'], 0.025)  # durations of nested calls are halved too
+            self.assertLess(results['p50'], 0.05)
+            self.assertLess(results['elapsed'], 0.5)
+            self.assertGreaterEqual(results['elapsed'], 0.2)
+            original = sorted((event.kind, event.name, event.parent is None) for event in recorder.events)
+            self.assertEqual(sorted((event.kind, event.name, event.parent is None) for event in replayed.events), original)
+            for before, after in zip(recorder.events, replayed.events):
+                self.assertAlmostEqual(before.size, after.size, delta=8)
+                self.assertAlmostEqual(before.response_size, after.response_size, delta=8)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_run_atask_record(self):
+        """Test recording scenarios and replaying them by the command"""
+        directory = tempfile.mkdtemp()
+        call_command('run_atask', 'dev.tests.scenarios', verbosity=0, mode='loopback', record=directory, record_anonymize=True)
+        path = os.path.join(directory, '%s.trace.gz' % os.getpid())
+        self.assertTrue(read_trace(path))
+        call_command('run_atask', verbosity=0, mode='loopback', replay=[path], replay_speed=10)
@@ -0,0 +1,120 @@
+"""
+Live introspection tests
+"""
+import asyncio
+import json
+
+from atasks import introspect
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.transport.backends.amqp import AMQPTransport
+from atasks.transport.base import LoopbackTransport
+from atasks.transport.memory import Broker
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_snapshot(self):
+        """Test listing nested requests in flight with their await points"""
+        async def _test_():
+            """Async test body"""
+            released = asyncio.Event()
+
+            @atask(name='inner', namespace='introspect test')
+            async def _inner():
+                """Atask waiting until released"""
+                await released.wait()
+
+            @atask(name='outer', namespace='introspect test')
+            async def _outer():
+                """Atask calling the nested atask"""
+                await _inner()
+
+            PickleCodec('introspect test')
+            router = get_router('introspect test')
+            await router.activate(LoopbackTransport('introspect test'))
+            future = asyncio.ensure_future(_outer())
+            await asyncio.sleep(0.1)
+
+            snapshot = introspect.snapshot('introspect test')['namespaces']['introspect test']
+            serving = dict((request['name'], request) for request in snapshot['serving'])
+            sending = dict((request['name'], request) for request in snapshot['sending'])
+            self.assertEqual(set(serving), {'inner', 'outer'})
+            self.assertEqual(set(sending), {'inner', 'outer'})
+            self.assertIsNone(sending['outer']['parent'])
+            self.assertEqual(sending['inner']['parent'], serving['outer']['id'])
+            self.assertGreaterEqual(serving['outer']['age'], 0.1)
+            self.assertIn(':_inner:', serving['inner']['await'])
+            self.assertIn('Future', serving['inner']['awaiting'])
+            self.assertIn(':_outer:', ' '.join(serving['outer']['stack']))
+            self.assertEqual(introspect.snapshot('introspect test', stack_limit=0)['namespaces']['introspect test']['serving'][0]['stack'], [])
+
+            released.set()
+            await future
+            snapshot = introspect.snapshot('introspect test')['namespaces']['introspect test']
+            self.assertEqual(snapshot['serving'], [])
+            self.assertEqual(snapshot['sending'], [])
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_http(self):
+        """Test serving snapshots with requests in flight of the transport over HTTP"""
+        async def _test_():
+            """Async test body"""
+            released = asyncio.Event()
+
+            @atask(name='waiting', namespace='introspect http')
+            async def _waiting():
+                """Atask waiting until released"""
+                await released.wait()
+
+            PickleCodec('introspect http')
+            transport = AMQPTransport('introspect http', driver=Broker())
+            await transport.connect()
+            router = get_router('introspect http')
+            await router.activate(transport)
+            future = asyncio.ensure_future(_waiting())
+            await asyncio.sleep(0.1)
+
+            server = await introspect.start_server('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /?stack=5 HTTP/1.0\r\nHost: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            head, body = response.split(b'\r\n\r\n', 1)
+            self.assertTrue(head.startswith(b'HTTP/1.0 200 OK'))
+            snapshot = json.loads(body)['namespaces']['introspect http']
+            self.assertEqual([request['name'] for request in snapshot['serving']], ['waiting'])
+            self.assertEqual([request['name'] for request in snapshot['transport']], ['waiting'])
+            self.assertLessEqual(len(snapshot['serving'][0]['stack']), 5)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /?stack=all HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            self.assertTrue(response.startswith(b'HTTP/1.0 400 Bad Request'))
+
+            released.set()
+            await future
+            self.assertEqual(transport.pending_requests(), [])
+            server.close()
+            await server.wait_closed()
+            await router.deactivate()
+            await transport.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_view(self):
+        """Test the view of requests in flight available to staff members"""
+        self.assertEqual(self.client.get('/atasks/inflight/').status_code, 302)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/atasks/inflight/?stack=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('namespaces', response.json())
+        self.assertEqual(self.client.get('/atasks/inflight/?stack=-1').status_code, 400)
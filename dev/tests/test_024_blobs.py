@@ -0,0 +1,172 @@
+"""
+Content-addressed argument cache tests
+"""
+import asyncio
+
+from atasks.blobs import Blob, BlobMissing, get_blobs
+from atasks.codecs import PickleCodec, get_codec
+from atasks.router import get_router
+from atasks.tasks import atask
+from atasks.trace import Recorder
+from atasks.transport.backends.processes import ProcessPoolTransport
+from atasks.transport.backends.threads import ThreadPoolTransport
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+class _CountingCodec(PickleCodec):
+    """Codec counting encoded dictionaries"""
+    encoded = 0
+
+    async def encode(self, obj):
+        """Overriden from the base class"""
+        if isinstance(obj, dict):
+            self.encoded += 1
+        return await super().encode(obj)
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_once_per_worker(self):
+        """Test, whether the large argument is encoded and sent once"""
+        async def _test_():
+            """Async test body"""
+            tables = set()
+
+            @atask(name='lookup', namespace='blobs test', blob_size=1000)
+            async def _lookup(table, key, default=None):
+                """Atask getting the value from the large table"""
+                tables.add(id(table))
+                return table.get(key, default)
+
+            codec = _CountingCodec('blobs test')
+            router = get_router('blobs test')
+            await router.activate(LoopbackTransport('blobs test'))
+            recorder = Recorder()
+            recorder.enable('blobs test')
+            table = dict((i, i * i) for i in range(10000))
+            self.assertEqual(await _lookup(table, 3), 9)
+            results = await asyncio.gather(*[_lookup(table, i, default=b'x' * 2000) for i in range(100)])
+            self.assertEqual(results, [i * i for i in range(100)])
+            self.assertEqual(await _lookup(table, -1, default='small'), 'small')
+            recorder.disable()
+            await router.deactivate()
+
+            self.assertEqual(codec.encoded, 1)
+            self.assertEqual(len(tables), 1)
+            sizes = [event.size for event in recorder.events if event.kind == 'c']
+            self.assertEqual(len(sizes), 102)  # large arguments are sent along with the first call
+            self.assertGreater(sizes[0], 50000)
+            self.assertEqual(len([size for size in sizes if size > 1000]), 2)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_evicted(self):
+        """Test sending the argument again after the worker has evicted it"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='size', namespace='blobs evicted', blob_size=100)
+            async def _size(data):
+                """Atask getting the size of the data"""
+                return len(data)
+
+            @atask(name='notify', namespace='blobs evicted', blob_size=100, reply=False)
+            async def _notify(data):
+                """Atask with no reply getting the data"""
+                received.append(len(data))
+
+            received = []
+            PickleCodec('blobs evicted')
+            store = get_blobs('blobs evicted')
+            store.max_bytes = 1500
+            router = get_router('blobs evicted')
+            await router.activate(LoopbackTransport('blobs evicted'))
+            first, second = [1] * 500, [2] * 500
+            for data in (first, second, first, second):
+                self.assertEqual(await _size(data), 500)
+            self.assertEqual(len(store._decoded), 1)
+            await _notify(list(range(1000)))
+            await asyncio.sleep(0.01)
+            self.assertEqual(received, [1000])
+            await router.deactivate()
+
+            argv, kwargs = await store.wrap((first, 1), {'small': 'x'}, 100)
+            self.assertIsInstance(argv[0], Blob)
+            self.assertEqual(argv[1:], [1])
+            self.assertEqual(kwargs, {'small': 'x'})
+            codec = get_codec('blobs evicted')
+            argv, kwargs = await codec.decode(await codec.encode((argv, kwargs)))
+            store._decoded.clear()
+            store._size = 0
+            with self.assertRaises(BlobMissing):
+                await store.unwrap(argv, kwargs)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_fan_out(self):
+        """Test, whether concurrent calls wait until the new argument is sent by the first one"""
+        async def _test_():
+            """Async test body"""
+            @atask(name='lookup', namespace='blobs fan-out', blob_size=1000)
+            async def _lookup(table, options, key):
+                """Atask getting the value from the large table"""
+                return table[key] * options['scale']
+
+            codec = _CountingCodec('blobs fan-out')
+            store = get_blobs('blobs fan-out')
+            transport = ThreadPoolTransport('blobs fan-out', workers=4)
+            await transport.connect()
+            router = get_router('blobs fan-out')
+            await router.activate(transport)
+            recorder = Recorder()
+            recorder.enable('blobs fan-out')
+            table = dict((i, i * i) for i in range(10000))
+            options = {'scale': 2}
+            results = await asyncio.gather(*[_lookup(table, options, i) for i in range(100)])
+            self.assertEqual(results, [i * i * 2 for i in range(100)])
+            recorder.disable()
+            await router.deactivate()
+            await transport.disconnect()
+
+            sizes = [event.size for event in recorder.events if event.kind == 'c']
+            self.assertEqual(len(sizes), 100)
+            self.assertEqual(len([size for size in sizes if size > 1000]), 1)
+            self.assertEqual(codec.encoded, 1)  # small arguments are not encoded to be measured
+            self.assertEqual([entry[0] for entry in store._encoded.values()], [table])
+            self.assertTrue(all(future.done() for future in store._sent.values()))
+
+            steps = [0] * 100
+            self.assertEqual(await store.wrap((steps,), {}, 1000), ([steps], {}))
+            self.assertEqual(store._small[id(steps)], (steps, 1000))  # the large object graph is walked once
+            self.assertEqual(codec.encoded, 1)
+            values = dict((i, i) for i in range(100))
+            self.assertEqual(await store.wrap((values,), {}, 1000), ([values], {}))
+            self.assertEqual(await store.wrap((values,), {}, 1000), ([values], {}))
+            self.assertEqual(codec.encoded, 2)  # the candidate found small by encoding is encoded once
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_workers(self):
+        """Test, whether the large argument is sent once to every worker process with no missing arguments"""
+        async def _test_():
+            """Async test body"""
+            PickleCodec()
+            transport = ProcessPoolTransport(workers=2, modules=['dev.tests.scenarios'])
+            await transport.connect()
+            from dev.tests.scenarios import task_lookup
+
+            recorder = Recorder()
+            recorder.enable('default')
+            table = dict((i, i * i) for i in range(10000))
+            for i in range(3):
+                results = await asyncio.gather(*[task_lookup(table, k) for k in range(20)])
+                self.assertEqual(results, [k * k for k in range(20)])
+            recorder.disable()
+            await transport.disconnect()
+
+            sizes = [event.size for event in recorder.events if event.kind == 'c']
+            self.assertEqual(len(sizes), 60)  # the worker never asks for missing arguments
+            self.assertLessEqual(len([size for size in sizes if size > 1000]), 2)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,167 @@
+"""
+Stateful actor tests
+"""
+import asyncio
+
+from atasks.actors import (
+    ActorNotFound,
+    ActorRef,
+    ActorTable,
+    actor,
+    get_actors,
+)
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+class _AddressedTransport(LoopbackTransport):
+    """Loopback transport pretending to address workers, keeping hints of requests"""
+    def __init__(self, namespace):
+        """Overriden from the base class"""
+        super().__init__(namespace)
+        self.hints = []
+
+    def local_address(self):
+        """Overriden from the base class"""
+        return 'tcp://worker:7100'
+
+    async def send_request(self, name, content, key=None, reply=True, target=None):
+        """Overriden from the base class"""
+        self.hints.append((name, key, target))
+        return await super().send_request(name, content, key=key, reply=reply, target=target)
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_actor(self):
+        """Test calling methods of the actor one by one against its state"""
+        async def _test_():
+            """Async test body"""
+            passivated = []
+
+            @actor(name='counter', namespace='actors test')
+            class Counter(object):
+                """Actor counting calls"""
+                def __init__(self, start=0):
+                    """Constructor"""
+                    self.value = start
+
+                async def incr(self, n=1):
+                    """Increment the value yielding to the loop in between"""
+                    value = self.value
+                    await asyncio.sleep(0)
+                    self.value = value + n
+                    return self.value
+
+                def get(self):
+                    """Synchronous method"""
+                    return self.value
+
+                async def passivate(self):
+                    """Save the state"""
+                    passivated.append(self.value)
+
+            PickleCodec('actors test')
+            transport = _AddressedTransport('actors test')
+            router = get_router('actors test')
+            await router.activate(transport)
+
+            counter = await Counter.create(10)
+            self.assertIsInstance(counter, ActorRef)
+            self.assertEqual(counter.owner, 'tcp://worker:7100')
+            await asyncio.gather(*[counter.incr() for i in range(50)])
+            self.assertEqual(await counter.get(), 60)
+            self.assertEqual(transport.hints[-1], ('counter.call', counter.key, 'tcp://worker:7100'))
+            with self.assertRaises(AttributeError):
+                await counter._call('__init__')
+
+            user = await Counter.activate('user:42', 100)
+            self.assertEqual(await user.incr(5), 105)
+            self.assertEqual(await (await Counter.activate('user:42', 0)).get(), 105)
+            self.assertIn(user, get_actors('actors test'))
+            self.assertEqual(transport.hints[-2][:2], ('counter.activate', 'user:42'))
+
+            await user.passivate()
+            self.assertEqual(passivated, [105])
+            with self.assertRaises(ActorNotFound):
+                await user.get()
+            self.assertEqual(await (await Counter.activate('user:42')).get(), 0)
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_002_eviction(self):
+        """Test dropping least recently used and idle actors"""
+        async def _test_():
+            """Async test body"""
+            passivated = []
+
+            class _Actor(object):
+                """Actor remembering its key"""
+                def __init__(self, key):
+                    """Constructor"""
+                    self.key = key
+
+                def passivate(self):
+                    """Synchronous passivation"""
+                    passivated.append(self.key)
+
+            table = ActorTable('actors eviction', max_items=2, idle_ttl=0.2)
+            for key in ('a', 'b', 'c'):
+                await table.activate('actor', _Actor, key, (key,), {})
+            self.assertEqual(passivated, ['a'])
+            await table.call('actor', 'b', 'passivate', (), {})
+            await table.activate('actor', _Actor, 'd', ('d',), {})
+            self.assertEqual(passivated, ['a', 'b', 'c'])
+            await asyncio.sleep(0.3)
+            await table.activate('actor', _Actor, 'e', ('e',), {})
+            self.assertEqual(passivated, ['a', 'b', 'c', 'b', 'd'])
+            self.assertEqual(len(table), 1)
+            with self.assertRaises(ActorNotFound):
+                await table.passivate('actor', 'a')
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_threads(self):
+        """Test calling methods of the actor from loops of several threads"""
+        async def _test_():
+            """Async test body"""
+            class _Counter(object):
+                """Actor counting calls"""
+                def __init__(self):
+                    """Constructor"""
+                    self.value = 0
+
+                async def incr(self):
+                    """Increment the value yielding to the loop in between"""
+                    value = self.value
+                    await asyncio.sleep(0)
+                    self.value = value + 1
+                    return self.value
+
+            table = ActorTable('actors threads')
+            await table.activate('counter', _Counter, 'a', (), {})
+
+            def _thread(key):
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                try:
+                    loop.run_until_complete(table.activate('counter', _Counter, key, (), {}))
+                    loop.run_until_complete(asyncio.gather(*[
+                        table.call('counter', k, 'incr', (), {}) for i in range(50) for k in ('a', key)
+                    ]))
+                finally:
+                    loop.close()
+                    asyncio.set_event_loop(None)
+
+            loop = asyncio.get_event_loop()
+            await asyncio.gather(*[loop.run_in_executor(None, _thread, key) for key in 'bcd'])
+            self.assertEqual([await table.call('counter', key, 'incr', (), {}) for key in 'abcd'], [151, 51, 51, 51])
+            for key in 'abcd':
+                await table.passivate('counter', key)
+            self.assertEqual(len(table), 0)
+
+        asyncio.get_event_loop().run_until_complete(_test_())
@@ -0,0 +1,122 @@
+"""
+Scheduled call tests
+"""
+import asyncio
+import random
+import time
+
+from atasks.codecs import PickleCodec
+from atasks.router import get_router
+from atasks.scheduler import (
+    TimerRef,
+    TimerWheel,
+    _Timer,
+    call_at,
+    call_later,
+    cancel,
+    get_scheduler,
+)
+from atasks.tasks import atask
+from atasks.transport.base import LoopbackTransport
+
+from django.test import TestCase
+
+
+class ModuleTest(TestCase):
+    """Module tests"""
+    def test_001_wheel(self):
+        """Test firing timers at their ticks across levels and the overflow list"""
+        wheel = TimerWheel(slots=4, levels=2)
+        rnd = random.Random(26)
+        timers = [_Timer(str(i), rnd.randrange(-2, 40), None, 'atask', (), {}) for i in range(2000)]
+        for timer in timers[:1000]:
+            wheel.add(timer)
+        self.assertEqual(len(wheel.timers()), 1000)
+        fired = {}
+        for tick in range(1, 45):
+            if tick == 7:
+                for timer in timers[1000:]:
+                    wheel.add(timer)
+            for timer in wheel.advance(tick):
+                fired[timer.id] = tick
+        self.assertEqual(len(fired), 2000)
+        self.assertEqual(wheel.timers(), [])
+        for timer in timers[:1000]:
+            self.assertEqual(fired[timer.id], max(timer.tick, 1))
+        for timer in timers[1000:]:
+            self.assertEqual(fired[timer.id], max(timer.tick, 7))
+
+    def test_002_call_later(self):
+        """Test sending scheduled calls through the router, and cancelling them"""
+        async def _test_():
+            """Async test body"""
+            calls = []
+
+            @atask(name='scheduled', namespace='scheduler test')
+            async def scheduled(value, delay=0):
+                """Atask remembering calls"""
+                calls.append((value, delay, time.time()))
+
+            PickleCodec('scheduler test')
+            router = get_router('scheduler test')
+            await router.activate(LoopbackTransport('scheduler test'))
+            scheduler = get_scheduler('scheduler test')
+
+            started = time.time()
+            for value in range(5):
+                await call_later(0.1 * value, scheduled, value, delay=0.1 * value)
+            cancelled = await call_at(started + 0.15, scheduled, 'cancelled')
+            self.assertIsInstance(cancelled, TimerRef)
+            self.assertEqual(len(scheduler), 6)
+            self.assertTrue(await cancel(cancelled))
+            self.assertFalse(await cancel(cancelled))
+            await asyncio.sleep(0.6)
+            self.assertEqual([value for value, delay, called in calls], [0, 1, 2, 3, 4])
+            for value, delay, called in calls:
+                self.assertGreaterEqual(called, started + delay)
+                self.assertLess(called, started + delay + 0.1)
+            self.assertEqual(len(scheduler), 0)
+            scheduler.stop()
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_003_handover(self):
+        """Test sending pending timers to other workers"""
+        async def _test_():
+            """Async test body"""
+            calls = []
+
+            @atask(name='handed over', namespace='scheduler handover')
+            async def handed_over(value):
+                """Atask remembering calls"""
+                calls.append(value)
+
+            PickleCodec('scheduler handover')
+            router = get_router('scheduler handover')
+            await router.activate(LoopbackTransport('scheduler handover'))
+            scheduler = get_scheduler('scheduler handover')
+            timer = await call_later(0.2, handed_over, 'later')
+            await cancel(await call_later(0.2, handed_over, 'cancelled'))
+            self.assertEqual(await scheduler.handover(), 1)
+            self.assertEqual(len(scheduler), 1)
+            self.assertIn(timer.id, scheduler._timers)
+            await asyncio.sleep(0.4)
+            self.assertEqual(calls, ['later'])
+            scheduler.stop()
+            await router.deactivate()
+
+        asyncio.get_event_loop().run_until_complete(_test_())
+
+    def test_004_idle_wheel(self):
+        """Test moving the empty wheel to the current tick at once"""
+        wheel = TimerWheel()
+        started = time.perf_counter()
+        self.assertEqual(wheel.advance(10 ** 9), [])
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertEqual(wheel.tick, 10 ** 9)
+        wheel.add(_Timer('late', 10 ** 9 + 300, None, 'atask', (), {}))
+        wheel.add(_Timer('early', 10 ** 9 + 2, None, 'atask', (), {}))
+        self.assertEqual([timer.id for timer in wheel.advance(10 ** 9 + 2)], ['early'])
+        self.assertEqual([timer.id for timer in wheel.advance(10 ** 12)], ['late'])
+        self.assertEqual((len(wheel), wheel.tick), (0, 10 ** 12))
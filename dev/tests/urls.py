@@ -1,10 +1,11 @@
 """
 URL Configuration
 """
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^atasks/', include('django_atasks.urls')),
 ]
@@ -0,0 +1,131 @@
+"""
+Django ORM integration for atasks
+
+Atasks using the Django ORM call synchronous code in the pool of database threads:
+
+    from django_atasks.db import database_sync_to_async
+
+    @atask
+    @database_sync_to_async
+    def active_users():
+        return list(User.objects.filter(is_active=True))
+
+Every database thread keeps its own persistent connections according to the
+`CONN_MAX_AGE` database setting. Connections which are obsolete or unusable
+are closed before and after every call, as Django does for every HTTP request.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+class DatabaseExecutor(object):
+    """
+    Pool of threads calling synchronous code using the database
+    """
+    def __init__(self, max_workers=None, health_checks=False):
+        """
+        Constructor
+
+        :param max_workers: number of database threads, the `ATASKS_DB_THREADS` setting or 4 by default
+        :type max_workers: int
+        :param health_checks: check whether persistent connections are usable before every call
+        :type health_checks: bool
+        """
+        self.max_workers = max_workers or getattr(settings, 'ATASKS_DB_THREADS', 4)
+        self.health_checks = health_checks
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='atasks-db',
+        )
+
+    async def run(self, func, *argv, **kwargs):
+        """
+        Call the function in the database thread
+
+        :param func: synchronous function to be called
+        :type func: callable
+        :param argv: positional parameters of the function
+        :param kwargs: named parameters of the function
+        :returns: result of the function
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, functools.partial(self._call, func, argv, kwargs),
+        )
+
+    def shutdown(self, wait=True):
+        """
+        Stop database threads
+
+        :param wait: wait until calls in progress are finished
+        :type wait: bool
+        """
+        self._executor.shutdown(wait=wait)
+
+    def _call(self, func, argv, kwargs):
+        """Call the function closing obsolete connections before and after the call"""
+        self._close_old_connections()
+        try:
+            return func(*argv, **kwargs)
+        finally:
+            self._close_old_connections()
+
+    def _close_old_connections(self):
+        """Close connections of the thread which are obsolete or unusable"""
+        close_old_connections()
+        if not self.health_checks:
+            return
+        for connection in connections.all():
+            if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+                logger.warning('Closing unusable connection to %s', connection.alias)
+                connection.close()
+
+
+def get_executor():
+    """
+    Get or create the default database executor
+
+    :returns: the database executor shared by atasks of the process
+    :rtype: DatabaseExecutor
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = DatabaseExecutor(health_checks=getattr(settings, 'ATASKS_DB_HEALTH_CHECKS', False))
+        return _executor
+
+
+def shutdown_executor():
+    """Stop threads of the default database executor if it has been created"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def database_sync_to_async(func):
+    """
+    Decorator making a coroutine function calling the synchronous function in the database thread
+
+    :param func: synchronous function using the database
+    :type func: callable
+    :returns: coroutine function
+    :rtype: callable
+    """
+    @functools.wraps(func)
+    async def wrapper(*argv, **kwargs):
+        return await get_executor().run(func, *argv, **kwargs)
+
+    return wrapper
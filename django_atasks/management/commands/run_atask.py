@@ -2,14 +2,14 @@
 Script to start atasks file in server mode
 """
 import asyncio
-import importlib
+import functools
 import logging
 import os
 import signal
 import sys
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 logger = logging.getLogger(__name__)
@@ -62,12 +62,197 @@ class Command(BaseCommand):
 
         parser.add_argument(
             '-T', '--transport',
-            choices=['loopback', 'amqp'],
+            choices=['loopback', 'amqp', 'threads', 'processes', 'sockets'],
             dest='transport',
             default='loopback',
             help='Transport to be used',
         )
 
+        parser.add_argument(
+            '-W', '--workers',
+            type=int,
+            dest='workers',
+            help='Number of workers started by the transport if applicable, default is CPU count',
+        )
+
+        parser.add_argument(
+            '--balance',
+            choices=['round-robin', 'least-loaded', 'p2c'],
+            dest='balance',
+            default='round-robin',
+            help='Policy distributing requests among workers of the sockets transport',
+        )
+
+        parser.add_argument(
+            '-C', '--concurrency',
+            type=int,
+            dest='concurrency',
+            default=0,
+            help='Number of worker processes started by the server using amqp or sockets transport, '
+                 'default is 0 running the server in the command process',
+        )
+
+        parser.add_argument(
+            '--max-requests',
+            type=int,
+            dest='max_requests',
+            default=0,
+            help='Number of requests processed by the server before it is restarted, default is unlimited',
+        )
+
+        parser.add_argument(
+            '--grace',
+            type=float,
+            dest='grace',
+            default=30.0,
+            help='Time in seconds given to the stopping server to finish requests being processed, default is 30',
+        )
+
+        parser.add_argument(
+            '--monitor',
+            type=float,
+            dest='monitor',
+            help='Monitor the event loop lag, logging stalls longer than the number of seconds with atasks and stacks',
+        )
+
+        parser.add_argument(
+            '--introspect',
+            dest='introspect',
+            help='Serve JSON snapshots of requests in flight over HTTP on the [host:]port, '
+                 'worker processes of the server use subsequent ports',
+        )
+
+        parser.add_argument(
+            '--profile',
+            dest='profile',
+            help='Profile atasks processed by this process, and write statistics '
+                 'to the subdirectory of the directory named after the process id on exit',
+        )
+
+        parser.add_argument(
+            '--profile-rate',
+            type=float,
+            dest='profile_rate',
+            default=1.0,
+            help='Fraction of atask calls to be profiled',
+        )
+
+        parser.add_argument(
+            '--profile-interval',
+            type=float,
+            dest='profile_interval',
+            help='Interval in seconds of sampling stacks of atasks written as folded stacks, no sampling by default',
+        )
+
+        parser.add_argument(
+            '--profile-memory',
+            action='store_true',
+            dest='profile_memory',
+            help='Measure memory allocated by atasks',
+        )
+
+        parser.add_argument(
+            '--record',
+            dest='record',
+            help='Record the trace of requests sent and received by this process, and write it '
+                 'to the file of the directory named after the process id on exit',
+        )
+
+        parser.add_argument(
+            '--record-anonymize',
+            action='store_true',
+            dest='record_anonymize',
+            help='Replace names of atasks in the recorded trace by their hashes',
+        )
+
+        parser.add_argument(
+            '--replay',
+            nargs='*',
+            dest='replay',
+            help='Trace file(s) to be replayed; the server serves synthetic atasks of the trace, '
+                 'the client sends top-level calls of the trace after scenarios and prints results',
+        )
+
+        parser.add_argument(
+            '--replay-speed',
+            type=float,
+            dest='replay_speed',
+            default=1.0,
+            help='Replay the trace the number of times faster than recorded',
+        )
+
+        parser.add_argument(
+            '--manifest',
+            dest='manifest',
+            help='Manifest file of atasks; the server registers atasks from the existing manifest '
+                 'and loads modules on the first request, the manifest is written after loading modules otherwise',
+        )
+
+        parser.add_argument(
+            '--prewarm',
+            action='store_true',
+            dest='prewarm',
+            help='Load modules of atasks registered from the manifest in background',
+        )
+
+        parser.add_argument(
+            '--bench',
+            action='store_true',
+            dest='bench',
+            help='Run benchmarks instead of scenarios, BENCHMARKS list of scenario modules is measured as well',
+        )
+
+        parser.add_argument(
+            '--bench-transports',
+            nargs='*',
+            dest='bench_transports',
+            help='Transports to be measured, default is all transports needing no external broker',
+        )
+
+        parser.add_argument(
+            '--bench-sizes',
+            nargs='*',
+            type=int,
+            dest='bench_sizes',
+            help='Payload sizes in bytes to be measured, default is from 10 bytes to 100 megabytes',
+        )
+
+        parser.add_argument(
+            '--bench-iterations',
+            type=int,
+            dest='bench_iterations',
+            default=20,
+            help='Number of calls measured for every workload',
+        )
+
+        parser.add_argument(
+            '--bench-concurrency',
+            type=int,
+            dest='bench_concurrency',
+            default=1,
+            help='Number of concurrent callers',
+        )
+
+        parser.add_argument(
+            '--bench-output',
+            dest='bench_output',
+            help='File to write results to as JSON',
+        )
+
+        parser.add_argument(
+            '--bench-baseline',
+            dest='bench_baseline',
+            help='File with baseline results to compare with, the command fails on regressions',
+        )
+
+        parser.add_argument(
+            '--bench-tolerance',
+            type=float,
+            dest='bench_tolerance',
+            default=0.2,
+            help='Relative change of throughput and latency tolerated comparing with the baseline',
+        )
+
     def handle(self, *args, **options):
         """Command handler."""
 
@@ -92,15 +277,64 @@ class Command(BaseCommand):
 
         logging.config.dictConfig(LOGGING)
 
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(aiomain(**options))
+        if options['bench']:
+            asyncio.get_event_loop().run_until_complete(aiobench(self, **options))
+        elif options['mode'] == 'server' and options['concurrency'] and options['transport'] in SUPERVISED_TRANSPORTS:
+            supervise(**options)
+        else:
+            asyncio.get_event_loop().run_until_complete(aiomain(**options))
+
+
+SUPERVISED_TRANSPORTS = ('amqp', 'sockets')
+
+
+def supervise(**options):
+    """Start the number of server worker processes sharing modules loaded before"""
+    from atasks.loader import load_module
+    from atasks.manifest import build_manifest, write_manifest
+    from atasks.supervisor import Supervisor
+
+    if options['transport'] == 'sockets' and (options['url'] or '').startswith('unix:'):
+        raise CommandError('Unix socket can not be shared among worker processes, use --concurrency 0')
+    if not (options['manifest'] and os.path.exists(options['manifest'])):
+        for filename in options['scenario']:
+            load_module(filename)
+        if options['manifest']:
+            write_manifest(options['manifest'], build_manifest(options['scenario']))
+    Supervisor(
+        functools.partial(serve, options),
+        concurrency=options['concurrency'],
+        stop_timeout=options['grace'] + 5,
+    ).run()
+
+
+def serve(options, index):
+    """Server worker process body"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(aiomain(worker=index, **options))
+    finally:
+        loop.close()
 
 
 async def aiomain(**options):
     """The non-task main function calls tasks from atasks worker, not self process"""
     from atasks.transport.base import LoopbackTransport
     from atasks.transport.backends.amqp import AMQPTransport
+    from atasks.transport.backends.processes import ProcessPoolTransport
+    from atasks.transport.backends.sockets import SocketTransport
+    from atasks.transport.backends.threads import ThreadPoolTransport
+    from atasks.bench.replay import Replay, Trace
+    from atasks.introspect import start_server
+    from atasks.loader import load_module
+    from atasks.manifest import build_manifest, prewarm, read_manifest, register_manifest, write_manifest
+    from atasks.monitor import LoopMonitor
+    from atasks.profiler import Profiler
     from atasks.router import get_router
+    from atasks.scheduler import get_scheduler
+    from atasks.supervisor import retire
+    from atasks.trace import Recorder
     from atasks.codecs import PickleCodec
 
     PickleCodec()
@@ -109,49 +343,190 @@ async def aiomain(**options):
         kw = {
             'url': options['url']
         }
+    if options['transport'] in ('threads',):
+        kw = {
+            'workers': options['workers']
+        }
+    if options['transport'] in ('processes',):
+        kw = {
+            'workers': options['workers'],
+            'modules': options['scenario'],
+        }
+    if options['transport'] in ('sockets',) and options['url']:
+        kw = {
+            'workers': [options['url']] if options['mode'] == 'client' else None,
+            'listen': options['url'],
+            'reuse_port': options['mode'] == 'server' and bool(options.get('concurrency', 0)),
+            'balance': options.get('balance', None) or 'round-robin',
+        }
     transport = {
         'loopback': LoopbackTransport,
-        'amqp': AMQPTransport
+        'amqp': AMQPTransport,
+        'threads': ThreadPoolTransport,
+        'processes': ProcessPoolTransport,
+        'sockets': SocketTransport,
     }[options['transport']](**kw)
+    monitor = None
+    if options.get('monitor', None):
+        monitor = LoopMonitor(threshold=options['monitor'])
+        monitor.start()
+
+    introspection = None
+    if options.get('introspect', None):
+        host, sep, port = options['introspect'].rpartition(':')
+        worker = options.get('worker', None)
+        introspection = await start_server(
+            host or '127.0.0.1', int(port) + (worker or 0), monitor=monitor, reuse_port=worker is not None,
+        )
+
     await transport.connect()
+    manifest = None
+    if options['manifest'] and options['mode'] == 'server' and os.path.exists(options['manifest']):
+        manifest = read_manifest(options['manifest'])
+        register_manifest(manifest)
     router = get_router()
+    scheduler = None
     if options['mode'] in ('server', 'loopback'):
+        scheduler = get_scheduler(router.namespace)
         await router.activate(transport)
 
-    futures = []
-    for filename in options['scenario']:
-        if os.path.exists(filename) and os.path.isfile(filename):
-            name = os.path.basename(filename).rsplit('.', 1)[0]
-            spec = importlib.util.spec_from_file_location(name, filename)
-            module = importlib.util.module_from_spec(spec)
-            sys.modules[name] = module
-            spec.loader.exec_module(module)
-        else:
-            module = importlib.import_module(filename)
+    profiler = None
+    if options.get('profile', None):
+        profiler = Profiler(
+            sample_rate=options['profile_rate'],
+            memory=options['profile_memory'],
+            interval=options['profile_interval'],
+        )
+        profiler.enable(router.namespace)
+
+    recorder = None
+    if options.get('record', None):
+        recorder = Recorder(anonymize=options['record_anonymize'])
+        recorder.enable(router.namespace)
 
-        if hasattr(module, 'aiomain'):
-            futures.append(module.aiomain(**options))
+    replay = None
+    if options.get('replay', None):
+        replay = Replay(Trace.load(*options['replay']), router.namespace, speed=options['replay_speed'])
+        replay.register()
+
+    futures = []
+    if manifest is not None:
+        if options['prewarm']:
+            asyncio.ensure_future(prewarm(manifest))
+    else:
+        for filename in options['scenario']:
+            module = load_module(filename)
+            if hasattr(module, 'aiomain'):
+                futures.append(module.aiomain(**options))
+        if options['manifest']:
+            write_manifest(options['manifest'], build_manifest(options['scenario']))
 
     if futures:
         await asyncio.gather(*futures)
 
+    if replay is not None and options['mode'] != 'server':
+        results = await replay.run()
+        sys.stdout.write(
+            'Replayed %(calls)s calls with %(errors)s errors in %(elapsed).3fs: %(throughput).1f calls/s, '
+            'p50 %(p50).6fs, p95 %(p95).6fs, p99 %(p99).6fs\n' % results
+        )
+
     if options['mode'] == 'server':
         logger.info("Listening for requests")
-        for s in set([
-            signal.SIGINT,
-            signal.SIGQUIT,
-            signal.SIGTERM,
-        ]):
-            signal.signal(s, sig_handler)
+        loop = asyncio.get_event_loop()
+        stopping = loop.create_future()
+        signals = [
+            s for s in (signal.SIGINT, signal.SIGQUIT, signal.SIGTERM)
+            if signal.getsignal(s) != signal.SIG_IGN
+        ]
+        for s in signals:
+            loop.add_signal_handler(s, sig_handler, s, stopping)
 
-        while not Command.exit_run:
-            await asyncio.sleep(1)
+        waiting = [stopping]
+        max_requests = options.get('max_requests', 0)
+        if max_requests:
+            waiting.append(router.wait_requests(max_requests))
+        await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        if not stopping.done():
+            logger.info("%s requests received, restarting", router.requests)
+            retire()
 
+        grace = options.get('grace', None)
+        if not await router.drain(grace):
+            logger.warning("%s requests not finished in %ss, stopping anyway", router.active, grace)
+        if options['transport'] in SUPERVISED_TRANSPORTS:
+            await scheduler.handover(grace)
+        await transport.disconnect()
+        for s in signals:
+            loop.remove_signal_handler(s)
         logger.info("Execution stopped")
 
+    if scheduler is not None:
+        scheduler.stop()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump(os.path.join(options['profile'], str(os.getpid())))
+
+    if recorder is not None:
+        recorder.disable()
+        os.makedirs(options['record'], exist_ok=True)
+        recorder.dump(os.path.join(options['record'], '%s.trace.gz' % os.getpid()))
+
+    if introspection is not None:
+        introspection.close()
+        await introspection.wait_closed()
+
+    if monitor is not None:
+        await monitor.stop()
+        snapshot = monitor.snapshot()
+        logger.info("Loop lag histogram: %s, max lag %.3fs, %s stalls", snapshot['histogram'], snapshot['max_lag'], len(snapshot['stalls']))
+
+    db = sys.modules.get('django_atasks.db', None)
+    if db is not None:
+        # the database executor may exist only if atasks have used the database
+        db.shutdown_executor()
+
+
+async def aiobench(command, **options):
+    """The benchmark main function"""
+    from atasks.bench import runner
+    from atasks.loader import load_module
+
+    scenarios = []
+    for filename in options['scenario']:
+        scenarios += getattr(load_module(filename), 'BENCHMARKS', [])
+
+    kw = {}
+    if options['bench_sizes']:
+        kw['sizes'] = options['bench_sizes']
+    benchmark = runner.Benchmark(
+        transports=options['bench_transports'] or runner.DEFAULT_TRANSPORTS,
+        iterations=options['bench_iterations'],
+        concurrency=options['bench_concurrency'],
+        scenarios=scenarios,
+        modules=options['scenario'],
+        url=options['url'],
+        workers=options['workers'],
+        **kw
+    )
+    results = await benchmark.run()
+    for line in runner.format_results(results):
+        command.stdout.write(line)
+    if options['bench_output']:
+        runner.write_results(options['bench_output'], results)
+    if options['bench_baseline']:
+        regressions = runner.compare(results, runner.read_results(options['bench_baseline']), options['bench_tolerance'])
+        for regression in regressions:
+            command.stderr.write('Regression of %(metric)s for %(key)s: %(baseline)s -> %(current)s' % regression)
+        if regressions:
+            raise CommandError('%s regressions found' % len(regressions))
+
 
-def sig_handler(sig_num, stack_frame):
-    """Signal handler"""
+def sig_handler(sig_num, stopping):
+    """Signal handler resolving the future awaited by the server"""
     signal_names = dict((s.value, s.name) for s in signal.Signals)
     logger.info("Signal %s[%s] cought, exiting...", signal_names.get(sig_num, 'UNKNOWN'), sig_num)
     Command.exit_run = True
+    if not stopping.done():
+        stopping.set_result(sig_num)
@@ -0,0 +1,11 @@
+"""
+URL Configuration of atasks views
+"""
+from django_atasks import views
+
+from django.conf.urls import url
+
+
+urlpatterns = [
+    url(r'^inflight/$', views.inflight, name='atasks-inflight'),
+]
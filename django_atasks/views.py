@@ -0,0 +1,24 @@
+"""
+Views of atasks state in the process serving Django
+"""
+from atasks import introspect
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+
+@staff_member_required
+def inflight(request):
+    """
+    Requests in flight of atask routers of this process as JSON
+
+    The `stack` query parameter limits await stacks, f.e. `?stack=0` skips them.
+    """
+    try:
+        limit = introspect.stack_limit(request.GET.get('stack', None))
+    except ValueError as ex:
+        return JsonResponse({'error': str(ex)}, status=400)
+    return JsonResponse(
+        introspect.snapshot(stack_limit=limit),
+        json_dumps_params={'indent': 2},
+    )
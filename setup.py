@@ -28,6 +28,7 @@ setup(
     version=version,
     packages=[
         'atasks',
+        'atasks.bench',
         'atasks.transport',
         'atasks.transport.backends',
         'django_atasks',